@@ -0,0 +1,176 @@
+"""エンドツーエンドの性能の回帰チェック
+
+docgen.pyで作成したドキュメントに、別のプロセスでフィルター(python -m pandoc_crossref_filter.main)を適用し、
+時間とピークのメモリ使用量(RSS)を計測する。
+PlantUML/Mermaidの図は、同じプロセスで起動したKrokiサーバーのモック(mock_kroki.py)で変換する。
+
+計測結果は基準値のJSON(デフォルトはbenchmarks/e2e_baseline.json)と比較し、
+時間またはメモリが閾値を超えて増えていれば、終了コード1で終了する。
+基準値のJSONが無い場合、または基準値に無いドキュメントを計測した場合も、比較できないので終了コード1で終了する。
+--updateを指定した場合は、計測結果を基準値として保存する。
+(基準値は計測したマシンに依存するので、同じマシンで計測した値と比較する)
+
+使い方:
+    PYTHONPATH=src python benchmarks/bench_e2e.py [--update] [--sections 50 500] [--latency 0.01]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from docgen import make_json
+from mock_kroki import MockKrokiServer
+
+
+# 環境変数の接頭辞(計測する変換に影響しないように、子プロセスでは削除する)
+ENV_PREFIX = "PANDOC_CROSSREF_FILTER_"
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "e2e_baseline.json")
+
+
+def run_once(input_path, work_dir, env):
+    """フィルターを1回実行する
+
+    Returns:
+        float: 時間(秒)
+        int: ピークのメモリ使用量(KiB)
+    """
+    output_path = os.path.join(work_dir, "output.json")
+    error_path = os.path.join(work_dir, "stderr.txt")
+    with open(input_path, "rb") as fin, open(output_path, "wb") as fout, \
+         open(error_path, "wb") as ferr:
+        start = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "pandoc_crossref_filter.main", "html"],
+            stdin=fin, stdout=fout, stderr=ferr, cwd=work_dir, env=env)
+        # 子プロセスごとのピークのRSSを取得するために、wait4()で待つ
+        _, status, rusage = os.wait4(proc.pid, 0)
+        seconds = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+
+    if proc.returncode != 0:
+        with open(error_path, encoding="utf-8", errors="replace") as f:
+            raise RuntimeError(f"The filter failed (exit code {proc.returncode}):\n{f.read()}")
+    # ru_maxrssの単位は、Linuxでは KiB、macOSでは バイト
+    peak_rss = rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+    return seconds, peak_rss
+
+
+def run_case(num_section, repeat, server_url):
+    """1つの大きさのドキュメントを、指定回数変換して計測する
+
+    Returns:
+        dict:
+            - seconds (float): 時間の中央値(秒)
+            - blocks_per_second (float): 1秒あたりに変換したトップレベルのブロックの数
+            - peak_rss_kib (int): ピークのメモリ使用量の最大値(KiB)
+    """
+    json_text = make_json(num_section)
+    num_block = len(json.loads(json_text)["blocks"])
+    env = {key: value for key, value in os.environ.items() if not key.startswith(ENV_PREFIX)}
+    env[ENV_PREFIX + "KROKI_URL"] = server_url
+    # 子プロセスは作業ディレクトリで実行するので、PYTHONPATHを絶対パスにする
+    if env.get("PYTHONPATH"):
+        env["PYTHONPATH"] = os.pathsep.join(
+            os.path.abspath(path) for path in env["PYTHONPATH"].split(os.pathsep))
+
+    list_seconds = []
+    list_rss = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        input_path = os.path.join(work_dir, "input.json")
+        with open(input_path, "w", encoding="utf-8") as f:
+            f.write(json_text)
+        for _ in range(repeat):
+            seconds, peak_rss = run_once(input_path, work_dir, env)
+            list_seconds.append(seconds)
+            list_rss.append(peak_rss)
+
+    seconds = statistics.median(list_seconds)
+    return {
+        "seconds": seconds,
+        "blocks_per_second": num_block / seconds,
+        "peak_rss_kib": max(list_rss)
+    }
+
+
+def compare(results, baseline, time_threshold, memory_threshold):
+    """計測結果を基準値と比較する
+
+    Returns:
+        list(str): 閾値を超えた項目と、基準値の無い項目の説明
+    """
+    list_regression = []
+    for name, result in results.items():
+        base = baseline.get("cases", {}).get(name)
+        if base is None:
+            list_regression.append(f"{name}: no baseline (run with --update to save it)")
+            continue
+        if result["seconds"] > base["seconds"] * (1 + time_threshold):
+            list_regression.append(
+                f"{name}: time {base['seconds']:.3f}s -> {result['seconds']:.3f}s "
+                f"(+{(result['seconds'] / base['seconds'] - 1) * 100:.0f}%)")
+        if result["peak_rss_kib"] > base["peak_rss_kib"] * (1 + memory_threshold):
+            list_regression.append(
+                f"{name}: peak RSS {base['peak_rss_kib']}KiB -> {result['peak_rss_kib']}KiB "
+                f"(+{(result['peak_rss_kib'] / base['peak_rss_kib'] - 1) * 100:.0f}%)")
+    return list_regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end performance regression gate")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON")
+    parser.add_argument("--update", action="store_true", help="save the results as the baseline")
+    parser.add_argument("--sections", type=int, nargs="+", default=[50, 500],
+                        help="number of sections of each generated document")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per document (median is used)")
+    parser.add_argument("--time-threshold", type=float, default=0.2,
+                        help="allowed increase of the time (0.2 = 20%%)")
+    parser.add_argument("--memory-threshold", type=float, default=0.1,
+                        help="allowed increase of the peak RSS (0.1 = 10%%)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds before each response of the mock Kroki server")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="ratio of 503 responses of the mock Kroki server")
+    args = parser.parse_args()
+    if not args.update and not os.path.exists(args.baseline):
+        # 基準値が無いまま成功にすると、回帰のチェックをしていないことに気付けない
+        print(f"No baseline: {args.baseline} (run with --update to save it)", file=sys.stderr)
+        sys.exit(1)
+
+    server = MockKrokiServer(latency=args.latency, error_rate=args.error_rate, seed=0).start()
+    try:
+        results = {}
+        for num_section in args.sections:
+            name = f"sections_{num_section}"
+            results[name] = run_case(num_section, args.repeat, server.url)
+            print(f"{name:16s}: {results[name]['seconds']:8.3f}s "
+                  f"{results[name]['blocks_per_second']:10.0f} blocks/s "
+                  f"{results[name]['peak_rss_kib'] / 1024:8.1f}MiB")
+        print(f"mock Kroki server: {server.num_request} requests, {server.num_error} errors")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    if args.update:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"cases": results}, f, indent=2)
+            f.write("\n")
+        print(f"Saved the baseline: {args.baseline}")
+        return
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    list_regression = compare(results, baseline, args.time_threshold, args.memory_threshold)
+    if list_regression:
+        print("Performance regression:")
+        for text in list_regression:
+            print(f"  {text}")
+        sys.exit(1)
+    print("No performance regression.")
+
+
+if __name__ == "__main__":
+    main()
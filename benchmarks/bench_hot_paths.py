@@ -0,0 +1,128 @@
+"""処理の多い箇所ごとのベンチマーク
+
+docgen.pyで作成したドキュメントを、基本の大きさ(デフォルト10セクション)の1倍、10倍、100倍にして、
+以下の処理ごとの時間とピークのメモリ使用量(tracemalloc)を計測する。
+
+- register_section: SectionCrossRef.register_section()
+- register_figure: FigureCrossRef.register_figure()
+- register_table: TableCrossRef.register_table()(表の整形を含む)
+- _format_table: TableCrossRef._format_table()(表の整形だけ)
+- register_code_block: CodeBlockRef.register_code_block()
+- replace_reference: 走査の後の、参照の上書き(resolve_references())
+- run_filter: JSONの読み込みから書き出しまで(画像の出力は含めない)
+
+各処理の準備(ドキュメントの読み込みと、対象の要素の収集)は計測に含めない。
+時間とメモリは別々に実行して計測する(tracemallocの負荷が時間に含まれないようにするため)。
+
+使い方:
+    PYTHONPATH=src python benchmarks/bench_hot_paths.py [基本のセクションの数] [倍率 ...]
+"""
+import sys
+import time
+import tracemalloc
+
+import panflute as pf
+
+from docgen import make_json
+from pandoc_crossref_filter import utils
+from pandoc_crossref_filter.pandoc_crossref_filter import action, prepare, resolve_references
+
+
+def load(json_text):
+    """ドキュメントを読み込んで、相互参照の管理クラスを初期化する"""
+    doc = utils.load_doc(json_text, "html")
+    prepare(doc)
+    return doc
+
+
+def collect(doc, elem_type):
+    """指定した型の要素を、走査の順番(子要素が先)に集める"""
+    list_elem = []
+
+    def collect_action(elem, doc):
+        if type(elem) is elem_type:
+            list_elem.append(elem)
+    doc.walk(collect_action)
+    return list_elem
+
+
+def setup_register(method_name, elem_type, cross_ref_name):
+    """要素を1つずつ登録する処理の準備"""
+    def setup(json_text):
+        doc = load(json_text)
+        method = getattr(getattr(doc, cross_ref_name), method_name)
+        list_elem = collect(doc, elem_type)
+
+        def run():
+            for elem in list_elem:
+                doc.diagnostics.current_elem = elem
+                method(elem)
+        return run
+    return setup
+
+
+def setup_replace_reference(json_text):
+    """参照の上書きの準備(ドキュメント全体を走査して、参照を登録しておく)"""
+    doc = load(json_text)
+    doc.walk(action)
+    return lambda: resolve_references(doc)
+
+
+def setup_run_filter(json_text):
+    """フィルター全体の準備"""
+    def run():
+        doc = utils.load_doc(json_text, "html")
+        pf.run_filter(action, prepare=prepare, finalize=resolve_references, doc=doc)
+        utils.dump_doc(doc)
+    return run
+
+
+# 処理の名前 -> 準備の関数(計測する関数を返す)
+BENCHMARKS = {
+    "register_section": setup_register("register_section", pf.Header, "section_cross_ref"),
+    "register_figure": setup_register("register_figure", pf.Figure, "figure_cross_ref"),
+    "register_table": setup_register("register_table", pf.Table, "table_cross_ref"),
+    "_format_table": setup_register("_format_table", pf.Table, "table_cross_ref"),
+    "register_code_block": setup_register("register_code_block", pf.CodeBlock, "code_block_ref"),
+    "replace_reference": setup_replace_reference,
+    "run_filter": setup_run_filter,
+}
+
+
+def measure(setup, json_text):
+    """時間と、ピークのメモリ使用量を計測する
+
+    Returns:
+        float: 時間(秒)
+        int: ピークのメモリ使用量(バイト)
+    """
+    run = setup(json_text)
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+
+    run = setup(json_text)
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main():
+    num_section = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    list_scale = [int(v) for v in sys.argv[2:]] or [1, 10, 100]
+    utils.get_logger().disabled = True
+
+    print(f"{'':20s}" + "".join(f"{f'x{scale}':>24s}" for scale in list_scale))
+    list_json = [make_json(num_section * scale) for scale in list_scale]
+    for name, setup in BENCHMARKS.items():
+        list_text = []
+        for json_text in list_json:
+            seconds, peak = measure(setup, json_text)
+            list_text.append(f"{seconds * 1000:10.1f}ms {peak / 1024 / 1024:8.2f}MiB")
+        print(f"{name:20s}" + "".join(f"{text:>24s}" for text in list_text))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""SoftBreakと<br>の改行への変換のベンチマーク
+
+文章の多いドキュメント(デフォルト2万段落)で、
+以前の方式(action()で要素ごとに[pf.LineBreak()]を返す)と、
+normalize_line_breaks()でまとめて置き換える方式の時間を比較する。
+
+使い方:
+    PYTHONPATH=src python benchmarks/bench_line_break.py [段落数]
+"""
+import sys
+import time
+
+import panflute as pf
+
+from pandoc_crossref_filter.line_break import normalize_line_breaks
+
+
+def make_doc(num_para):
+    """SoftBreakと<br>を含む段落を、指定数含むドキュメントを作成する"""
+    list_block = []
+    for i in range(num_para):
+        list_inline = []
+        for j in range(8):
+            list_inline += [pf.Str(f"word{i}-{j}"), pf.Space, pf.Str("text"), pf.SoftBreak]
+        list_inline += [pf.Str("end"), pf.RawInline("<br>", format="html"), pf.Str("tail")]
+        list_block.append(pf.Para(*list_inline))
+    return pf.Doc(*list_block)
+
+
+def legacy_action(elem, doc):
+    """以前の方式"""
+    if isinstance(elem, pf.SoftBreak):
+        return [pf.LineBreak()]
+    elif (isinstance(elem, pf.RawInline)
+          and elem.text == "<br>"
+          and elem.format == "html"):
+        return [pf.LineBreak()]
+
+
+def noop_action(elem, doc):
+    """その他の処理(フィルター本体のwalk)の代わり"""
+    return None
+
+
+def main():
+    num_para = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    doc = make_doc(num_para)
+    start = time.perf_counter()
+    doc.walk(legacy_action)
+    legacy = time.perf_counter() - start
+
+    doc = make_doc(num_para)
+    start = time.perf_counter()
+    normalize_line_breaks(doc)
+    normalize = time.perf_counter() - start
+    doc.walk(noop_action)
+    total = time.perf_counter() - start
+
+    print(f"{num_para} paragraphs")
+    print(f"per-element callback (walk)        : {legacy:.3f}s")
+    print(f"normalize_line_breaks              : {normalize:.3f}s")
+    print(f"normalize_line_breaks + no-op walk : {total:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
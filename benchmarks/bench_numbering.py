@@ -0,0 +1,89 @@
+"""番号付けのベンチマーク
+
+図番号を付ける要素を指定数(デフォルト5万)含むドキュメントで、
+以前の方式(呼び出しごとにセクション番号をスライスして文字列のキーを作る)と、
+NumberingEngine(セクション番号が変わったときだけキーと接頭辞を作る)の時間を比較する。
+また、フィルター全体(prepare + action)で番号付けにかかる時間も計測する。
+
+使い方:
+    PYTHONPATH=src python benchmarks/bench_numbering.py [要素数]
+"""
+import sys
+import time
+
+import panflute as pf
+
+from pandoc_crossref_filter import utils
+from pandoc_crossref_filter.numbering import NumberingEngine
+from pandoc_crossref_filter.pandoc_crossref_filter import prepare, action
+
+# 1つのセクションあたりの要素数
+ITEMS_PER_SECTION = 20
+
+
+def legacy_numbering(list_section_numbers, count_level, delimiter):
+    """以前の方式"""
+    dict_increment = {}
+    for section_numbers in list_section_numbers:
+        if count_level >= 0 and len(section_numbers) > count_level:
+            section_numbers = section_numbers[:count_level]
+        start_number = delimiter.join(map(str, section_numbers))
+        if start_number not in dict_increment:
+            dict_increment[start_number] = 0
+        dict_increment[start_number] += 1
+        if start_number != "":
+            number = start_number + delimiter + str(dict_increment[start_number])
+        else:
+            number = str(dict_increment[start_number])
+    return number
+
+
+def engine_numbering(list_section_numbers, count_level, delimiter):
+    """NumberingEngine"""
+    numbering = NumberingEngine()
+    counter = numbering.add_counter(count_level, delimiter)
+    for section_numbers in list_section_numbers:
+        numbering.set_section_numbers(section_numbers)
+        number = counter.next_number()
+    return number
+
+
+def make_doc(num_item):
+    """図を指定数含むドキュメントを作成する"""
+    list_block = []
+    for i in range(num_item):
+        if i % ITEMS_PER_SECTION == 0:
+            list_block.append(pf.Header(pf.Str(f"S{i}"), level=2 if i % 100 else 1))
+        list_block.append(pf.Para(pf.Image(pf.Str(f"F{i}"), url="a.png", identifier=f"fig:{i}")))
+    metadata = {"pandoc_crossref_filter": {"figure": {"figure_number_count_level": 2}}}
+    return pf.Doc(*list_block, metadata=metadata, format="html")
+
+
+def measure(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    num_item = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+    # 番号付けだけの比較(呼び出しごとのセクション番号は、以前の方式と同じリストを渡す)
+    list_section_numbers = [
+        [i // 100 + 1, (i // ITEMS_PER_SECTION) % 5 + 1, 1] for i in range(num_item)]
+    for count_level in (0, 2, -1):
+        legacy = measure(legacy_numbering, list_section_numbers, count_level, "-")
+        engine = measure(engine_numbering, list_section_numbers, count_level, "-")
+        print(f"count_level={count_level:2d}: legacy {legacy:.3f}s, engine {engine:.3f}s")
+
+    # フィルター全体
+    doc = make_doc(num_item)
+    utils.get_logger().disabled = True
+    start = time.perf_counter()
+    prepare(doc)
+    doc.walk(action)
+    print(f"filter (prepare + action) on {num_item} figures: {time.perf_counter() - start:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
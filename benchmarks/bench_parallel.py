@@ -0,0 +1,77 @@
+"""チャンクの並列変換のベンチマーク
+
+セル結合を含む表の多いドキュメント(デフォルト1000章)で、
+通常の変換と、parallel.convert_json_parallel()でワーカープロセスの数を変えた場合の時間を比較する。
+(どちらも変換結果が同じであることを確認する)
+
+使い方:
+    PYTHONPATH=src python benchmarks/bench_parallel.py [章の数] [ワーカープロセスの数 ...]
+"""
+import sys
+import json
+import time
+
+import panflute as pf
+
+from pandoc_crossref_filter import utils
+from pandoc_crossref_filter.pandoc_crossref_filter import action, prepare, finalize
+from pandoc_crossref_filter.parallel import convert_json_parallel
+
+
+def cite(key):
+    return pf.Cite(pf.Str("@" + key), citations=[pf.Citation(key)])
+
+
+def make_table(identifier, num_row):
+    """セル結合の目印を含む表を作成する"""
+    list_row = []
+    for k in range(num_row):
+        marker = "〃" if k % 3 else f"a{k}"
+        list_row.append(pf.TableRow(
+            pf.TableCell(pf.Plain(pf.Str(marker))),
+            pf.TableCell(pf.Plain(pf.Str(f"b{k}"))),
+            pf.TableCell(pf.Plain(pf.Str("->")))))
+    return pf.Table(
+        pf.TableBody(*list_row),
+        caption=pf.Caption(pf.Plain(pf.Str("Table"), pf.Space, pf.Str(f"{{#tbl:{identifier}}}"))))
+
+
+def make_json(num_chapter):
+    """章ごとに、セクション、表、本文と、前後の章への参照を含むドキュメントのJSONを作成する"""
+    list_block = []
+    for i in range(num_chapter):
+        list_block.append(pf.Header(pf.Str(f"Chapter{i}"), level=1, identifier=f"sec:c{i}"))
+        for j in range(10):
+            list_block.append(pf.Para(
+                pf.Str(f"text{i}-{j}"), pf.Space, cite(f"tbl:t{i}"), pf.Space,
+                cite(f"sec:c{(i + 1) % num_chapter}"), pf.SoftBreak, pf.Str("end")))
+        list_block.append(make_table(f"t{i}", 30))
+    return json.dumps(pf.Doc(*list_block).to_json())
+
+
+def run_normal(json_text):
+    doc = utils.load_doc(json_text, "html")
+    pf.run_filter(action, prepare=prepare, finalize=finalize, doc=doc)
+    return utils.dump_doc(doc)
+
+
+def main():
+    num_chapter = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    list_jobs = [int(v) for v in sys.argv[2:]] or [1, 2, 4, 8]
+    json_text = make_json(num_chapter)
+
+    start = time.perf_counter()
+    expected = json.loads(run_normal(json_text))
+    normal = time.perf_counter() - start
+    print(f"normal : {normal:.3f}s")
+
+    for jobs in list_jobs:
+        start = time.perf_counter()
+        output, _ = convert_json_parallel(json_text, "html", jobs)
+        seconds = time.perf_counter() - start
+        print(f"jobs={jobs:<2}: {seconds:.3f}s (x{normal / seconds:.2f}), "
+              f"same output: {json.loads(output) == expected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""参照の登録先のメモリ使用量のベンチマーク
+
+以前の構成(種類ごとの references / references_title の辞書と、引用ごとの辞書)と、
+ReferenceRegistry(__slots__のレコード)のメモリ使用量を比較する。
+
+使い方:
+    PYTHONPATH=src python benchmarks/bench_registry_memory.py [引用数]
+"""
+import sys
+import tracemalloc
+
+from pandoc_crossref_filter.registry import ReferenceRegistry, PendingRef
+
+
+def build_legacy(num_ref, num_cite):
+    """以前の構成"""
+    references = {}
+    references_title = {}
+    for i in range(num_ref):
+        references[f"fig:{i}"] = f"1-{i}"
+        references_title[f"fig:{i}"] = f"title {i}"
+    list_replace_target = []
+    for i in range(num_cite):
+        list_replace_target.append({
+            "key": f"fig:{i % num_ref}",
+            "target": None,
+            "is_header": False,
+            "add_title": False
+        })
+    return references, references_title, list_replace_target
+
+
+def build_registry(num_ref, num_cite):
+    """ReferenceRegistryの構成"""
+    registry = ReferenceRegistry()
+    for i in range(num_ref):
+        registry.add(f"fig:{i}", f"1-{i}", f"title {i}")
+    list_replace_target = []
+    for i in range(num_cite):
+        list_replace_target.append(
+            PendingRef(f"fig:{i % num_ref}", None, False, False))
+    return registry, list_replace_target
+
+
+def measure(func, *args):
+    """関数の戻り値が保持しているメモリ量を計測する"""
+    tracemalloc.start()
+    ret = func(*args)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del ret
+    return current
+
+
+def main():
+    num_cite = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    num_ref = max(1, num_cite // 10)
+    # 書き換え対象のpf.Strは両方の構成で同じなので、計測ではNoneにする
+    legacy = measure(build_legacy, num_ref, num_cite)
+    registry = measure(build_registry, num_ref, num_cite)
+    print(f"references: {num_ref}, citations: {num_cite}")
+    print(f"legacy   : {legacy / 1024 / 1024:8.2f} MiB")
+    print(f"registry : {registry / 1024 / 1024:8.2f} MiB "
+          f"({(1 - registry / legacy) * 100:.0f}% less)")
+
+
+if __name__ == "__main__":
+    main()
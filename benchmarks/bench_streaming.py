@@ -0,0 +1,87 @@
+"""ストリーミング変換のメモリ使用量のベンチマーク
+
+セクション、図への参照、表を含むドキュメント(デフォルト2000章)で、
+ドキュメント全体を読み込んでからフィルターを適用する方式と、
+streaming.run_streaming()でブロックごとに変換する方式の、時間とピークのメモリ使用量を比較する。
+(どちらも変換結果が同じであることを確認する)
+
+使い方:
+    PYTHONPATH=src python benchmarks/bench_streaming.py [章の数]
+"""
+import io
+import sys
+import json
+import time
+import tracemalloc
+
+import panflute as pf
+
+from pandoc_crossref_filter import utils
+from pandoc_crossref_filter.pandoc_crossref_filter import action, prepare, finalize
+from pandoc_crossref_filter.streaming import run_streaming
+
+
+def cite(key):
+    return pf.Cite(pf.Str("@" + key), citations=[pf.Citation(key)])
+
+
+def make_json(num_chapter):
+    """章ごとに、セクション、図、表と、前後の章への参照を含むドキュメントのJSONを作成する"""
+    list_block = []
+    for i in range(num_chapter):
+        list_block.append(pf.Header(pf.Str(f"Chapter{i}"), level=1, identifier=f"sec:c{i}"))
+        for j in range(5):
+            list_block.append(pf.Para(
+                pf.Str(f"text{i}-{j}"), pf.Space, cite(f"fig:f{i}"), pf.Space,
+                cite(f"sec:c{(i + 1) % num_chapter}"), pf.SoftBreak, pf.Str("end")))
+        list_block.append(pf.Figure(
+            pf.Plain(pf.Image(pf.Str("image"), url=f"image{i}.png")),
+            caption=pf.Caption(pf.Plain(pf.Str(f"Figure{i}"))),
+            identifier=f"fig:f{i}"))
+        list_block.append(pf.Table(
+            pf.TableBody(*[pf.TableRow(pf.TableCell(pf.Plain(pf.Str(f"a{k}"))),
+                                       pf.TableCell(pf.Plain(pf.Str(f"b{k}"))))
+                           for k in range(10)]),
+            caption=pf.Caption(pf.Plain(pf.Str(f"Table{i}"), pf.Space, pf.Str(f"{{#tbl:t{i}}}")))))
+    return json.dumps(pf.Doc(*list_block).to_json())
+
+
+def run_normal(json_text):
+    """ドキュメント全体を読み込んでから変換する"""
+    doc = utils.load_doc(json_text, "html")
+    pf.run_filter(action, prepare=prepare, finalize=finalize, doc=doc)
+    return utils.dump_doc(doc)
+
+
+def run_stream(json_text):
+    """ブロックごとに変換する"""
+    output = io.StringIO()
+    run_streaming(io.StringIO(json_text), output, "html")
+    return output.getvalue()
+
+
+def measure(func, json_text):
+    """時間とピークのメモリ使用量(入力と出力の文字列を除く)を計測する"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    output = func(json_text)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return output, seconds, peak - sys.getsizeof(output)
+
+
+def main():
+    num_chapter = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    json_text = make_json(num_chapter)
+    print(f"input: {len(json_text) / 1024 / 1024:.1f} MB")
+
+    output_normal, seconds, peak = measure(run_normal, json_text)
+    print(f"normal   : {seconds:.3f}s, peak {peak / 1024 / 1024:.1f} MB")
+    output_stream, seconds, peak = measure(run_stream, json_text)
+    print(f"streaming: {seconds:.3f}s, peak {peak / 1024 / 1024:.1f} MB")
+    print("same output:", json.loads(output_normal) == json.loads(output_stream))
+
+
+if __name__ == "__main__":
+    main()
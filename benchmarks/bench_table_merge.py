@@ -0,0 +1,69 @@
+"""表のセル結合のベンチマーク
+
+行数x列数(デフォルト10000x20)の表について、
+以前の方式(すべてのセルをpf.stringify()して結合の目印を探す)と、
+現在のTableCrossRef._format_table()の時間を比較する。
+
+使い方:
+    PYTHONPATH=src python benchmarks/bench_table_merge.py [行数] [列数]
+"""
+import sys
+import time
+
+import panflute as pf
+
+from pandoc_crossref_filter.table_cross_ref import TableCrossRef
+
+
+def make_table(num_row, num_column, marker_interval):
+    """表を作成する
+
+    Args:
+        marker_interval (int): 結合の目印("〃")を入れる行の間隔。0なら目印なし
+    """
+    def cell(text):
+        return pf.TableCell(pf.Plain(pf.Str(text)))
+
+    list_row = []
+    for irow in range(num_row):
+        list_cell = [cell(f"v{irow}-{icol}") for icol in range(num_column)]
+        if marker_interval and irow % marker_interval == marker_interval - 1:
+            list_cell[1] = cell("〃")
+        list_row.append(pf.TableRow(*list_cell))
+    head = pf.TableHead(pf.TableRow(*[cell(f"C{icol}") for icol in range(num_column)]))
+    return pf.Table(pf.TableBody(*list_row), head=head)
+
+
+def legacy_format_table(elem):
+    """以前の方式(目印の検出部分)"""
+    for part in [elem.head] + list(elem.content):
+        for row in part.content:
+            for cell in row.content:
+                cell_text = pf.stringify(cell.content)
+                if cell_text == "->" or cell_text == "〃":
+                    pass
+
+
+def measure(func, elem):
+    start = time.perf_counter()
+    func(elem)
+    return time.perf_counter() - start
+
+
+def main():
+    num_row = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    num_column = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    table_cross_ref = TableCrossRef({}, False)
+
+    for name, marker_interval in (("no markers", 0),
+                                  ("markers near the end", num_row),
+                                  ("markers every 100 rows", 100)):
+        legacy = measure(legacy_format_table, make_table(num_row, num_column, marker_interval))
+        current = measure(table_cross_ref._format_table,
+                          make_table(num_row, num_column, marker_interval))
+        print(f"{num_row}x{num_column} {name:24s}: "
+              f"legacy(scan only) {legacy:.3f}s, current {current:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
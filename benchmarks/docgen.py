@@ -0,0 +1,132 @@
+"""ベンチマーク用のドキュメントの生成
+
+セクション(入れ子)、図、キャプション付きの表(セル結合の目印とcolwidthの指定)、
+参照([@XXX])を含むコードブロック、PlantUML/Mermaidの図、引用を含む
+pandocのJSON(AST)を作成する。
+セクションごとに同じ構成を繰り返すので、セクションの数でドキュメントの大きさを変えられる。
+
+使い方:
+    PYTHONPATH=src python benchmarks/docgen.py [セクションの数] > doc.json
+"""
+import sys
+import json
+
+import panflute as pf
+
+
+# 1つのセクションあたりの要素の数(デフォルト)
+DEFAULT_OPTIONS = {
+    # ヘッダーの入れ子の深さ(セクションごとに、レベル1からこの深さまでを繰り返す)
+    "depth": 3,
+    # 図
+    "figures": 2,
+    # キャプション付きの表
+    "tables": 1,
+    # 表の行数
+    "table_rows": 20,
+    # 参照を含むコードブロック
+    "code_blocks": 1,
+    # PlantUML/Mermaidの図(交互に作成する)
+    "diagrams": 1,
+    # 本文の引用(セクション、図、表への参照。前方参照を含む)
+    "citations": 6,
+}
+
+
+def cite(key):
+    return pf.Cite(pf.Str(f"[@{key}]"), citations=[pf.Citation(key)])
+
+
+def make_table(identifier, num_row):
+    """セル結合の目印("〃"、"->")とcolwidthの指定を含む、3列の表を作成する"""
+    def cell(text):
+        return pf.TableCell(pf.Plain(pf.Str(text)))
+
+    list_row = []
+    for k in range(num_row):
+        marker = "〃" if k % 3 else f"a{k}"
+        list_row.append(pf.TableRow(cell(marker), cell(f"b{k}"), cell("->" if k % 4 == 1 else f"c{k}")))
+    head = pf.TableHead(pf.TableRow(cell("A"), cell("B"), cell("C")))
+    caption = pf.Caption(pf.Plain(
+        pf.Str("Table"), pf.Space, pf.Str(identifier),
+        pf.Space, pf.Str(f"{{#tbl:{identifier}"), pf.Space, pf.Str('colwidth="20,30,50"}')))
+    return pf.Table(
+        pf.TableBody(*list_row),
+        head=head,
+        caption=caption,
+        colspec=[("AlignDefault", "ColWidthDefault")] * 3)
+
+
+def make_diagram(identifier, index):
+    """PlantUML(偶数番目)またはMermaid(奇数番目)の図のコードブロックを作成する"""
+    if index % 2 == 0:
+        text = (f"@startuml\n'filename={identifier}.svg\n'caption=Diagram {identifier}\n"
+                f"'#fig:{identifier}\nAlice -> Bob: {identifier}\n@enduml")
+        return pf.CodeBlock(text, classes=["plantuml"])
+    text = (f"%%filename={identifier}.svg\n%%caption=Diagram {identifier}\n"
+            f"%%#fig:{identifier}\ngraph TD\n  A[{identifier}] --> B")
+    return pf.CodeBlock(text, classes=["mermaid"])
+
+
+def make_section(i, num_section, options):
+    """1つのセクションのブロックを作成する"""
+    level = i % options["depth"] + 1
+    list_block = [pf.Header(pf.Str(f"Section{i}"), level=level, identifier=f"sec:s{i}")]
+    next_section = (i + 1) % num_section
+
+    # 引用(直前の図と表、次のセクションの図への前方参照、次のセクションへの前方参照)
+    list_key = [f"sec:s{i}", f"fig:f{i}-0", f"tbl:t{i}-0",
+                f"fig:f{next_section}-0", f"sec:s{next_section}", f"tbl:t{next_section}-0"]
+    list_inline = []
+    for k in range(options["citations"]):
+        list_inline.extend([pf.Str(f"text{i}-{k}"), pf.Space, cite(list_key[k % len(list_key)]), pf.Space])
+    if list_inline:
+        list_block.append(pf.Para(*list_inline[:-1]))
+
+    for k in range(options["figures"]):
+        list_block.append(pf.Figure(
+            pf.Plain(pf.Image(pf.Str(f"Figure {i}-{k}"), url="image.png")),
+            caption=pf.Caption(pf.Plain(pf.Str(f"Figure {i}-{k}"))),
+            identifier=f"fig:f{i}-{k}"))
+    for k in range(options["tables"]):
+        list_block.append(make_table(f"t{i}-{k}", options["table_rows"]))
+    for k in range(options["code_blocks"]):
+        list_block.append(pf.CodeBlock(
+            f"# see [@sec:s{i}] and [@fig:f{i}-0]\nvalue = {k}\n# next [@tbl:t{next_section}-0]",
+            classes=["python"]))
+    for k in range(options["diagrams"]):
+        list_block.append(make_diagram(f"d{i}-{k}", i + k))
+    return list_block
+
+
+def make_doc(num_section, **kwargs):
+    """ドキュメントを作成する
+
+    Args:
+        num_section (int):
+            セクションの数
+        **kwargs:
+            1つのセクションあたりの要素の数(DEFAULT_OPTIONSを参照)
+
+    Returns:
+        pf.Doc: ドキュメント
+    """
+    options = dict(DEFAULT_OPTIONS, **kwargs)
+    list_block = []
+    for i in range(num_section):
+        list_block.extend(make_section(i, num_section, options))
+    return pf.Doc(*list_block, format="html")
+
+
+def make_json(num_section, **kwargs):
+    """ドキュメントのJSONを作成する(引数はmake_doc()と同じ)"""
+    return json.dumps(make_doc(num_section, **kwargs).to_json())
+
+
+def main():
+    num_section = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    sys.stdout.write(make_json(num_section))
+
+
+if __name__ == "__main__":
+    main()
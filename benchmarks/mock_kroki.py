@@ -0,0 +1,135 @@
+"""ベンチマーク用のKrokiサーバーのモック
+
+KrokiClientと同じ形式のリクエスト(POST /、JSONで図のテキスト、種類、フォーマットを指定)と、
+Markdown Preview Enhancedと同じ形式のリクエスト(POST /<種類>/<フォーマット>、本文が図のテキスト)に、
+図のテキストを含む小さな画像を返す。
+応答までの待ち時間と、一時的なエラー(503)を返す割合を指定できるので、
+Dockerを使わずに、PlantUML/Mermaidの画像の出力を負荷やエラーのある状態で試すことができる。
+
+使い方:
+    python benchmarks/mock_kroki.py [--port 8080] [--latency 0.05] [--error-rate 0.1]
+    PANDOC_CROSSREF_FILTER_KROKI_URL=http://127.0.0.1:8080 pandoc ...
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from xml.sax.saxutils import escape
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# PNGのシグネチャ(中身は画像として正しくなくてよい)
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class MockKrokiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0, error_rate: float = 0.0,
+                 seed: int | None = None) -> None:
+        """Krokiサーバーのモック
+
+        Args:
+            port (int):
+                待ち受けるポート。0なら空いているポートを使う
+            latency (float):
+                応答までの待ち時間(秒)
+            error_rate (float):
+                一時的なエラー(503)を返す割合(0から1)
+            seed (int | None):
+                エラーを返すリクエストを決める乱数のシード
+        """
+        super().__init__(("127.0.0.1", port), MockKrokiHandler)
+        self.latency: float = latency
+        self.error_rate: float = error_rate
+        self.random: random.Random = random.Random(seed)
+        self.lock: threading.Lock = threading.Lock()
+        # 統計
+        self.num_request: int = 0
+        self.num_error: int = 0
+
+    @property
+    def url(self) -> str:
+        """サーバーのURL"""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def is_error(self) -> bool:
+        """リクエストを数えて、エラーを返すかどうかを決める"""
+        with self.lock:
+            self.num_request += 1
+            if self.error_rate > 0 and self.random.random() < self.error_rate:
+                self.num_error += 1
+                return True
+            return False
+
+    def start(self) -> "MockKrokiServer":
+        """別のスレッドで待ち受けを始める"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class MockKrokiHandler(BaseHTTPRequestHandler):
+    server: MockKrokiServer
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.strip("/"):
+            # POST /<種類>/<フォーマット>
+            diagram_type, _, output_format = self.path.strip("/").partition("/")
+            source = body.decode("utf-8")
+        else:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                self._send(400, b"invalid json", "text/plain")
+                return
+            diagram_type = data.get("diagram_type", "")
+            output_format = data.get("output_format", "svg")
+            source = data.get("diagram_source", "")
+
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        if self.server.is_error():
+            self._send(503, b"service unavailable", "text/plain")
+            return
+
+        if output_format == "png":
+            self._send(200, PNG_SIGNATURE + source.encode("utf-8"), "image/png")
+        else:
+            svg = (f'<svg xmlns="http://www.w3.org/2000/svg" data-type="{escape(diagram_type)}">'
+                   f"<text>{escape(source)}</text></svg>")
+            self._send(200, svg.encode("utf-8"), "image/svg+xml")
+
+    def _send(self, status: int, content: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format: str, *args) -> None:
+        """リクエストごとのログは出力しない"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Kroki server for benchmarks")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="ratio of 503 responses")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = MockKrokiServer(args.port, args.latency, args.error_rate, args.seed)
+    print(f"Mock Kroki server: {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+import functools
+from typing import List, Dict, Sequence
+
+import panflute as pf
+
+from . import utils
+from .pandoc_crossref_filter import action, prepare, resolve_references
+from .format_tweaks import FormatTweaks, sort_formats
+from .pandoc_process import read_json, write_output, PandocError
+
+
+logger = utils.get_logger()
+
+
+class ConvertError(Exception):
+    def __init__(self, message: str, list_error: List[Dict] | None = None) -> None:
+        """変換に失敗したときの例外
+
+        Args:
+            message (str):
+                エラーの内容
+            list_error (list(dict) | None):
+                ドキュメント中のエラーの一覧(Diagnostics.list_errorと同じ形式)
+        """
+        super().__init__(message)
+        self.list_error: List[Dict] = list_error or []
+
+
+class ConvertResult():
+    def __init__(self,
+                 output: bytes,
+                 output_path: str | None,
+                 diagrams: List[Dict]) -> None:
+        """変換結果
+
+        Args:
+            output (bytes):
+                変換結果。出力先のパスを指定した場合は空
+            output_path (str | None):
+                出力先のパス
+            diagrams (list(dict)):
+                PlantUML/Mermaidの画像ごとの出力結果
+                - filename (str): 出力先の画像ファイル名
+                - diagram_type (str | None): 図の種類
+                - error (str | None): 失敗した場合はエラーの内容
+        """
+        self.output: bytes = output
+        self.output_path: str | None = output_path
+        self.diagrams: List[Dict] = diagrams
+
+    @property
+    def diagram_errors(self) -> List[Dict]:
+        """出力に失敗した画像の一覧"""
+        return [diagram for diagram in self.diagrams if diagram["error"] is not None]
+
+    @property
+    def ok(self) -> bool:
+        """すべての画像の出力に成功したかどうか"""
+        return len(self.diagram_errors) == 0
+
+
+def convert(source: str,
+            to: str = "docx",
+            metadata: Dict | None = None,
+            from_format: str = "markdown",
+            output: str | None = None,
+            extra_args: Sequence[str] = ()) -> ConvertResult:
+    """テキストを変換する
+
+    pandocでJSONに変換し、フィルターをプロセス内で適用してから、
+    再度pandocで出力フォーマットに変換する。
+    (pandocからフィルターのプロセスを起動しない)
+
+    Args:
+        source (str):
+            入力テキスト
+        to (str):
+            出力フォーマット
+        metadata (dict | None):
+            ドキュメントのメタデータに追加する値(辞書は既存のメタデータと再帰的にマージする)
+            例: {"pandoc_crossref_filter": {"section": {"auto_section": True}}}
+        from_format (str):
+            入力フォーマット
+        output (str | None):
+            出力先のパス。Noneの場合は変換結果をConvertResult.outputで返す
+        extra_args (list(str)):
+            出力時にpandocに渡す追加の引数
+
+    Returns:
+        ConvertResult: 変換結果
+
+    Raises:
+        PandocError: pandocの実行に失敗した
+        ConvertError: フィルターの適用に失敗した
+    """
+    json_text = read_json(text=source, from_format=from_format)
+    return convert_json(json_text, to, metadata, output, extra_args)
+
+
+def convert_file(path: str,
+                 to: str = "docx",
+                 metadata: Dict | None = None,
+                 from_format: str | None = None,
+                 output: str | None = None,
+                 extra_args: Sequence[str] = ()) -> ConvertResult:
+    """ファイルを変換する
+
+    Args:
+        path (str):
+            入力ファイルのパス
+        from_format (str | None):
+            入力フォーマット。Noneの場合はpandocに推定させる
+        その他:
+            convert()と同じ
+
+    Returns:
+        ConvertResult: 変換結果
+
+    Raises:
+        PandocError: pandocの実行に失敗した
+        ConvertError: フィルターの適用に失敗した
+    """
+    json_text = read_json(path, from_format=from_format)
+    return convert_json(json_text, to, metadata, output, extra_args)
+
+
+def convert_json(json_text: str,
+                 to: str = "docx",
+                 metadata: Dict | None = None,
+                 output: str | None = None,
+                 extra_args: Sequence[str] = ()) -> ConvertResult:
+    """pandocのJSONを変換する
+
+    Args:
+        json_text (str):
+            pandocのJSON
+        その他:
+            convert()と同じ
+
+    Returns:
+        ConvertResult: 変換結果
+
+    Raises:
+        PandocError: pandocの実行に失敗した
+        ConvertError: フィルターの適用に失敗した
+    """
+    doc = utils.load_doc(json_text, to)
+    update_metadata(doc, metadata or {})
+
+    diagrams = apply_filter(doc)
+    output_bytes = write_output(utils.dump_doc(doc), to, output, extra_args)
+    return ConvertResult(output_bytes, output, diagrams)
+
+
+def convert_multi(source: str,
+                  formats: Sequence[str],
+                  metadata: Dict | None = None,
+                  from_format: str = "markdown",
+                  outputs: Dict[str, str] | None = None,
+                  extra_args: Sequence[str] = ()) -> Dict[str, ConvertResult]:
+    """テキストを複数の出力フォーマットに変換する
+
+    番号付け、参照の解決、画像の出力は1回だけ行い、
+    出力フォーマットごとの差分(参照のリンク、図の幅)だけを書き換えて出力する。
+
+    Args:
+        source (str):
+            入力テキスト
+        formats (list(str)):
+            出力フォーマットの一覧
+        outputs (dict | None):
+            出力フォーマットごとの出力先のパス。含まれないフォーマットは変換結果を返す
+        その他:
+            convert()と同じ
+
+    Returns:
+        dict: 出力フォーマットごとの変換結果
+
+    Raises:
+        PandocError: pandocの実行に失敗した
+        ConvertError: フィルターの適用に失敗した
+    """
+    json_text = read_json(text=source, from_format=from_format)
+    return convert_json_multi(json_text, formats, metadata, outputs, extra_args)
+
+
+def convert_file_multi(path: str,
+                       formats: Sequence[str],
+                       metadata: Dict | None = None,
+                       from_format: str | None = None,
+                       outputs: Dict[str, str] | None = None,
+                       extra_args: Sequence[str] = ()) -> Dict[str, ConvertResult]:
+    """ファイルを複数の出力フォーマットに変換する
+
+    Args:
+        path (str):
+            入力ファイルのパス
+        from_format (str | None):
+            入力フォーマット。Noneの場合はpandocに推定させる
+        その他:
+            convert_multi()と同じ
+
+    Returns:
+        dict: 出力フォーマットごとの変換結果
+
+    Raises:
+        PandocError: pandocの実行に失敗した
+        ConvertError: フィルターの適用に失敗した
+    """
+    json_text = read_json(path, from_format=from_format)
+    return convert_json_multi(json_text, formats, metadata, outputs, extra_args)
+
+
+def convert_json_multi(json_text: str,
+                       formats: Sequence[str],
+                       metadata: Dict | None = None,
+                       outputs: Dict[str, str] | None = None,
+                       extra_args: Sequence[str] = ()) -> Dict[str, ConvertResult]:
+    """pandocのJSONを複数の出力フォーマットに変換する
+
+    Args:
+        json_text (str):
+            pandocのJSON
+        その他:
+            convert_multi()と同じ
+
+    Returns:
+        dict: 出力フォーマットごとの変換結果
+
+    Raises:
+        PandocError: pandocの実行に失敗した
+        ConvertError: フィルターの適用に失敗した
+    """
+    list_format = sort_formats(list(dict.fromkeys(formats)))
+    outputs = outputs or {}
+
+    doc = utils.load_doc(json_text, list_format[0])
+    update_metadata(doc, metadata or {})
+
+    format_tweaks = FormatTweaks()
+    diagrams = apply_filter(doc, format_tweaks)
+
+    dict_result = {}
+    for output_format in list_format:
+        format_tweaks.apply(output_format)
+        output = outputs.get(output_format)
+        output_bytes = write_output(
+            utils.dump_doc(doc), output_format, output, extra_args)
+        dict_result[output_format] = ConvertResult(output_bytes, output, diagrams)
+    return dict_result
+
+
+def update_metadata(doc: pf.Doc, metadata: Dict) -> None:
+    """ドキュメントのメタデータを更新する
+
+    辞書の値は、既存のメタデータと再帰的にマージする
+
+    Args:
+        doc (pf.Doc):
+            ドキュメント
+        metadata (dict):
+            追加する値
+    """
+    for key, value in metadata.items():
+        current = doc.get_metadata(key, None)
+        if isinstance(current, dict) and isinstance(value, dict):
+            value = _merge_dict(current, value)
+        doc.metadata[key] = value
+
+
+def _merge_dict(base: Dict, update: Dict) -> Dict:
+    """辞書を再帰的にマージする"""
+    merged = dict(base)
+    for key, value in update.items():
+        if isinstance(merged.get(key), dict) and isinstance(value, dict):
+            value = _merge_dict(merged[key], value)
+        merged[key] = value
+    return merged
+
+
+def apply_filter(doc: pf.Doc, format_tweaks: FormatTweaks | None = None) -> List[Dict]:
+    """読み込み済みのドキュメントにフィルターを適用する
+
+    画像の出力に失敗しても、sys.exit()せずに結果を返す
+    参照が見つからないなどのエラーは、すべて集めてから1回だけ例外にする
+
+    Args:
+        doc (pf.Doc):
+            ドキュメント
+        format_tweaks (FormatTweaks | None):
+            複数の出力フォーマットを作る場合に指定する
+
+    Returns:
+        list(dict): 画像ごとの出力結果(CodeBlockRef.export_images()の戻り値)
+
+    Raises:
+        ConvertError: フィルターの適用に失敗した
+    """
+    try:
+        pf.run_filter(action,
+                      prepare=functools.partial(prepare, format_tweaks=format_tweaks),
+                      finalize=resolve_references,
+                      doc=doc)
+    except SystemExit as e:
+        # エラーの内容はログに出力済み
+        raise ConvertError("Failed to apply the filter.") from e
+    if doc.diagnostics.has_errors():
+        raise ConvertError(doc.diagnostics.get_report_text(),
+                           doc.diagnostics.get_sorted_errors())
+    return doc.code_block_ref.export_images()
+
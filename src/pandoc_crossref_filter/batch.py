@@ -0,0 +1,298 @@
+import os
+import glob
+import time
+from typing import List, Dict, Sequence
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import utils
+from . import kroki
+from . import api
+from .pandoc_process import PandocError
+from .pandoc_crossref_filter import CONFIG_ROOT
+
+
+logger = utils.get_logger()
+
+# 出力フォーマットごとの出力ファイルの拡張子
+OUTPUT_EXTENSIONS = {
+    "docx": ".docx",
+    "html": ".html",
+    "html5": ".html",
+    "gfm": ".md",
+    "markdown": ".md",
+    "commonmark": ".md",
+    "latex": ".tex",
+    "pdf": ".pdf",
+}
+
+
+def collect_sources(list_pattern: Sequence[str]) -> List[str]:
+    """ファイルのパスまたはglobのパターンから、入力ファイルの一覧を取得する
+
+    Args:
+        list_pattern (list(str)):
+            ファイルのパスまたはglobのパターン
+
+    Returns:
+        list(str): 入力ファイルの一覧(重複は除く)
+    """
+    list_source = []
+    for pattern in list_pattern:
+        if glob.has_magic(pattern):
+            list_source.extend(sorted(glob.glob(pattern, recursive=True)))
+        else:
+            list_source.append(pattern)
+    return list(dict.fromkeys(list_source))
+
+
+class DuplicateOutputError(Exception):
+    """複数の入力ファイルの出力先が同じになるときの例外"""
+
+
+def get_input_root(list_source: Sequence[str]) -> str | None:
+    """入力ファイルに共通する親ディレクトリを取得する
+
+    Args:
+        list_source (list(str)):
+            入力ファイルの一覧
+
+    Returns:
+        str | None: 共通する親ディレクトリ。無い場合(Windowsでドライブが異なる場合など)はNone
+    """
+    if len(list_source) == 0:
+        return None
+    try:
+        return os.path.commonpath(
+            [os.path.dirname(os.path.abspath(source)) for source in list_source])
+    except ValueError:
+        return None
+
+
+def get_output_path(source: str,
+                    to_format: str,
+                    output_dir: str | None,
+                    input_root: str | None = None) -> str:
+    """入力ファイルに対応する出力ファイルのパスを取得する
+
+    Args:
+        source (str):
+            入力ファイルのパス
+        to_format (str):
+            出力フォーマット
+        output_dir (str | None):
+            出力先のディレクトリ。Noneなら入力ファイルと同じディレクトリ
+        input_root (str | None):
+            入力ファイルに共通する親ディレクトリ(get_input_root()を参照)。
+            出力先のディレクトリの下に、ここからの相対パスで出力する。Noneならファイル名だけを使う
+
+    Returns:
+        str: 出力ファイルのパス
+    """
+    stem = os.path.splitext(source)[0]
+    if output_dir is not None:
+        if input_root is None:
+            stem = os.path.join(output_dir, os.path.basename(stem))
+        else:
+            stem = os.path.join(output_dir, os.path.relpath(os.path.abspath(stem), input_root))
+    output = stem + OUTPUT_EXTENSIONS.get(to_format, "." + to_format)
+    # 入力ファイルを上書きしないようにする
+    if os.path.abspath(output) == os.path.abspath(source):
+        output = stem + ".out" + OUTPUT_EXTENSIONS.get(to_format, "." + to_format)
+    return output
+
+
+def get_output_paths(list_source: Sequence[str],
+                     to_format: str,
+                     output_dir: str | None) -> List[str]:
+    """入力ファイルごとの出力ファイルのパスを取得する
+
+    出力先のディレクトリを指定した場合は、入力ファイルのディレクトリ構成を保つ
+
+    Args:
+        list_source (list(str)):
+            入力ファイルの一覧
+        to_format (str):
+            出力フォーマット
+        output_dir (str | None):
+            出力先のディレクトリ。Noneなら入力ファイルと同じディレクトリ
+
+    Returns:
+        list(str): 出力ファイルのパス(list_sourceと同じ順番)
+
+    Raises:
+        DuplicateOutputError: 複数の入力ファイルの出力先が同じになる
+    """
+    input_root = get_input_root(list_source)
+    list_output = [get_output_path(source, to_format, output_dir, input_root)
+                   for source in list_source]
+
+    # 出力先 -> 入力ファイルの一覧
+    dict_source: Dict[str, List[str]] = {}
+    for source, output in zip(list_source, list_output):
+        dict_source.setdefault(os.path.normcase(os.path.abspath(output)), []).append(source)
+    list_duplicate = [list_same for list_same in dict_source.values() if len(list_same) > 1]
+    if list_duplicate:
+        raise DuplicateOutputError("Several inputs are written to the same output: " + "; ".join(
+            ", ".join(list_same) for list_same in list_duplicate))
+    return list_output
+
+
+def convert_file(source: str,
+                 output: str,
+                 to_format: str,
+                 from_format: str | None = None,
+                 extra_args: Sequence[str] = (),
+                 index_path: str | None = None) -> Dict:
+    """1つのファイルを変換する
+
+    api.convert_file()で変換し、結果をまとめる
+
+    Args:
+        source (str):
+            入力ファイルのパス
+        output (str):
+            出力ファイルのパス
+        to_format (str):
+            出力フォーマット
+        from_format (str | None):
+            入力フォーマット。Noneの場合はpandocに推定させる
+        extra_args (list(str)):
+            出力時にpandocに渡す追加の引数
+        index_path (str | None):
+            複数のドキュメント(章)をまたいだ参照のインデックスのパス
+
+    Returns:
+        dict:
+            変換結果
+            - source (str): 入力ファイルのパス
+            - output (str): 出力ファイルのパス
+            - seconds (float): 変換にかかった時間
+            - error (str | None): 失敗した場合はエラーの内容
+    """
+    start = time.perf_counter()
+    error = None
+    metadata = None
+    if index_path is not None:
+        metadata = {CONFIG_ROOT: {"index": {"path": index_path, "chapter": source}}}
+    try:
+        result = api.convert_file(
+            source, to_format, metadata=metadata, from_format=from_format,
+            output=output, extra_args=extra_args)
+        if not result.ok:
+            error = " ".join(diagram["error"] for diagram in result.diagram_errors)
+    except (PandocError, api.ConvertError) as e:
+        error = str(e)
+    except Exception as e:
+        # 壊れたドキュメントなどによる想定外のエラーも、このファイルの失敗として記録する
+        # (1つのファイルのエラーで、バッチ全体を止めない)
+        logger.debug("Failed to convert %s", source, exc_info=True)
+        error = f"{type(e).__name__}: {e}"
+
+    return {
+        "source": source,
+        "output": output,
+        "seconds": time.perf_counter() - start,
+        "error": error
+    }
+
+
+def _init_worker(render_cache_dir: str | None) -> None:
+    """ワーカープロセスの初期化
+
+    ワーカープロセスごとに1つのKrokiクライアント(コネクションプール)を作成し、
+    すべてのドキュメントで共有する
+    """
+    kroki.set_render_cache_dir(render_cache_dir)
+
+
+def run_batch(list_source: Sequence[str],
+              to_format: str,
+              output_dir: str | None = None,
+              jobs: int | None = None,
+              render_cache_dir: str | None = None,
+              from_format: str | None = None,
+              extra_args: Sequence[str] = (),
+              index_path: str | None = None) -> List[Dict]:
+    """複数のファイルを、ワーカープロセスのプールで変換する
+
+    Args:
+        list_source (list(str)):
+            入力ファイルの一覧
+        to_format (str):
+            出力フォーマット
+        output_dir (str | None):
+            出力先のディレクトリ。Noneなら入力ファイルと同じディレクトリ
+        jobs (int | None):
+            ワーカープロセスの数。Noneの場合はCPU数
+        render_cache_dir (str | None):
+            PlantUML/Mermaidの画像のキャッシュの保存先
+        from_format (str | None):
+            入力フォーマット。Noneの場合はpandocに推定させる
+        extra_args (list(str)):
+            出力時にpandocに渡す追加の引数
+        index_path (str | None):
+            複数のドキュメント(章)をまたいだ参照のインデックスのパス
+
+    Returns:
+        list(dict): ファイルごとの変換結果(convert_file()の戻り値)
+
+    Raises:
+        DuplicateOutputError: 複数の入力ファイルの出力先が同じになる(変換は始めない)
+    """
+    list_output = get_output_paths(list_source, to_format, output_dir)
+    for output in list_output:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    start = time.perf_counter()
+    list_result = []
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=_init_worker,
+                             initargs=(render_cache_dir,)) as executor:
+        # future -> (入力ファイルのパス, 出力ファイルのパス)
+        dict_future = {}
+        for source, output in zip(list_source, list_output):
+            future = executor.submit(
+                convert_file,
+                source,
+                output,
+                to_format,
+                from_format,
+                tuple(extra_args),
+                index_path)
+            dict_future[future] = (source, output)
+        for future in as_completed(dict_future):
+            try:
+                result = future.result()
+            except Exception as e:
+                # ワーカープロセスの異常終了など、convert_file()の外のエラー
+                source, output = dict_future[future]
+                result = {
+                    "source": source,
+                    "output": output,
+                    "seconds": 0.0,
+                    "error": f"{type(e).__name__}: {e}"
+                }
+            list_result.append(result)
+            _print_result(result)
+
+    _print_summary(list_result, time.perf_counter() - start)
+    return list_result
+
+
+def _print_result(result: Dict) -> None:
+    """ファイルごとの変換結果を表示する"""
+    if result["error"] is None:
+        print(f"[ OK ] {result['seconds']:7.3f}s {result['source']} -> {result['output']}")
+    else:
+        print(f"[FAIL] {result['seconds']:7.3f}s {result['source']}: {result['error']}")
+
+
+def _print_summary(list_result: List[Dict], wall_seconds: float) -> None:
+    """変換結果のまとめを表示する"""
+    num_files = len(list_result)
+    num_failed = sum(1 for result in list_result if result["error"] is not None)
+    total_seconds = sum(result["seconds"] for result in list_result)
+    throughput = num_files / wall_seconds if wall_seconds > 0 else 0.0
+    print(
+        f"{num_files} files ({num_failed} failed) in {wall_seconds:.3f}s "
+        f"(sum of per-file time {total_seconds:.3f}s, {throughput:.2f} files/s)")
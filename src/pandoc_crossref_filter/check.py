@@ -0,0 +1,192 @@
+import json
+import time
+import collections
+from typing import List, Dict, Sequence
+from concurrent.futures import ProcessPoolExecutor
+
+import panflute as pf
+
+from . import utils
+from . import api
+from .pandoc_crossref_filter import CONFIG_ROOT, action, prepare, resolve_references
+from .pandoc_process import read_json, PandocError
+
+
+logger = utils.get_logger()
+
+
+def check_json(json_text: str, metadata: Dict | None = None) -> Dict:
+    """pandocのJSONの相互参照を検査する
+
+    番号付けと参照の解決までを行い、画像の出力と出力ファイルの作成は行わない
+
+    Args:
+        json_text (str):
+            pandocのJSON
+        metadata (dict | None):
+            ドキュメントのメタデータに追加する値
+
+    Returns:
+        dict:
+            検査結果
+            - identifiers (dict): 参照の種類 -> 登録された参照IDの数
+            - references (dict): 引用の数
+                - backward (int): 登録済みの参照への引用の数
+                - forward (int): 後続で定義されている参照への引用の数
+                - code_block (int): コードブロック中の引用の数
+            - diagrams (int): PlantUML/Mermaidの図の数
+            - error_count (int): エラーの数
+            - errors (list(dict)): エラーの一覧(Diagnostics.get_report()と同じ形式)
+    """
+    doc = utils.load_doc(json_text, "json")
+    api.update_metadata(doc, metadata or {})
+    try:
+        pf.run_filter(action, prepare=prepare, finalize=_finalize, doc=doc)
+    except SystemExit:
+        # インデックスの読み込みの失敗など、処理を続けられないエラー
+        return {
+            "identifiers": {},
+            "references": {},
+            "diagrams": 0,
+            "error_count": 1,
+            "errors": [{
+                "code": "fatal",
+                "message": "Failed to apply the filter.",
+                "block": None,
+                "header": None
+            }]
+        }
+
+    # 画像は出力しないが、出力ファイル名の重複はここで検査する
+    list_filename = doc.code_block_ref.get_filenames()
+    for filename, count in collections.Counter(list_filename).items():
+        if count > 1:
+            doc.diagnostics.error("diagram", f"Duplicate filename: {filename}.", (None, None))
+
+    stats = doc.reference_registry.get_stats()
+    report = {
+        "identifiers": doc.check_identifiers,
+        "references": {
+            "backward": stats["backward"],
+            "forward": stats["forward"],
+            "code_block": sum(len(template.keys)
+                              for template in doc.code_block_ref.list_replace_target)
+        },
+        "diagrams": len(list_filename)
+    }
+    report.update(doc.diagnostics.get_report())
+    return report
+
+
+def _finalize(doc: pf.Doc) -> None:
+    """参照を上書きする(画像は出力しない)
+
+    インデックスから読み込んだ参照を含めないように、参照の解決の前に参照IDの数を数える
+    """
+    doc.check_identifiers = dict(collections.Counter(
+        record.kind for _, record in doc.reference_registry.items()))
+    resolve_references(doc)
+
+
+def check_file(source: str,
+               from_format: str | None = None,
+               index_path: str | None = None) -> Dict:
+    """1つのファイルの相互参照を検査する
+
+    Args:
+        source (str):
+            入力ファイルのパス
+        from_format (str | None):
+            入力フォーマット。Noneの場合はpandocに推定させる
+        index_path (str | None):
+            複数のドキュメント(章)をまたいだ参照のインデックスのパス
+
+    Returns:
+        dict:
+            検査結果(check_json()の戻り値に、以下を追加したもの)
+            - source (str): 入力ファイルのパス
+            - seconds (float): 検査にかかった時間
+    """
+    start = time.perf_counter()
+    metadata = None
+    if index_path is not None:
+        metadata = {CONFIG_ROOT: {"index": {"path": index_path, "chapter": source}}}
+    try:
+        json_text = read_json(source, from_format=from_format)
+        result = check_json(json_text, metadata)
+    except PandocError as e:
+        result = {
+            "identifiers": {},
+            "references": {},
+            "diagrams": 0,
+            "error_count": 1,
+            "errors": [{"code": "pandoc", "message": str(e), "block": None, "header": None}]
+        }
+    result["source"] = source
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def run_check(list_source: Sequence[str],
+              from_format: str | None = None,
+              jobs: int | None = None,
+              index_path: str | None = None) -> Dict:
+    """複数のファイルの相互参照を、ワーカープロセスのプールで検査する
+
+    Args:
+        list_source (list(str)):
+            入力ファイルの一覧
+        from_format (str | None):
+            入力フォーマット。Noneの場合はpandocに推定させる
+        jobs (int | None):
+            ワーカープロセスの数。Noneの場合はCPU数
+        index_path (str | None):
+            複数のドキュメント(章)をまたいだ参照のインデックスのパス
+
+    Returns:
+        dict:
+            検査結果
+            - files (list(dict)): ファイルごとの検査結果(check_file()の戻り値、入力ファイルの順)
+            - error_count (int): すべてのファイルのエラーの数
+            - seconds (float): 検査にかかった時間
+    """
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        list_result: List[Dict] = list(executor.map(
+            check_file,
+            list_source,
+            [from_format] * len(list_source),
+            [index_path] * len(list_source)))
+
+    return {
+        "files": list_result,
+        "error_count": sum(result["error_count"] for result in list_result),
+        "seconds": time.perf_counter() - start
+    }
+
+
+def write_report(report: Dict, path: str | None) -> None:
+    """検査結果をJSON形式で出力する
+
+    Args:
+        report (dict):
+            run_check()の戻り値
+        path (str | None):
+            保存先のパス。Noneの場合は標準出力に出力する
+    """
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if path is None:
+        print(text)
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def print_summary(report: Dict) -> None:
+    """ファイルごとの検査結果を表示する"""
+    for result in report["files"]:
+        status = "[ OK ]" if result["error_count"] == 0 else "[FAIL]"
+        print(f"{status} {result['seconds']:7.3f}s {result['source']} "
+              f"({result['error_count']} errors)")
+    print(f"{len(report['files'])} files ({report['error_count']} errors) "
+          f"in {report['seconds']:.3f}s")
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+import sys
+import logging
+import argparse
+
+from . import utils
+from . import batch
+from . import kroki
+from . import prescan
+from . import check
+from .cross_doc_index import CrossDocIndexError
+from .pandoc_process import PandocError
+from .watch import Watcher
+from .server import ConversionService, serve
+
+
+utils.set_logger(logging.WARNING)
+logger = utils.get_logger()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="pandoc_crossref_filter_cli",
+        description="Tools for running pandoc_crossref_filter without a pandoc filter process.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    # 一括変換
+    parser_batch = subparsers.add_parser(
+        "batch", help="Convert many documents with a pool of worker processes.")
+    parser_batch.add_argument(
+        "sources", nargs="+", help="Input files or glob patterns (e.g. 'docs/**/*.md').")
+    _add_conversion_arguments(parser_batch)
+    parser_batch.add_argument(
+        "-j", "--jobs", type=int, default=None,
+        help="Number of worker processes (default: number of CPUs).")
+    parser_batch.add_argument(
+        "--index", default=None,
+        help="Cross-document reference index built by the 'index' command.")
+    parser_batch.set_defaults(func=_run_batch)
+
+    # 複数のドキュメント(章)をまたいだ参照のインデックスの作成
+    parser_index = subparsers.add_parser(
+        "index", help="Pre-scan chapters and build a cross-document reference index.")
+    parser_index.add_argument(
+        "index", help="Path of the index file (SQLite).")
+    parser_index.add_argument(
+        "sources", nargs="+",
+        help="Chapter files or glob patterns, in book order.")
+    parser_index.add_argument(
+        "-f", "--from", dest="from_format", default=None, help="Input format.")
+    parser_index.add_argument(
+        "-j", "--jobs", type=int, default=None,
+        help="Number of concurrent pandoc readers (default: automatic).")
+    parser_index.set_defaults(func=_run_index)
+
+    # 相互参照の検査(画像と出力ファイルは作らない)
+    parser_check = subparsers.add_parser(
+        "check", help="Check cross-references without rendering diagrams or writing outputs.")
+    parser_check.add_argument(
+        "sources", nargs="+", help="Input files or glob patterns (e.g. 'docs/**/*.md').")
+    parser_check.add_argument(
+        "-f", "--from", dest="from_format", default=None, help="Input format.")
+    parser_check.add_argument(
+        "-j", "--jobs", type=int, default=None,
+        help="Number of worker processes (default: number of CPUs).")
+    parser_check.add_argument(
+        "--index", default=None,
+        help="Cross-document reference index built by the 'index' command.")
+    parser_check.add_argument(
+        "--report", default=None,
+        help="Write the JSON report to this file instead of standard output.")
+    parser_check.set_defaults(func=_run_check)
+
+    # 監視して再変換
+    parser_watch = subparsers.add_parser(
+        "watch", help="Watch documents and their images, and rebuild outputs on changes.")
+    parser_watch.add_argument(
+        "sources", nargs="+", help="Input files or glob patterns (e.g. 'docs/**/*.md').")
+    _add_conversion_arguments(parser_watch)
+    parser_watch.add_argument(
+        "--interval", type=float, default=0.5,
+        help="Polling interval in seconds (default: 0.5).")
+    parser_watch.add_argument(
+        "--debounce", type=float, default=0.3,
+        help="Quiet period in seconds before rebuilding after a change (default: 0.3).")
+    parser_watch.set_defaults(func=_run_watch)
+
+    # HTTPの変換サービス
+    parser_serve = subparsers.add_parser(
+        "serve", help="Run a local HTTP conversion service.")
+    parser_serve.add_argument(
+        "--host", default="127.0.0.1", help="Host to listen on (default: 127.0.0.1).")
+    parser_serve.add_argument(
+        "--port", type=int, default=8000, help="Port to listen on (default: 8000).")
+    parser_serve.add_argument(
+        "--pandoc-workers", type=int, default=4,
+        help="Maximum number of concurrent pandoc processes (default: 4).")
+    parser_serve.add_argument(
+        "--max-pending", type=int, default=16,
+        help="Maximum number of requests in progress; more are rejected with 503 (default: 16).")
+    parser_serve.add_argument(
+        "--queue-timeout", type=float, default=10.0,
+        help="Seconds to wait for a free pandoc process before rejecting (default: 10).")
+    parser_serve.add_argument(
+        "--render-cache", default=None,
+        help="Directory for caching rendered PlantUML/Mermaid images.")
+    parser_serve.set_defaults(func=_run_serve)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+def _add_conversion_arguments(parser: argparse.ArgumentParser) -> None:
+    """変換に関する共通の引数を追加する"""
+    parser.add_argument(
+        "-t", "--to", default="docx", help="Output format (default: docx).")
+    parser.add_argument(
+        "-f", "--from", dest="from_format", default=None, help="Input format.")
+    parser.add_argument(
+        "-o", "--output-dir", default=None,
+        help="Output directory (default: next to each input file).")
+    parser.add_argument(
+        "--render-cache", default=None,
+        help="Directory for caching rendered PlantUML/Mermaid images.")
+    parser.add_argument(
+        "--pandoc-arg", action="append", default=[],
+        help="Extra argument passed to pandoc when writing the output (repeatable).")
+
+
+def _run_batch(args: argparse.Namespace) -> int:
+    list_source = batch.collect_sources(args.sources)
+    if len(list_source) == 0:
+        logger.error("No input files.")
+        return 1
+
+    try:
+        list_result = batch.run_batch(
+            list_source,
+            args.to,
+            output_dir=args.output_dir,
+            jobs=args.jobs,
+            render_cache_dir=args.render_cache,
+            from_format=args.from_format,
+            extra_args=args.pandoc_arg,
+            index_path=args.index)
+    except batch.DuplicateOutputError as e:
+        logger.error(e)
+        return 1
+    return 1 if any(result["error"] is not None for result in list_result) else 0
+
+
+def _run_index(args: argparse.Namespace) -> int:
+    list_source = batch.collect_sources(args.sources)
+    if len(list_source) == 0:
+        logger.error("No input files.")
+        return 1
+
+    try:
+        prescan.build_index(
+            args.index, list_source, from_format=args.from_format, jobs=args.jobs)
+    except (PandocError, CrossDocIndexError) as e:
+        logger.error(e)
+        return 1
+    except SystemExit:
+        # エラーの内容はログに出力済み
+        return 1
+    return 0
+
+
+def _run_check(args: argparse.Namespace) -> int:
+    list_source = batch.collect_sources(args.sources)
+    if len(list_source) == 0:
+        logger.error("No input files.")
+        return 1
+
+    report = check.run_check(
+        list_source,
+        from_format=args.from_format,
+        jobs=args.jobs,
+        index_path=args.index)
+    check.write_report(report, args.report)
+    if args.report is not None:
+        check.print_summary(report)
+    return 1 if report["error_count"] > 0 else 0
+
+
+def _run_watch(args: argparse.Namespace) -> int:
+    kroki.set_render_cache_dir(args.render_cache)
+    watcher = Watcher(
+        args.sources,
+        args.to,
+        output_dir=args.output_dir,
+        from_format=args.from_format,
+        extra_args=args.pandoc_arg,
+        interval=args.interval,
+        debounce=args.debounce)
+    watcher.run()
+    return 0
+
+
+def _run_serve(args: argparse.Namespace) -> int:
+    kroki.set_render_cache_dir(args.render_cache)
+    service = ConversionService(
+        pandoc_workers=args.pandoc_workers,
+        max_pending=args.max_pending,
+        queue_timeout=args.queue_timeout)
+    serve(args.host, args.port, service)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
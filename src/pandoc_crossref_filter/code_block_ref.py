@@ -1,17 +1,14 @@
 import os
-import sys
-import re
 import hashlib
-from typing import List, Tuple, Dict
+from typing import List, Dict, Tuple
 import collections
 import itertools
 
 import panflute as pf
 
 from . import utils
-from .section_cross_ref import SectionCrossRef
-from .figure_cross_ref import FigureCrossRef
-from .table_cross_ref import TableCrossRef
+from .registry import PREFIX_KINDS, get_prefix
+from .diagnostics import Diagnostics, MISSING_REFERENCE_TEXT
 from .plantuml_wrapper import PlantUMLWrapper
 from .mermaid_wrapper import MermaidWrapper
 
@@ -19,20 +16,54 @@ from .mermaid_wrapper import MermaidWrapper
 logger = utils.get_logger()
 
 
+class CodeBlockTemplate():
+    """参照を含むコードブロックのテンプレート
+
+    segments[0] + 参照(keys[0]) + segments[1] + ... + 参照(keys[-1]) + segments[-1]
+    の順に連結すると、参照を置き換えたコードブロックの文字列になる
+    """
+    __slots__ = ("elem", "segments", "keys", "position", "is_diagram")
+
+    def __init__(self,
+                 elem: pf.CodeBlock,
+                 segments: List[str],
+                 keys: List[str],
+                 position: Tuple[int | None, str | None] | None = None) -> None:
+        self.elem: pf.CodeBlock = elem
+        # 参照以外の文字列(参照の数 + 1個)
+        self.segments: List[str] = segments
+        # 参照キー(タイトル指定を含む)
+        self.keys: List[str] = keys
+        # コードブロックの位置(Diagnostics.get_position()の戻り値)
+        self.position: Tuple[int | None, str | None] | None = position
+        # PlantUML/Mermaidの図のソースかどうか(画像の出力まで、置き換えた文字列を使う)
+        self.is_diagram: bool = False
+
+
 class CodeBlockRef():
 
-    def __init__(self, config: Dict):
+    def __init__(self, config: Dict, diagnostics: Diagnostics | None = None):
         """コンストラクタ
 
         Args:
             config (dict): config設定
             - save_dir (str):
                 PlantUML or Mermaid画像の出力先
+            - allow_path_in_filename (bool):
+                ファイル名(filename=)に、ディレクトリの区切りを含めてよいかどうか(デフォルトはTrue)
+            diagnostics (Diagnostics | None):
+                エラーの収集先(参照の位置の記録に使う)
         """
         self.save_dir: str = config.get("save_dir", "assets")
+        self.allow_path_in_filename: bool = config.get("allow_path_in_filename", True)
+        self.diagnostics: Diagnostics | None = diagnostics
 
         # 書き換えるべき項目を記憶する(最後に書き換える)
-        self.list_replace_target: List[Dict] = []
+        self.list_replace_target: List[CodeBlockTemplate] = []
+        # 登録したコードブロックの数
+        self.num_code_block: int = 0
+        # コードブロック中の引用の数(ストリーミングでは書き換える項目を途中で切り離すので、別に数える)
+        self.num_code_block_reference: int = 0
 
         # ラッパー
         self.list_wrapper = [
@@ -54,16 +85,13 @@ class CodeBlockRef():
             None | pf.Image | pf.Figure | List:
                 PlantUMLをFigureに置き換えた要素
         """
+        self.num_code_block += 1
+
         # 参照を抽出して一時記憶する
-        replace_text, list_ref_key = self._extract_reference(elem.text)
-        if len(list_ref_key) > 0:
-            # 参照あり
-            # %のエスケープは戻さなくてよい(参照適用時にpythonが勝手に戻す)
-            self.list_replace_target.append({
-                "elem": elem,
-                "replace_text": replace_text,
-                "list_ref_key": list_ref_key
-            })
+        template = self._compile_template(elem)
+        if template is not None:
+            self.list_replace_target.append(template)
+            self.num_code_block_reference += len(template.keys)
 
         # コードブロックを画像に変換する
         for wrapper in self.list_wrapper:
@@ -90,6 +118,14 @@ class CodeBlockRef():
             # エキスポート時は画像で返す
             # (上位側でFigureCrossRefに登録する)
             else:
+                # 出力先のディレクトリの外に書き込めないように、ディレクトリの区切りを含むファイル名を拒否する
+                if not self.allow_path_in_filename and ("/" in filename or "\\" in filename):
+                    if self.diagnostics is not None:
+                        self.diagnostics.error(
+                            "invalid_filename",
+                            f"Invalid filename: '{filename}'. Directory separators are not allowed.")
+                    return None
+
                 # 出力先のディレクトリを追加
                 filename = utils.joinpath(self.save_dir, filename)
 
@@ -99,6 +135,8 @@ class CodeBlockRef():
                     filename += ".png"
 
                 wrapper.add(filename, elem)
+                if template is not None:
+                    template.is_diagram = True
 
                 # widthが指定されていれば属性に追加
                 attributes = elem.attributes.copy()
@@ -116,69 +154,83 @@ class CodeBlockRef():
 
         return None
 
-    def _extract_reference(self, text: str) -> Tuple[str, List[str]]:
-        """コードブロックから参照を抽出する関数
+    def _compile_template(self, elem: pf.CodeBlock) -> CodeBlockTemplate | None:
+        """コードブロックから参照([@XXX])を抽出して、テンプレートを作成する
+
+        - "[@"を含まないコードブロックは、走査せずにNoneを返す
+        - 対応していない参照(sec:, fig:などで始まらないもの)は、そのままの文字列として残す
 
         Args:
-            text (str):
-                コードブロックのテキスト
+            elem (pf.CodeBlock):
+                コードブロック
 
         Returns:
-            str:
-                入力文字列について、参照する箇所を%sに置き換えた文字列
-            list(str):
-                参照のリスト
+            CodeBlockTemplate | None:
+                テンプレート。参照が無ければNone
         """
-        # 正規表現で[@XXX]の形式を抽出
-        pattern = r"\[@(.*?)\]"
-        matches = re.findall(pattern, text)  # "XXX"部分を抽出
-
-        if len(matches) == 0:
-            # 抽出なし
-            return text, []
-
-        # "[@XXX]"を"%s"に置き換え
-        # ただし、事前に%を%%にエスケープする
-        # (参照適用時にpythonが勝手に%%を%に戻すので、明示的にエスケープは戻さなくてよい)
-        replaced_text = re.sub(pattern, "%s", text.replace("%", "%%"))
-
-        return replaced_text, matches
+        text = elem.text
+        if "[@" not in text:
+            return None
+
+        segments = []
+        keys = []
+        # 参照以外の文字列の開始位置
+        segment_start = 0
+        pos = text.find("[@")
+        while pos != -1:
+            end = text.find("]", pos + 2)
+            if end == -1:
+                break
+            # 参照キーは改行を含まない
+            if text.find("\n", pos + 2, end) != -1:
+                pos = text.find("[@", pos + 1)
+                continue
 
-    def replace_reference(self,
-                          section_cross_ref: SectionCrossRef,
-                          figure_cross_ref: FigureCrossRef,
-                          table_cross_ref: TableCrossRef) -> None:
+            key_tmp = text[pos + 2:end]
+            key, _ = utils.split_key_title(key_tmp)
+            if get_prefix(key) in PREFIX_KINDS:
+                segments.append(text[segment_start:pos])
+                keys.append(key_tmp)
+                segment_start = end + 1
+            else:
+                logger.warning(f"Unsupported reference in a code block: '[@{key_tmp}]'. It is left as is.")
+            pos = text.find("[@", end + 1)
+
+        if len(keys) == 0:
+            return None
+        segments.append(text[segment_start:])
+        position = None
+        if self.diagnostics is not None:
+            position = self.diagnostics.get_position()
+        return CodeBlockTemplate(elem, segments, keys, position)
+
+    def replace_reference(self, dict_cross_ref: Dict) -> None:
         """参照を置き換える関数
 
         Args:
-            section_cross_ref: SectionCrossRef
-                セクション番号の参照
-            figure_cross_ref: FigureCrossRef):
-                図番号の参照
-            table_cross_ref: TableCrossRef):
-                表番号の参照
+            dict_cross_ref (dict):
+                参照IDの接頭辞(sec, fig, tbl, eq, lst) -> 各番号の参照
         """
-        for replace_text in self.list_replace_target:
-            # 参照キーから、置き換える文字列を取得する
-            list_replace_value = []
-            for key_tmp in replace_text["list_ref_key"]:
-                key, add_title = utils.split_key_title(key_tmp)
-                if key.startswith("sec:"):
-                    reference = section_cross_ref
-                elif key.startswith("fig:"):
-                    reference = figure_cross_ref
-                elif key.startswith("tbl:"):
-                    reference = table_cross_ref
-                else:
-                    logger.error(f"Unsupported reference: '{key}'.")
-                    sys.exit(1)
-
-                # 参照の取得
-                list_replace_value.append(reference.get_reference_string(key, add_title))
+        # 参照キー(タイトル指定を含む) -> 置き換える文字列
+        dict_replace_value: Dict[str, str] = {}
+        for template in self.list_replace_target:
+            # 参照以外の文字列と、参照を置き換えた文字列を交互に連結する
+            list_text = [template.segments[0]]
+            for key_tmp, segment in zip(template.keys, template.segments[1:]):
+                value = dict_replace_value.get(key_tmp)
+                if value is None:
+                    key, add_title = utils.split_key_title(key_tmp)
+                    reference = dict_cross_ref[get_prefix(key)]
+                    value = reference.get_reference_string(
+                        key, add_title, position=template.position)
+                    # 見つからない参照は、位置ごとにエラーを記録するためにキャッシュしない
+                    if value is not MISSING_REFERENCE_TEXT:
+                        dict_replace_value[key_tmp] = value
+                list_text.append(value)
+                list_text.append(segment)
 
             # コードブロック文字列の置き換え
-            replace_text["elem"].text = \
-                replace_text["replace_text"] % tuple(list_replace_value)
+            template.elem.text = "".join(list_text)
 
     @staticmethod
     def _has_ref(identifier: str) -> bool:
@@ -191,34 +243,73 @@ class CodeBlockRef():
         hash_object = hashlib.md5(text.encode())
         return hash_object.hexdigest()
 
-    def export_images(self) -> None:
-        """画像の出力"""
+    def get_filenames(self) -> List[str]:
+        """出力する画像のファイル名を取得する
+
+        Returns:
+            list(str): 出力する画像のファイル名の一覧
+        """
+        return list(itertools.chain.from_iterable([
+            wrapper.get_filenames() for wrapper in self.list_wrapper
+        ]))
+
+    def get_stats(self) -> Dict:
+        """登録の統計を取得する
+
+        Returns:
+            dict:
+                - code_blocks (int): 登録したコードブロックの数
+                - code_block_references (int): コードブロック中の引用の数
+                - diagrams (int): PlantUML/Mermaidの図の数
+        """
+        return {
+            "code_blocks": self.num_code_block,
+            "code_block_references": self.num_code_block_reference,
+            "diagrams": len(self.get_filenames())
+        }
+
+    def export_images(self) -> List[Dict]:
+        """画像の出力
+
+        Returns:
+            list(dict):
+                画像ごとの出力結果
+                - filename (str): 出力先の画像ファイル名
+                - diagram_type (str | None): 図の種類
+                - error (str | None): 失敗した場合はエラーの内容
+                - bytes (int): 書き込んだ画像のバイト数(失敗した場合は0)
+        """
         # ディレクトリが無ければ作成
         if not os.path.exists(self.save_dir):
             os.makedirs(self.save_dir, exist_ok=True)
 
         # 出力ファイルの重複チェック
-        self._assert_no_duplicate_filename(
-            itertools.chain.from_iterable([
-                wrapper.get_filenames() for wrapper in self.list_wrapper
-            ])
-        )
+        # (重複している場合は、どの画像も出力しない)
+        list_duplicate = self._get_duplicate_filenames(self.get_filenames())
+        if len(list_duplicate) > 0:
+            return [{
+                "filename": dup,
+                "diagram_type": None,
+                "error": f"Duplicate filename: {dup}.",
+                "bytes": 0
+            } for dup in list_duplicate]
 
         # 画像の出力
+        list_result = []
         for wrapper in self.list_wrapper:
-            wrapper.export_images()
+            list_result.extend(wrapper.export_images())
+        return list_result
 
     @staticmethod
-    def _assert_no_duplicate_filename(list_filename: List[str]) -> None:
+    def _get_duplicate_filenames(list_filename: List[str]) -> List[str]:
         """出力ファイル名の重複チェック
 
         Args:
             list_filename (str):
                 ファイル名の出力先
+
+        Returns:
+            list(str): 重複しているファイル名の一覧
         """
         counter = collections.Counter(list_filename)
-        duplicates = [item for item, count in counter.items() if count > 1]
-        if len(duplicates) > 0:
-            for dup in duplicates:
-                logger.error(f"Duplicate filename: {dup}.")
-            sys.exit(1)
+        return [item for item, count in counter.items() if count > 1]
@@ -1,2 +1,44 @@
 # KrokiサーバーのURL
 KROKI_SERVER_URL = "http://127.0.0.1:8080"
+# KrokiサーバーのURLを指定する環境変数(未指定ならKROKI_SERVER_URL)
+KROKI_URL_ENV = "PANDOC_CROSSREF_FILTER_KROKI_URL"
+# リクエストの時間を記録する最大数(古いものから捨てる)
+KROKI_LATENCY_SAMPLES = 10000
+
+# 変換結果のキャッシュの保存先を指定する環境変数(未指定ならキャッシュしない)
+RESULT_CACHE_DIR_ENV = "PANDOC_CROSSREF_FILTER_CACHE_DIR"
+# 変換結果のキャッシュの最大サイズ(MB)を指定する環境変数
+RESULT_CACHE_MAX_MB_ENV = "PANDOC_CROSSREF_FILTER_CACHE_MAX_MB"
+# 変換結果のキャッシュの最大サイズ(MB)のデフォルト値
+RESULT_CACHE_MAX_MB = 256
+
+# PlantUML/Mermaidの画像のキャッシュの保存先を指定する環境変数(未指定ならキャッシュしない)
+RENDER_CACHE_DIR_ENV = "PANDOC_CROSSREF_FILTER_RENDER_CACHE_DIR"
+# プロセス内でメモリに保持する、PlantUML/Mermaidの画像の最大数
+RENDER_MEMORY_CACHE_SIZE = 256
+
+# pandocのコマンド
+PANDOC_COMMAND = "pandoc"
+
+# エラーのレポート(JSON)の保存先を指定する環境変数
+DIAGNOSTICS_REPORT_ENV = "PANDOC_CROSSREF_FILTER_REPORT"
+
+# ブロックごとに読み込みながら変換する(ストリーミング)かどうかを指定する環境変数
+STREAMING_ENV = "PANDOC_CROSSREF_FILTER_STREAMING"
+
+# トップレベルのブロックを分けて並列に変換する場合の、ワーカープロセスの数を指定する環境変数
+PARALLEL_JOBS_ENV = "PANDOC_CROSSREF_FILTER_JOBS"
+
+# フィルターの処理時間を計測する(プロファイル)かどうかを指定する環境変数
+PROFILE_ENV = "PANDOC_CROSSREF_FILTER_PROFILE"
+# プロファイルの計測結果の保存先を指定する環境変数(未指定なら標準エラー出力に要約を出力するだけ)
+PROFILE_OUTPUT_ENV = "PANDOC_CROSSREF_FILTER_PROFILE_OUTPUT"
+# プロファイルの計測結果のフォーマット("json", "chrome")を指定する環境変数
+PROFILE_FORMAT_ENV = "PANDOC_CROSSREF_FILTER_PROFILE_FORMAT"
+# プロファイルで、メモリも計測する(tracemalloc)かどうかを指定する環境変数
+PROFILE_MEMORY_ENV = "PANDOC_CROSSREF_FILTER_PROFILE_MEMORY"
+# プロファイルで、要素ごとの処理時間を記録する(トレース)かどうかを指定する環境変数
+PROFILE_TRACE_ENV = "PANDOC_CROSSREF_FILTER_TRACE"
+
+# 実行結果のメトリクス(JSON)の保存先を指定する環境変数
+METRICS_ENV = "PANDOC_CROSSREF_FILTER_METRICS"
@@ -0,0 +1,229 @@
+import re
+from typing import List, Dict
+
+import panflute as pf
+
+from . import utils
+from .registry import ReferenceRegistry
+from .cross_ref_base import CrossRefBase
+from .numbering import NumberingEngine
+
+
+logger = utils.get_logger()
+
+
+class CounterCrossRef(CrossRefBase):
+    def __init__(self,
+                 name: str,
+                 config: Dict,
+                 default_title_template: str,
+                 enable_link: bool,
+                 registry: ReferenceRegistry | None = None,
+                 numbering: NumberingEngine | None = None) -> None:
+        """連番を付けて参照する要素の管理(数式、コードリストなど)
+
+        Args:
+            name (str):
+                設定のキーの接頭辞 (例: "equation")
+            config (dict):
+                設定
+                - {name}_number_count_level (int):
+                    番号の連番のカウントをするレベル
+                    例えば0なら、ドキュメント全体で連番をカウントする
+                    例えば1なら、第一階層である章ごとにカウントする
+                    負の値なら、常に一番深い階層ごとにカウントする
+                - {name}_title_template (str):
+                    番号のタイトルのテンプレート
+                - delimiter (str):
+                    番号の区切り
+            default_title_template (str):
+                番号のタイトルのテンプレートのデフォルト値
+            enable_link (bool):
+                参照にリンクを張るかどうか
+            registry (ReferenceRegistry | None):
+                参照の登録先(セクション、図、表と共有する)。Noneの場合は新しく作成する
+            numbering (NumberingEngine | None):
+                連番の管理(セクション番号と共有する)。Noneの場合は新しく作成する
+        """
+        self.number_count_level: int = int(
+            config.get(f"{name}_number_count_level", "0"))
+        self.title_template: str = \
+            config.get(f"{name}_title_template", default_title_template)
+        self.delimiter: str = \
+            config.get("delimiter", "-")
+        super().__init__(enable_link, registry)
+        # 連番
+        numbering = numbering if numbering is not None else NumberingEngine()
+        self.counter = numbering.add_counter(self.number_count_level, self.delimiter)
+
+    def register(self, identifier: str, title: str) -> str:
+        """番号を付けて参照を登録する
+
+        Args:
+            identifier (str):
+                ID
+            title (str):
+                タイトル
+
+        Returns:
+            str: 番号
+        """
+        number = self.counter.next_number()
+        # 登録(重複登録はエラーとして記録し、最初の登録を残す)
+        if not self.registry.add(identifier, number, title):
+            self.registry.diagnostics.error(
+                "duplicate_identifier", f"Duplicate identifier: '{identifier}'")
+        return number
+
+    def _format_reference(self, key: str, add_title: bool, is_header: bool) -> str:
+        """参照キーから、番号の文字列を作成する
+
+        Args:
+            key (str):
+                参照キー
+            add_title (bool):
+                タイトルを追加するかどうか
+            is_header (bool):
+                ヘッダーかどうか(使わない)
+
+        Returns:
+            str:
+                番号の文字列
+        """
+        record = self.registry.get(key)
+        reference_string = self.title_template % record.number
+
+        if add_title is True and record.title != "":
+            reference_string += " " + record.title
+        return reference_string
+
+    def get_numbering_state(self) -> Dict:
+        """番号の状態を取得する(他のドキュメントの続きから番号を付けるために使う)
+
+        Returns:
+            dict: 連番をカウントする辞書
+        """
+        return self.counter.get_state()
+
+    def set_numbering_state(self, state: Dict) -> None:
+        """番号の状態を設定する
+
+        Args:
+            state (dict):
+                get_numbering_state()で取得した状態
+        """
+        self.counter.set_state(state)
+
+
+class EquationCrossRef(CounterCrossRef):
+    def __init__(self,
+                 config: Dict,
+                 enable_link: bool,
+                 registry: ReferenceRegistry | None = None,
+                 numbering: NumberingEngine | None = None) -> None:
+        """数式番号の管理
+
+        Args:
+            config (dict):
+                設定
+                - equation_number_count_level (int):
+                    数式番号の連番のカウントをするレベル
+                - equation_title_template (str):
+                    数式番号のテンプレート
+                - delimiter (str):
+                    数式番号の区切り
+            その他:
+                CounterCrossRefと同じ
+        """
+        super().__init__("equation", config, "(%s)", enable_link, registry, numbering)
+
+    def register_equation(self, elem: pf.Math) -> None | pf.Element:
+        """数式番号の登録
+
+        "$$ 数式 $$ {#eq:XXX}"のように、ディスプレイ数式の直後にIDが書かれている場合に、
+        数式の右側に番号を追加し、IDの文字列を削除する
+
+        Args:
+            elem (pf.Math):
+                数式
+
+        Returns:
+            None | pf.Element:
+                Noneではない場合、要素を差し替えます。
+        """
+        if elem.format != "DisplayMath":
+            return None
+
+        # 直後の"{#eq:XXX}"を探す
+        label = elem.next
+        if isinstance(label, pf.Space):
+            label = label.next
+        if not isinstance(label, pf.Str):
+            return None
+        match = re.fullmatch(r"\{#(eq:[^\s\}]+)\}", label.text)
+        if match is None:
+            return None
+        identifier = match.group(1)
+
+        # IDの文字列を削除する
+        # (walk()で後から処理される要素なので、ここで削除しても問題ない)
+        del elem.container[elem.index + 1:label.index + 1]
+
+        # 数式の右側に番号を追加する
+        number = self.register(identifier, "")
+        elem.text = elem.text + r" \qquad " + self.title_template % number
+
+        if self.enable_link:
+            # 参照元の定義
+            span = pf.Span(elem, identifier=identifier)
+            if self.format_tweaks is not None:
+                self.format_tweaks.add_identifier(span, "")
+            return span
+        return None
+
+
+class ListingCrossRef(CounterCrossRef):
+    def __init__(self,
+                 config: Dict,
+                 enable_link: bool,
+                 registry: ReferenceRegistry | None = None,
+                 numbering: NumberingEngine | None = None) -> None:
+        """コードリスト番号の管理
+
+        Args:
+            config (dict):
+                設定
+                - listing_number_count_level (int):
+                    コードリスト番号の連番のカウントをするレベル
+                - listing_title_template (str):
+                    コードリスト番号のタイトルのテンプレート
+                - delimiter (str):
+                    コードリスト番号の区切り
+            その他:
+                CounterCrossRefと同じ
+        """
+        super().__init__("listing", config, "[リスト%s]", enable_link, registry, numbering)
+
+    def register_listing(self, elem: pf.CodeBlock) -> None | List[pf.Element]:
+        """コードリスト番号の登録
+
+        IDが"lst:"で始まるコードブロックに、番号とキャプション(caption属性)を追加する
+
+        Args:
+            elem (pf.CodeBlock):
+                コードブロック
+
+        Returns:
+            None | List[pf.Element]:
+                Noneではない場合、キャプションを追加して要素を差し替えます。
+        """
+        if not elem.identifier.startswith("lst:"):
+            return None
+
+        title = elem.attributes.get("caption", "")
+        number = self.register(elem.identifier, title)
+
+        caption_text = self.title_template % number
+        if title:
+            caption_text += " " + title
+        return [pf.Para(pf.Str(caption_text)), elem]
@@ -0,0 +1,177 @@
+import os
+import json
+import sqlite3
+import urllib.parse
+from typing import List, Dict, Tuple, Sequence
+
+from . import utils
+
+
+logger = utils.get_logger()
+
+# テーブルの定義
+# (executescript()は実行中のトランザクションをコミットしてしまうので、1文ずつexecute()する)
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS chapters (
+        chapter TEXT PRIMARY KEY,
+        position INTEGER NOT NULL,
+        state TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS refs (
+        identifier TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        number TEXT NOT NULL,
+        title TEXT NOT NULL,
+        chapter TEXT NOT NULL
+    )
+    """,
+)
+
+
+class CrossDocIndexError(Exception):
+    """インデックスの作成に失敗したときの例外"""
+
+
+class CrossDocIndex():
+    def __init__(self, path: str) -> None:
+        """複数のドキュメント(章)をまたいだ参照のインデックス
+
+        全章を事前にスキャンして(prescan.build_index())、以下をSQLiteに保存しておく
+        - 参照ID、種類、番号、タイトル、定義されている章
+        - 章ごとの番号の開始状態(前の章までのセクション番号、図番号、表番号のカウント)
+
+        これにより、各章を独立に(並列に)変換しても、
+        本全体で連続した番号を付け、他の章の参照を解決できる
+
+        Args:
+            path (str):
+                インデックスのファイルのパス
+        """
+        self.path: str = path
+        self.connection: sqlite3.Connection | None = None
+        # 読み込み済みの参照(参照ID -> (番号, タイトル) または None)
+        self.dict_reference: Dict[str, Tuple[str, str] | None] = {}
+
+    def _connect(self, read_only: bool = True) -> sqlite3.Connection:
+        """インデックスに接続する
+
+        Args:
+            read_only (bool):
+                読み込み専用で接続するかどうか
+                (複数のプロセスから同時に読み込めるように、変換時は読み込み専用にする)
+        """
+        if self.connection is None:
+            if read_only:
+                uri = "file:" + urllib.parse.quote(os.path.abspath(self.path)) + "?mode=ro"
+                self.connection = sqlite3.connect(uri, uri=True)
+            else:
+                self.connection = sqlite3.connect(self.path)
+        return self.connection
+
+    def close(self) -> None:
+        """インデックスとの接続を閉じる"""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def get_reference(self, identifier: str) -> Tuple[str, str] | None:
+        """参照IDから、番号とタイトルを取得する
+
+        Args:
+            identifier (str):
+                参照ID
+
+        Returns:
+            tuple(str, str) | None:
+                番号とタイトル。見つからなければNone
+        """
+        if identifier not in self.dict_reference:
+            row = self._connect().execute(
+                "SELECT number, title FROM refs WHERE identifier = ?",
+                (identifier,)).fetchone()
+            self.dict_reference[identifier] = None if row is None else (row[0], row[1])
+        return self.dict_reference[identifier]
+
+    def get_chapter_state(self, chapter: str) -> Dict | None:
+        """章の番号の開始状態を取得する
+
+        Args:
+            chapter (str):
+                章(入力ファイルのパス)
+
+        Returns:
+            dict | None:
+                番号の開始状態(get_numbering_state()の戻り値)。見つからなければNone
+        """
+        row = self._connect().execute(
+            "SELECT state FROM chapters WHERE chapter = ?",
+            (self.normalize_chapter(chapter),)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def write(self, list_chapter: Sequence[Tuple[str, Dict, List[Tuple[str, str, str, str]]]]) -> None:
+        """インデックスを作り直す
+
+        Args:
+            list_chapter (list(tuple(str, dict, list))):
+                章ごとの以下の値の一覧(本の順番に並べる)
+                - 章(入力ファイルのパス)
+                - 章の始まりの番号の状態
+                - 章で定義されている参照の一覧(参照ID、種類、番号、タイトル)
+
+        Raises:
+            CrossDocIndexError: 参照IDが複数の章で重複している
+        """
+        connection = self._connect(read_only=False)
+        # テーブルの削除と作成も含めて1つのトランザクションにする
+        # (失敗した場合は、元のインデックスに戻す)
+        connection.isolation_level = None
+        connection.execute("BEGIN")
+        try:
+            connection.execute("DROP TABLE IF EXISTS chapters")
+            connection.execute("DROP TABLE IF EXISTS refs")
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+            for position, (chapter, state, list_ref) in enumerate(list_chapter):
+                chapter = self.normalize_chapter(chapter)
+                connection.execute(
+                    "INSERT INTO chapters VALUES (?, ?, ?)",
+                    (chapter, position, json.dumps(state)))
+                for identifier, kind, number, title in list_ref:
+                    try:
+                        connection.execute(
+                            "INSERT INTO refs VALUES (?, ?, ?, ?, ?)",
+                            (identifier, kind, number, title, chapter))
+                    except sqlite3.IntegrityError:
+                        raise CrossDocIndexError(
+                            f"Duplicate identifier: '{identifier}' in {chapter}")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self.dict_reference = {}
+
+    def normalize_chapter(self, chapter: str) -> str:
+        """章の名前(入力ファイルのパス)を正規化する
+
+        相対パスと絶対パスのどちらで指定しても同じ章になるように、
+        インデックスのファイルのディレクトリからの相対パスにする
+
+        Args:
+            chapter (str):
+                章(入力ファイルのパス。相対パスはカレントディレクトリから)
+
+        Returns:
+            str: 正規化した章の名前
+        """
+        root = os.path.dirname(os.path.abspath(self.path))
+        path = os.path.abspath(chapter)
+        try:
+            path = os.path.relpath(path, root)
+        except ValueError:
+            # Windowsで、インデックスと異なるドライブにある場合
+            pass
+        return os.path.normcase(path)
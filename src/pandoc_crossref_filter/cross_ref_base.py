@@ -0,0 +1,137 @@
+from typing import List, Tuple
+
+import panflute as pf
+
+from . import utils
+from .registry import ReferenceRegistry, PendingRef
+
+
+class CrossRefBase():
+    # ヘッダー内の参照を、リンクを張らずにヘッダー用の文字列にするかどうか
+    # (Falseの場合は、ヘッダー内でも通常の参照と同じ文字列とリンクにする)
+    format_header_reference: bool = False
+
+    def __init__(self,
+                 enable_link: bool,
+                 registry: ReferenceRegistry | None = None) -> None:
+        """番号を付けて参照する要素の管理の基底クラス
+
+        参照の登録と書き換え(add_reference()、replace_reference()など)は共通にし、
+        参照の文字列の作成(_format_reference())だけを要素の種類ごとに実装する
+
+        Args:
+            enable_link (bool):
+                参照にリンクを張るかどうか
+            registry (ReferenceRegistry | None):
+                参照の登録先(他の種類の要素と共有する)。Noneの場合は新しく作成する
+        """
+        self.enable_link: bool = enable_link
+        # 複数の出力フォーマットを作る場合の差分の管理(FormatTweaks)
+        self.format_tweaks = None
+
+        # 参照の登録先
+        self.registry: ReferenceRegistry = \
+            registry if registry is not None else ReferenceRegistry()
+        # 書き換えるべき項目を記憶する(最後に書き換える)
+        self.list_replace_target: List[PendingRef] = []
+
+    def add_reference(self,
+                      key: str,
+                      is_header: bool = False) -> pf.Str | pf.Link:
+        """参照を上書きするべき対象を一時的に記憶しておく
+
+        参照先が登録済みの場合は、記憶せずにすぐに書き換える
+
+        Args:
+            key (str): 参照の目印となるキー
+            is_header (bool): 上書き対象がヘッダーかどうか
+
+        Returns:
+            pf.Str | pf.Link:
+                参照追加後の要素
+        """
+        key, is_add_title = utils.split_key_title(key)
+        if self.registry.has(key):
+            # 登録済みの参照は、すぐに書き換える
+            self.registry.num_backward_ref += 1
+            target = pf.Str(self.get_reference_string(key, is_add_title, is_header))
+        else:
+            # 後続で定義されている参照は、最後に書き換える
+            self.registry.num_forward_ref += 1
+            target = pf.Str("")
+            self.list_replace_target.append(
+                PendingRef(key, target, is_add_title, is_header,
+                           self.registry.diagnostics.get_position()))
+
+        # ヘッダー内の参照なら終了
+        if is_header and self.format_header_reference:
+            return target
+
+        if self.enable_link:
+            # 参照先へのリンクを張る
+            return pf.Link(target, url=f"#{key}")
+        else:
+            return target
+
+    def replace_reference(self) -> None:
+        """参照の上書き"""
+        for replace_target in self.list_replace_target:
+            replace_target.target.text = self.get_pending_string(replace_target)
+
+    def get_pending_string(self, pending: PendingRef) -> str:
+        """書き換えを待っている参照の文字列を返す
+
+        Args:
+            pending (PendingRef):
+                書き換えを待っている参照
+
+        Returns:
+            str:
+                参照の文字列
+        """
+        return self.get_reference_string(
+            pending.key, pending.add_title, pending.is_header, pending.position)
+
+    def get_reference_string(self,
+                             key: str,
+                             add_title: bool,
+                             is_header: bool = False,
+                             position: Tuple[int | None, str | None] | None = None) -> str:
+        """参照キーから、参照の文字列を返す
+
+        同じ参照の文字列は、1回だけ作成する
+
+        Args:
+            key (str):
+                参照キー
+            add_title (bool):
+                タイトルを追加するかどうか
+            is_header (bool):
+                ヘッダーかどうか(format_header_referenceがFalseの場合は使わない)
+            position (tuple | None):
+                引用の位置(参照が見つからない場合のエラーの報告に使う)
+
+        Returns:
+            str:
+                参照の文字列
+        """
+        return self.registry.get_reference_string(
+            key, add_title, is_header and self.format_header_reference,
+            self._format_reference, position)
+
+    def _format_reference(self, key: str, add_title: bool, is_header: bool) -> str:
+        """参照キーから、参照の文字列を作成する(要素の種類ごとに実装する)
+
+        Args:
+            key (str):
+                参照キー
+            add_title (bool):
+                タイトルを追加するかどうか
+            is_header (bool):
+                ヘッダーかどうか
+
+        Returns:
+            str:
+                参照の文字列
+        """
+        raise NotImplementedError
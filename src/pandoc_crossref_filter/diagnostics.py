@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+from typing import List, Dict, Tuple
+
+import panflute as pf
+
+from . import utils
+from . import config
+
+
+logger = utils.get_logger()
+
+# 見つからない参照を書き換える文字列
+MISSING_REFERENCE_TEXT = "??"
+
+
+class Diagnostics():
+    def __init__(self) -> None:
+        """エラーの収集
+
+        エラーが見つかってもすぐには終了せずに、ドキュメント全体を処理してから、
+        すべてのエラーをまとめて報告する。
+        """
+        # エラーの一覧
+        # - code (str): エラーの種類
+        # - message (str): エラーの内容
+        # - block (int | None): トップレベルのブロックの番号(1始まり)
+        # - header (str | None): 直前のヘッダー
+        self.list_error: List[Dict] = []
+
+        # 処理中の要素(エラーの位置の取得に使う)
+        self.current_elem: pf.Element | None = None
+        # 処理中のトップレベルのブロックの番号(0始まり)。ドキュメントの外で処理する場合に指定する
+        self.block_index: int | None = None
+        # ドキュメントのブロックを分けて処理する場合の、先頭のブロックの番号(0始まり)
+        self.block_offset: int = 0
+        # 直前のヘッダー
+        self.header_elem: pf.Header | None = None
+        self.header_title: str | None = None
+
+    def set_header(self, elem: pf.Header) -> None:
+        """直前のヘッダーを設定する"""
+        self.header_elem = elem
+        self.header_title = None
+
+    def get_position(self) -> Tuple[int | None, str | None]:
+        """処理中の要素の位置を取得する
+
+        Returns:
+            int | None: トップレベルのブロックの番号(1始まり)
+            str | None: 直前のヘッダー
+        """
+        block_index = self.block_index
+        if self.current_elem is not None:
+            root_elem = utils.get_root_elem(self.current_elem)
+            # メタデータの要素は、ブロックの番号を持たない
+            if isinstance(root_elem.parent, pf.Doc) and root_elem.index is not None:
+                block_index = self.block_offset + root_elem.index
+        if self.header_elem is not None and self.header_title is None:
+            self.header_title = pf.stringify(self.header_elem.content)
+        return (None if block_index is None else block_index + 1,
+                self.header_title)
+
+    def error(self,
+              code: str,
+              message: str,
+              position: Tuple[int | None, str | None] | None = None) -> None:
+        """エラーを記録する
+
+        Args:
+            code (str):
+                エラーの種類 (例: "missing_reference")
+            message (str):
+                エラーの内容
+            position (tuple | None):
+                エラーの位置(get_position()の戻り値)。Noneの場合は処理中の要素の位置
+        """
+        if position is None:
+            position = self.get_position()
+        self.list_error.append({
+            "code": code,
+            "message": message,
+            "block": position[0],
+            "header": position[1]
+        })
+
+    def has_errors(self) -> bool:
+        """エラーがあるかどうか"""
+        return len(self.list_error) > 0
+
+    def get_sorted_errors(self) -> List[Dict]:
+        """エラーの一覧を、ドキュメント中の位置の順に並べて返す
+
+        位置が分からないエラー(画像の出力の失敗など)は最後にする
+        """
+        return sorted(self.list_error,
+                      key=lambda error: (error["block"] is None, error["block"] or 0))
+
+    def get_report_text(self) -> str:
+        """テキスト形式のレポートを取得する"""
+        list_line = [f"{len(self.list_error)} error(s) found:"]
+        for error in self.get_sorted_errors():
+            list_position = []
+            if error["block"] is not None:
+                list_position.append(f"block {error['block']}")
+            if error["header"] is not None:
+                list_position.append(f"under '{error['header']}'")
+            line = f"  [{error['code']}] {error['message']}"
+            if list_position:
+                line += f" ({', '.join(list_position)})"
+            list_line.append(line)
+        return "\n".join(list_line)
+
+    def get_report(self) -> Dict:
+        """JSON形式のレポートを取得する"""
+        return {
+            "error_count": len(self.list_error),
+            "errors": self.get_sorted_errors()
+        }
+
+    def write_report(self, path: str) -> None:
+        """JSON形式のレポートを保存する
+
+        Args:
+            path (str):
+                保存先のパス
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.get_report(), f, ensure_ascii=False, indent=2)
+
+    def exit_if_errors(self) -> None:
+        """レポートを出力し、エラーがあれば終了する
+
+        環境変数(config.DIAGNOSTICS_REPORT_ENV)が指定されていれば、JSON形式のレポートを保存する
+        """
+        report_path = os.environ.get(config.DIAGNOSTICS_REPORT_ENV)
+        if report_path:
+            self.write_report(report_path)
+        if self.has_errors():
+            logger.error(self.get_report_text())
+            sys.exit(1)
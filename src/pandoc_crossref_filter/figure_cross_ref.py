@@ -1,16 +1,23 @@
-import sys
 from typing import List, Dict
 
 import panflute as pf
 
 from . import utils
+from .registry import ReferenceRegistry
+from .cross_ref_base import CrossRefBase
+from .numbering import NumberingEngine
 
 
 logger = utils.get_logger()
 
 
-class FigureCrossRef():
-    def __init__(self, config: Dict, enable_link: bool, disable_width: bool) -> None:
+class FigureCrossRef(CrossRefBase):
+    def __init__(self,
+                 config: Dict,
+                 enable_link: bool,
+                 disable_width: bool,
+                 registry: ReferenceRegistry | None = None,
+                 numbering: NumberingEngine | None = None) -> None:
         """コンストラクタ
 
         Args:
@@ -31,6 +38,10 @@ class FigureCrossRef():
             disable_width (bool):
                 図の幅の指定を無効にするかどうか
                 AzureDevOpsの場合、幅の指定があると、画像が表示されないため、幅の指定を無効にするオプションを追加
+            registry (ReferenceRegistry | None):
+                参照の登録先(セクション、表と共有する)。Noneの場合は新しく作成する
+            numbering (NumberingEngine | None):
+                連番の管理(セクション番号と共有する)。Noneの場合は新しく作成する
         """
         self.figure_number_count_level: int = int(
             config.get("figure_number_count_level", "0"))
@@ -38,34 +49,34 @@ class FigureCrossRef():
             config.get("figure_title_template", "[図%s]")
         self.delimiter: str = \
             config.get("delimiter", "-")
-        self.enable_link: bool = enable_link
+        super().__init__(enable_link, registry)
         self.disable_width: bool = disable_width
-
-        # 参照用の図番号を格納する辞書
-        self.references: Dict = {}
-        # 参照用の図のタイトルを格納する辞書
-        self.references_title: Dict = {}
-        # 書き換えるべき項目を記憶する(最後に書き換える)
-        self.list_replace_target: List[Dict] = []
-        # 図番号の連番をカウントする辞書
-        self.dict_fig_number_increment: Dict = {}
+        # 番号を付けた図の数
+        self.num_figure: int = 0
+        # 図番号の連番
+        numbering = numbering if numbering is not None else NumberingEngine()
+        self.counter = numbering.add_counter(self.figure_number_count_level, self.delimiter)
 
     def register_figure(self,
-                        elem: pf.Image | pf.Figure,
-                        list_present_section_numbers: List
+                        elem: pf.Image | pf.Figure
                         ) -> pf.Element | List[pf.Element]:
         """図番号の登録
 
         Args:
             elem: pf.Image | pf.Figure:
                 図要素
-            list_present_section_numbers: List:
-                セクション番号
 
         Returns:
             pf.Element | List[pf.Element]:
                 Noneではない場合、キャプションを追加して要素を差し替えます。
         """
+        # 出力フォーマットごとに幅の指定を変えられるように記憶しておく
+        if self.format_tweaks is not None:
+            if isinstance(elem, pf.Image):
+                self.format_tweaks.add_width_image(elem)
+            elif isinstance(elem, pf.Figure):
+                self.format_tweaks.add_width_image(elem.content[0].content[0])
+
         # disable_widthがTrueの場合、図の幅の指定を無効にする
         if self.disable_width:
             if isinstance(elem, pf.Image):
@@ -82,8 +93,9 @@ class FigureCrossRef():
         # DefinitionListがすでに定義されている場合は、記載が重複するのでエラーにする
         root_elem = utils.get_root_elem(elem)
         if isinstance(root_elem, pf.DefinitionList):
-            logger.error(f"Duplicate definition: '{elem.identifier}'")
-            sys.exit(1)
+            self.registry.diagnostics.error(
+                "duplicate_definition", f"Duplicate definition: '{elem.identifier}'")
+            return elem
 
         # 親要素にFigureが存在する場合は、子のImageでは何もしない
         # (キャプションに何も設定しないと、FigureではなくImageになる)
@@ -92,7 +104,8 @@ class FigureCrossRef():
             return elem
 
         # 図番号の取得
-        fig_number = self._get_figure_number(list_present_section_numbers)
+        fig_number = self.counter.next_number()
+        self.num_figure += 1
 
         # 図タイトルの取得
         # .contentが無いと、なぜかキャプションが二重になる
@@ -109,6 +122,8 @@ class FigureCrossRef():
             image = elem.content[0].content[0]
             if self.enable_link:
                 # 参照元の定義
+                if self.format_tweaks is not None:
+                    self.format_tweaks.add_identifier(image, image.identifier)
                 image.identifier = elem.identifier
             return [pf.DefinitionList(pf.DefinitionItem([image], [caption]))]
         else:
@@ -118,8 +133,7 @@ class FigureCrossRef():
 
     def register_external_caption(self,
                                   caption: pf.Para,
-                                  identifier: str,
-                                  list_present_section_numbers: List) -> None:
+                                  identifier: str) -> None:
         """外部のキャプションの登録
 
         Markdown Preview EnhancedでPlantUMLのプレビューを実行するときに使用する
@@ -129,11 +143,10 @@ class FigureCrossRef():
                 キャプションを表す文章
             identifier: str:
                 ID
-            list_present_section_numbers: List:
-                セクション番号
         """
         # 図番号の取得
-        fig_number = self._get_figure_number(list_present_section_numbers)
+        fig_number = self.counter.next_number()
+        self.num_figure += 1
 
         # identifierの登録
         self._add_figure_identifier(identifier, fig_number, pf.stringify(caption.content))
@@ -156,100 +169,56 @@ class FigureCrossRef():
             fig_title (str):
                 図のタイトル
         """
-        # 重複登録はエラーで落とす
-        if identifier in self.references:
-            logger.error(f"Duplicate identifier: '{identifier}'")
-            sys.exit(1)
+        # 登録(重複登録はエラーとして記録し、最初の登録を残す)
+        if not self.registry.add(identifier, fig_number, fig_title):
+            self.registry.diagnostics.error(
+                "duplicate_identifier", f"Duplicate identifier: '{identifier}'")
 
-        # 登録
-        self.references[identifier] = fig_number
+    def get_stats(self) -> Dict:
+        """登録の統計を取得する
 
-        # タイトルも登録
-        self.references_title[identifier] = fig_title
+        Returns:
+            dict:
+                - figures (int): 番号を付けた図の数
+        """
+        return {"figures": self.num_figure}
 
-    def _get_figure_number(self,
-                           list_present_section_numbers: List[int]) -> str:
-        """図番号の取得
-
-        Args:
-            list_present_section_numbers (list):
-                セクション番号の配列
+    def get_numbering_state(self) -> Dict:
+        """番号の状態を取得する(他のドキュメントの続きから番号を付けるために使う)
 
         Returns:
-            str: 図番号を返します。
+            dict: 図番号の連番をカウントする辞書
         """
-        # カウントを開始するレベルの調整
-        if self.figure_number_count_level >= 0 and \
-           len(list_present_section_numbers) > self.figure_number_count_level:
-            list_present_section_numbers = \
-                list_present_section_numbers[:self.figure_number_count_level]
-        # 番号のカウント
-        start_number = \
-            self.delimiter.join(map(str, list_present_section_numbers))
-        if start_number not in self.dict_fig_number_increment:
-            self.dict_fig_number_increment[start_number] = 0
-        self.dict_fig_number_increment[start_number] += 1
-
-        if start_number != "":
-            fig_number = \
-                start_number + \
-                self.delimiter + \
-                str(self.dict_fig_number_increment[start_number])
-        else:
-            fig_number = str(self.dict_fig_number_increment[start_number])
-        return fig_number
+        return self.counter.get_state()
 
-    def add_reference(self,
-                      key: str) -> pf.Str | pf.Link:
-        """参照を上書きするべき対象を一時的に記憶しておく
+    def set_numbering_state(self, state: Dict) -> None:
+        """番号の状態を設定する
 
         Args:
-            key (str): 参照の目印となるキー
-
-        Returns:
-            pf.Str | pf.Link:
-                参照追加後の要素
+            state (dict):
+                get_numbering_state()で取得した状態
         """
-        key, is_add_title = utils.split_key_title(key)
-        target = pf.Str("")
-        self.list_replace_target.append({
-            "key": key,
-            "target": target,
-            "add_title": is_add_title
-        })
-
-        if self.enable_link:
-            # 参照先へのリンクを張る
-            return pf.Link(target, url=f"#{key}")
-        else:
-            return target
-
-    def replace_reference(self) -> None:
-        """参照の上書き"""
-        for replace_target in self.list_replace_target:
-            replace_target["target"].text = self.get_reference_string(
-                replace_target["key"], replace_target["add_title"])
+        self.counter.set_state(state)
 
-    def get_reference_string(self, key: str, add_title: bool) -> str:
-        """参照キーから、図番号の文字列を返す
+    def _format_reference(self, key: str, add_title: bool, is_header: bool) -> str:
+        """参照キーから、図番号の文字列を作成する
 
         Args:
             key (str):
                 参照キー
             add_title (bool):
                 タイトルを追加するかどうか
+            is_header (bool):
+                ヘッダーかどうか(使わない)
 
         Returns:
             str:
-                セクション番号の文字列
+                図番号の文字列
         """
-        # 参照キーが見つからない
-        if key not in self.references:
-            logger.error(f"No such reference: '{key}'.")
-            sys.exit(1)
-        fig_number = self.figure_title_template % self.references[key]
+        record = self.registry.get(key)
+        fig_number = self.figure_title_template % record.number
 
         if add_title:
-            fig_title = self.references_title[key]
+            fig_title = record.title
             fig_number = fig_number + " " + fig_title
         return fig_number
@@ -0,0 +1,113 @@
+from typing import List, Tuple
+
+import panflute as pf
+
+from . import utils
+
+
+logger = utils.get_logger()
+
+
+def get_format_options(output_format: str) -> Tuple[bool, bool]:
+    """出力フォーマットごとの設定を取得する
+
+    Args:
+        output_format (str):
+            出力フォーマット
+
+    Returns:
+        bool: 参照にリンクを張るかどうか
+        bool: 図の幅の指定を無効にするかどうか
+    """
+    # 出力先がWordの場合のみ、相互参照のリンクを実装する
+    # (出力先がMarkdonwやHTML(Markdown Preview Enhancedのプレビュー)の場合、
+    # リンクがうまく動作しないパターンがある)
+    enable_link = output_format == "docx"
+    # 図の幅の指定を無効にするかどうか
+    # AzureDevOpsの場合、幅の指定があると、画像が表示されないため、幅の指定を無効にするオプションを追加
+    disable_width = output_format == "gfm"
+    return enable_link, disable_width
+
+
+def sort_formats(list_format: List[str]) -> List[str]:
+    """FormatTweaks.apply()で順番に適用できるように、出力フォーマットを並べ替える
+
+    リンクあり -> リンクなし、幅あり -> 幅なしの順になる
+    (例: docx -> html -> gfm)
+    """
+    def get_order(output_format):
+        enable_link, disable_width = get_format_options(output_format)
+        return (not enable_link, disable_width)
+    return sorted(list_format, key=get_order)
+
+
+class FormatTweaks():
+    def __init__(self) -> None:
+        """出力フォーマットごとの差分の管理
+
+        1回のフィルター適用(リンクあり、幅あり)の結果から、複数の出力フォーマットを作るために、
+        フォーマットごとに変わる要素を記憶しておき、あとから書き換える。
+        書き換えは元に戻せないので、sort_formats()の順に適用すること。
+        """
+        # 参照のリンク (リンクを含む親要素, リンク)
+        self.list_link: List[Tuple[pf.Element, pf.Link]] = []
+        # 参照元として設定したidentifier (要素, 元のidentifier)
+        self.list_identifier: List[Tuple[pf.Element, str]] = []
+        # 幅の指定がある画像
+        self.list_width_image: List[pf.Image] = []
+
+        self.enable_link: bool = True
+        self.disable_width: bool = False
+
+    def add_link(self, parent: pf.Element, link: pf.Element) -> None:
+        """参照のリンクを記憶する
+
+        Args:
+            parent (pf.Element):
+                リンクを含む親要素(置き換える前のpf.Citeの親要素)
+            link (pf.Element):
+                add_reference()の戻り値。pf.Link以外は何もしない
+        """
+        if isinstance(link, pf.Link):
+            self.list_link.append((parent, link))
+
+    def add_identifier(self, elem: pf.Element, original: str) -> None:
+        """参照元として設定したidentifierを記憶する"""
+        self.list_identifier.append((elem, original))
+
+    def add_width_image(self, image: pf.Element) -> None:
+        """幅の指定がある画像を記憶する"""
+        if isinstance(image, pf.Image) and "width" in image.attributes:
+            self.list_width_image.append(image)
+
+    def apply(self, output_format: str) -> None:
+        """出力フォーマットに合わせてドキュメントを書き換える
+
+        Args:
+            output_format (str):
+                出力フォーマット
+        """
+        enable_link, disable_width = get_format_options(output_format)
+        if enable_link and not self.enable_link or \
+           not disable_width and self.disable_width:
+            logger.error(f"Cannot apply the format '{output_format}' after removing links or widths.")
+            raise ValueError(output_format)
+
+        if not enable_link and self.enable_link:
+            self._remove_links()
+        if disable_width and not self.disable_width:
+            for image in self.list_width_image:
+                image.attributes.pop("width", None)
+        self.enable_link = enable_link
+        self.disable_width = disable_width
+
+    def _remove_links(self) -> None:
+        """参照のリンクを外し、参照元のidentifierを元に戻す"""
+        for parent, link in self.list_link:
+            content = parent.content.list
+            for i, elem in enumerate(content):
+                if elem is link:
+                    content[i:i + 1] = link.content.list
+                    break
+        for elem, original in self.list_identifier:
+            elem.identifier = original
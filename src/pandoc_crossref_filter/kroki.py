@@ -0,0 +1,226 @@
+import os
+import time
+import hashlib
+import tempfile
+import collections
+import threading
+from typing import Dict
+
+import requests
+
+from . import utils
+from . import profiler
+from .config import (
+    KROKI_SERVER_URL,
+    KROKI_URL_ENV,
+    KROKI_LATENCY_SAMPLES,
+    RENDER_CACHE_DIR_ENV,
+    RENDER_MEMORY_CACHE_SIZE
+)
+
+
+logger = utils.get_logger()
+
+
+class KrokiConnectionError(Exception):
+    """Krokiサーバーに接続できなかったときの例外"""
+
+
+class KrokiRenderError(Exception):
+    """Krokiサーバーが画像の変換に失敗したときの例外"""
+
+
+class KrokiClient():
+    """Krokiサーバーのクライアント
+
+    - 1つのセッション(コネクションプール)を使いまわして、Krokiサーバーに接続する
+    - 変換した画像をメモリに保持し、同じプロセス内では同じ内容の図を再度変換しない
+    - キャッシュの保存先が指定されていれば、変換した画像をファイルにもキャッシュし、
+      プロセスをまたいで同じ内容の図を再度変換しない
+    """
+
+    def __init__(self, server_url: str, cache_dir: str | None = None) -> None:
+        """コンストラクタ
+
+        Args:
+            server_url (str):
+                KrokiサーバーのURL
+            cache_dir (str | None):
+                変換した画像のキャッシュの保存先。Noneならキャッシュしない
+        """
+        self.server_url: str = server_url
+        self.cache_dir: str | None = cache_dir
+        self.session: requests.Session = requests.Session()
+        # メモリ上のキャッシュ(古いものから削除する)
+        self.memory_cache: collections.OrderedDict = collections.OrderedDict()
+        # 複数のスレッドから使われる場合のためのロック
+        self.lock: threading.Lock = threading.Lock()
+
+        # 統計(get_stats()を参照)
+        self.num_request: int = 0
+        self.num_error: int = 0
+        self.num_memory_cache_hit: int = 0
+        self.num_file_cache_hit: int = 0
+        # リクエストの時間(秒)
+        self.latencies: collections.deque = collections.deque(maxlen=KROKI_LATENCY_SAMPLES)
+
+    def render(self, diagram_type: str, output_format: str, source: str) -> bytes:
+        """図のテキストを画像に変換する
+
+        Args:
+            diagram_type (str):
+                図の種類("plantuml", "mermaid")
+            output_format (str):
+                画像のフォーマット("png", "svg")
+            source (str):
+                図のテキスト
+
+        Returns:
+            bytes: 画像のバイト列
+
+        Raises:
+            KrokiConnectionError: Krokiサーバーに接続できなかった
+            KrokiRenderError: Krokiサーバーが画像の変換に失敗した
+        """
+        prof = profiler.get_profiler()
+        cache_key = self._get_cache_key(diagram_type, output_format, source)
+        with self.lock:
+            if cache_key in self.memory_cache:
+                self.memory_cache.move_to_end(cache_key)
+                self.num_memory_cache_hit += 1
+                prof.count("kroki.memory_cache_hit")
+                return self.memory_cache[cache_key]
+
+        cache_path = self._get_cache_path(cache_key, output_format)
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                content = f.read()
+            self._save_memory_cache(cache_key, content)
+            with self.lock:
+                self.num_file_cache_hit += 1
+            prof.count("kroki.file_cache_hit")
+            return content
+
+        content = self._request(diagram_type, output_format, source)
+        if cache_path is not None:
+            self._save_cache(cache_path, content)
+        self._save_memory_cache(cache_key, content)
+        return content
+
+    def _request(self, diagram_type: str, output_format: str, source: str) -> bytes:
+        """Krokiサーバーに図の変換をリクエストする
+
+        Returns:
+            bytes: 画像のバイト列
+
+        Raises:
+            KrokiConnectionError: Krokiサーバーに接続できなかった
+            KrokiRenderError: Krokiサーバーが画像の変換に失敗した
+        """
+        start = time.perf_counter()
+        try:
+            ret = self.session.post(
+                self.server_url,
+                json={
+                    "diagram_source": source,
+                    "diagram_type": diagram_type,
+                    "output_format": output_format
+                }
+            )
+        except Exception as e:
+            self._add_request_stats(time.perf_counter() - start, False)
+            raise KrokiConnectionError(self.server_url) from e
+        seconds = time.perf_counter() - start
+        profiler.get_profiler().add("kroki.request", seconds, diagram_type)
+        self._add_request_stats(seconds, ret.status_code == 200)
+        if ret.status_code != 200:
+            raise KrokiRenderError(ret.status_code)
+        return ret.content
+
+    def _add_request_stats(self, seconds: float, is_success: bool) -> None:
+        """リクエストの統計を記録する"""
+        with self.lock:
+            self.num_request += 1
+            if not is_success:
+                self.num_error += 1
+            self.latencies.append(seconds)
+
+    def get_stats(self) -> Dict:
+        """統計を取得する(プロセス内で共有するクライアントの場合は、プロセスの開始からの値)
+
+        Returns:
+            dict:
+                - requests (int): Krokiサーバーへのリクエストの数
+                - errors (int): 失敗したリクエストの数
+                - memory_cache_hits (int): メモリ上のキャッシュを使った数
+                - file_cache_hits (int): ファイルのキャッシュを使った数
+                - latencies (list(float)): 直近のリクエストの時間(秒)
+        """
+        with self.lock:
+            return {
+                "requests": self.num_request,
+                "errors": self.num_error,
+                "memory_cache_hits": self.num_memory_cache_hit,
+                "file_cache_hits": self.num_file_cache_hit,
+                "latencies": list(self.latencies)
+            }
+
+    @staticmethod
+    def _get_cache_key(diagram_type: str, output_format: str, source: str) -> str:
+        """キャッシュのキーを取得する"""
+        hash_object = hashlib.sha256(
+            "\0".join([diagram_type, output_format, source]).encode())
+        return hash_object.hexdigest()
+
+    def _get_cache_path(self, cache_key: str, output_format: str) -> str | None:
+        """キャッシュファイルのパスを取得する"""
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, f"{cache_key}.{output_format}")
+
+    def _save_memory_cache(self, cache_key: str, content: bytes) -> None:
+        """変換した画像をメモリ上のキャッシュに保存する"""
+        with self.lock:
+            self.memory_cache[cache_key] = content
+            while len(self.memory_cache) > RENDER_MEMORY_CACHE_SIZE:
+                self.memory_cache.popitem(last=False)
+
+    def _save_cache(self, cache_path: str, content: bytes) -> None:
+        """変換した画像をキャッシュに保存する"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # 複数のプロセスが同時に書き込んでも壊れないように、一時ファイル経由で保存する
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Failed to save the render cache: {e}")
+
+
+# プロセス内で共有するクライアント
+_client: KrokiClient | None = None
+
+
+def get_client() -> KrokiClient:
+    """プロセス内で共有するKrokiクライアントを取得する
+
+    Returns:
+        KrokiClient: Krokiクライアント
+    """
+    global _client
+    if _client is None:
+        _client = KrokiClient(
+            os.environ.get(KROKI_URL_ENV, KROKI_SERVER_URL),
+            os.environ.get(RENDER_CACHE_DIR_ENV))
+    return _client
+
+
+def set_render_cache_dir(cache_dir: str | None) -> None:
+    """プロセス内で共有するKrokiクライアントの、画像のキャッシュの保存先を設定する
+
+    Args:
+        cache_dir (str | None):
+            変換した画像のキャッシュの保存先。Noneならキャッシュしない
+    """
+    get_client().cache_dir = cache_dir
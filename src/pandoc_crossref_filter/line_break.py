@@ -0,0 +1,51 @@
+import panflute as pf
+from panflute.containers import ListContainer, DictContainer, attach
+
+
+def normalize_line_breaks(doc: pf.Doc) -> None:
+    """SoftBreakと<br>を、LineBreakに置き換える
+
+    例えば
+
+    ああ
+    いい
+
+    のような文章の場合、Markdownでは
+
+    ああいい
+
+    のように改行が無くなってしまう。
+    そこで、元の見た目と同じになるように、改行(LineBreak)に置き換える。
+
+    また、Tableの中で<br>を使うと、
+    pandocでwordに変換したときも、表の中で改行できるようにする。
+
+    action()で要素ごとに置き換えるのではなく、
+    インライン要素のリストごとに、1回の走査でまとめて置き換える。
+    LineBreakは置き換えるたびに作成し、親と位置を設定する
+    (インスタンスを共有すると、parentやlocationが最後に置き換えた位置を指してしまう)。
+
+    Args:
+        doc (pf.Doc):
+            ドキュメント
+    """
+    stack = [doc]
+    while stack:
+        elem = stack.pop()
+        for child_name in elem._children:
+            child = getattr(elem, child_name)
+            if isinstance(child, ListContainer):
+                items = child.list
+                for i, item in enumerate(items):
+                    item_type = type(item)
+                    if item_type is pf.SoftBreak:
+                        items[i] = attach(pf.LineBreak(), child.parent, child.location, i)
+                    elif item_type is pf.RawInline:
+                        if item.text == "<br>" and item.format == "html":
+                            items[i] = attach(pf.LineBreak(), child.parent, child.location, i)
+                    elif item._children:
+                        stack.append(item)
+            elif isinstance(child, DictContainer):
+                stack.extend(child.dict.values())
+            elif child is not None and child._children:
+                stack.append(child)
@@ -1,11 +1,37 @@
 #!/usr/bin/env python3
 
+import io
+import os
+import sys
+import json
 import logging
+from typing import List
 
 import panflute as pf
 
 from . import utils
-from .pandoc_crossref_filter import action, prepare, finalize
+from . import metrics
+from . import profiler
+from .config import (
+    RESULT_CACHE_DIR_ENV,
+    RESULT_CACHE_MAX_MB_ENV,
+    RESULT_CACHE_MAX_MB,
+    STREAMING_ENV,
+    PARALLEL_JOBS_ENV
+)
+from .pandoc_crossref_filter import (
+    CONFIG_PROFILE,
+    CONFIG_METRICS,
+    CONFIG_INDEX,
+    get_action,
+    prepare,
+    finalize,
+    run_filter_on_doc
+)
+from .diagnostics import Diagnostics
+from .result_cache import ResultCache
+from .streaming import run_streaming
+from .parallel import convert_json_parallel
 
 
 utils.set_logger(logging.WARNING)
@@ -13,10 +39,192 @@ logger = utils.get_logger()
 
 
 def main():
+    # 環境変数が指定されていれば、処理時間を計測し、実行結果のメトリクスを保存する
+    profiler.setup_from_env()
+    metrics.setup_from_env()
     try:
-        pf.run_filter(action, prepare=prepare, finalize=finalize)
+        mode = get_conversion_mode()
+        if mode == "streaming":
+            # ストリーミングが指定されていれば、ドキュメント全体をメモリに持たずに、ブロックごとに変換する
+            run_filter_streaming()
+        elif mode == "parallel":
+            # ワーカープロセスの数が指定されていれば、ブロックを分けて並列に変換する
+            run_filter_parallel(get_parallel_jobs())
+        elif mode == "cache":
+            # キャッシュの保存先が指定されていれば、変換結果をキャッシュする
+            max_mb = float(os.environ.get(RESULT_CACHE_MAX_MB_ENV, RESULT_CACHE_MAX_MB))
+            run_filter_with_cache(
+                ResultCache(os.environ[RESULT_CACHE_DIR_ENV], int(max_mb * 1024 * 1024)))
+        else:
+            run_filter()
     except Exception as e:
+        # 空の出力を成功として返さないように、エラーを出力して終了コード1で終了する
         logger.exception(e)
+        sys.exit(1)
+    finally:
+        # 処理時間の計測結果とメトリクスを出力する(エラーで終了する場合も出力する)
+        metrics.finish()
+        profiler.get_profiler().finish()
+
+
+def get_conversion_mode() -> str:
+    """環境変数から、変換の方式を決める
+
+    ストリーミング、並列変換、変換結果のキャッシュは併用できないので、この順番で優先する。
+    複数指定されている場合は、使わないものを警告する
+
+    Returns:
+        str: "streaming", "parallel", "cache", "normal"のいずれか
+    """
+    list_mode = []
+    if os.environ.get(STREAMING_ENV):
+        list_mode.append(("streaming", STREAMING_ENV))
+    if PARALLEL_JOBS_ENV in os.environ:
+        list_mode.append(("parallel", PARALLEL_JOBS_ENV))
+    if os.environ.get(RESULT_CACHE_DIR_ENV):
+        list_mode.append(("cache", RESULT_CACHE_DIR_ENV))
+    if len(list_mode) == 0:
+        return "normal"
+
+    mode, env_name = list_mode[0]
+    for _, ignored_env_name in list_mode[1:]:
+        logger.warning(f"{ignored_env_name} is ignored because {env_name} is set.")
+    return mode
+
+
+def get_parallel_jobs() -> int:
+    """環境変数で指定された、ワーカープロセスの数を取得する
+
+    正の整数でなければ、エラーを報告して終了する
+
+    Returns:
+        int: ワーカープロセスの数
+    """
+    value = os.environ[PARALLEL_JOBS_ENV]
+    try:
+        jobs = int(value)
+    except ValueError:
+        jobs = 0
+    if jobs < 1:
+        diagnostics = Diagnostics()
+        diagnostics.error(
+            "invalid_config",
+            f"{PARALLEL_JOBS_ENV} must be a positive integer: '{value}'.",
+            (None, None))
+        diagnostics.exit_if_errors()
+    return jobs
+
+
+def run_filter() -> None:
+    """フィルターを実行する
+
+    pf.run_filter()と同じ処理を、段階ごとに処理時間を計測できるように分けて行う。
+    メタデータでプロファイルやメトリクスが指定されていれば、JSONの読み込みの後から計測する。
+    """
+    prof = profiler.get_profiler()
+    with prof.phase("load"):
+        doc = pf.load()
+    profiler.setup_from_metadata(doc.get_metadata(CONFIG_PROFILE, {}))
+    metrics.setup_from_metadata(doc.get_metadata(CONFIG_METRICS, None))
+    metrics.set_doc(doc, "normal")
+
+    prof = profiler.get_profiler()
+    with prof.phase("prepare"):
+        prepare(doc)
+    with prof.phase("walk"):
+        doc = doc.walk(get_action(), doc=doc)
+    with prof.phase("finalize"):
+        finalize(doc)
+    with prof.phase("dump"):
+        pf.dump(doc)
+
+
+def run_filter_streaming() -> None:
+    """ブロックごとに読み込みながらフィルターを実行する(streaming.run_streaming()を参照)"""
+    output_format = sys.argv[1] if len(sys.argv) > 1 else "html"
+    input_stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8")
+    output_stream = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+    run_streaming(input_stream, output_stream, output_format)
+    output_stream.flush()
+
+
+def run_filter_parallel(jobs: int) -> None:
+    """トップレベルのブロックを分けて、並列にフィルターを実行する(parallel.convert_json_parallel()を参照)
+
+    Args:
+        jobs (int):
+            ワーカープロセスの数
+    """
+    output_format = sys.argv[1] if len(sys.argv) > 1 else "html"
+    json_text = sys.stdin.buffer.read().decode("utf-8")
+    output, diagnostics = convert_json_parallel(json_text, output_format, jobs)
+    diagnostics.exit_if_errors()
+    sys.stdout.buffer.write(output.encode("utf-8"))
+    sys.stdout.buffer.flush()
+
+
+def get_dependency_paths(input_bytes: bytes) -> List[str]:
+    """入力JSON以外に、変換結果が依存するファイルのパスを取得する
+
+    メタデータで指定された、他のドキュメント(章)の参照のインデックスが該当する。
+    panfluteの要素は作らずに、メタデータの値だけを読み込む
+
+    Args:
+        input_bytes (bytes):
+            pandocから受け取ったJSONのバイト列
+
+    Returns:
+        list(str): ファイルのパス
+    """
+    try:
+        data = json.loads(input_bytes)
+        data["blocks"] = []
+        doc = json.loads(json.dumps(data), object_hook=pf.elements.from_json)
+    except (ValueError, TypeError, KeyError):
+        # 不正な入力は、変換時にエラーを報告する
+        return []
+    index_config = doc.get_metadata(CONFIG_INDEX, {})
+    if isinstance(index_config, dict) and index_config.get("path"):
+        return [index_config["path"]]
+    return []
+
+
+def run_filter_with_cache(cache: ResultCache) -> None:
+    """変換結果のキャッシュを使ってフィルターを実行する
+
+    入力が前回と同じであれば、panfluteでのパースを行わずに、
+    キャッシュした変換結果をそのまま出力する。
+
+    Args:
+        cache (ResultCache):
+            変換結果のキャッシュ
+    """
+    input_bytes = sys.stdin.buffer.read()
+    output_format = sys.argv[1] if len(sys.argv) > 1 else "html"
+    # 他の章の番号や参照はインデックスから読み込むので、インデックスが更新されたらキャッシュを使わない
+    key = cache.make_key(input_bytes, output_format, get_dependency_paths(input_bytes))
+
+    prof = profiler.get_profiler()
+    with prof.phase("cache_get"):
+        output = cache.get(key)
+    if output is None:
+        with prof.phase("load"):
+            doc = utils.load_doc(input_bytes.decode("utf-8"), output_format)
+        metrics.set_doc(doc, "cache_miss")
+        with prof.phase("filter"):
+            doc = run_filter_on_doc(doc)
+        with prof.phase("dump"):
+            output = utils.dump_doc(doc).encode("utf-8")
+        with prof.phase("cache_put"):
+            cache.put(key, output, doc.code_block_ref.get_filenames())
+    else:
+        # キャッシュを使った場合は、図の出力などの処理をしていないので、要素の数などは0にする
+        run_metrics = metrics.get_run_metrics()
+        if run_metrics is not None:
+            run_metrics.set_result("cache_hit", output_format, metrics.get_empty_counts(), [], 0)
+
+    sys.stdout.buffer.write(output)
+    sys.stdout.buffer.flush()
 
 
 if __name__ == "__main__":
@@ -1,13 +1,13 @@
 from typing import Tuple, List, Dict
+import os
 import json
 import re
-import sys
 
 import panflute as pf
-import requests
 
 from . import utils
-from .config import KROKI_SERVER_URL
+from . import kroki
+from . import profiler
 
 
 logger = utils.get_logger()
@@ -136,38 +136,54 @@ class MermaidWrapper():
         """
         return [mmd["filename"] for mmd in self.list_mmd]
 
-    def export_images(self) -> None:
-        """Mermaid画像の出力"""
-        # 画像に変換する
-        for mmd in self.list_mmd:
-            self._export_image(mmd["filename"], mmd["elem"].text)
+    def export_images(self) -> List[Dict]:
+        """Mermaid画像の出力
 
-    def _export_image(self, filename: str, text: str) -> None:
+        Returns:
+            list(dict):
+                画像ごとの出力結果
+                - filename (str): 出力先の画像ファイル名
+                - diagram_type (str): 図の種類
+                - error (str | None): 失敗した場合はエラーの内容
+                - bytes (int): 書き込んだ画像のバイト数(失敗した場合は0)
+        """
+        list_result = []
+        prof = profiler.get_profiler()
+        # 画像に変換する(プロファイルが有効な場合は、図ごとの時間を計測する)
+        for mmd in self.list_mmd:
+            with prof.phase(mmd["filename"], "export_images.mermaid"):
+                error = self._export_image(mmd["filename"], mmd["elem"].text)
+            list_result.append({
+                "filename": mmd["filename"],
+                "diagram_type": "mermaid",
+                "error": error,
+                "bytes": os.path.getsize(mmd["filename"]) if error is None else 0
+            })
+        return list_result
+
+    def _export_image(self, filename: str, text: str) -> str | None:
         """Mermaidのテキストを画像に出力する
 
         Args:
             filename (str): 出力先の画像ファイル名
             text (str): Mermaidのテキスト
+
+        Returns:
+            str | None: 失敗した場合はエラーの内容
         """
         fmt = "svg" if filename.endswith(".svg") else "png"
 
         try:
-            ret = requests.post(
-                KROKI_SERVER_URL,
-                json={
-                    "diagram_source": text,
-                    "diagram_type": "mermaid",
-                    "output_format": fmt
-                }
-            )
-        except Exception:
-            logger.error(f"Failed to connect to {KROKI_SERVER_URL}.")
-            sys.exit(1)
-
-        if ret.status_code != 200:
-            logger.error(f"Failed to export {filename}.")
-            sys.exit(1)
+            content = kroki.get_client().render("mermaid", fmt, text)
+        except kroki.KrokiConnectionError:
+            return f"Failed to connect to {kroki.get_client().server_url}."
+        except kroki.KrokiRenderError:
+            return f"Failed to export {filename}."
 
         # ファイル保存
-        with open(filename, "wb") as f:
-            f.write(ret.content)
+        try:
+            with open(filename, "wb") as f:
+                f.write(content)
+        except OSError as e:
+            return f"Failed to write {filename}: {e}"
+        return None
@@ -0,0 +1,339 @@
+import os
+import json
+import time
+import threading
+from typing import List, Dict
+
+import panflute as pf
+
+from . import utils
+from . import kroki
+from . import profiler
+from .config import METRICS_ENV
+
+
+logger = utils.get_logger()
+
+# Krokiサーバーへのリクエストの時間の、報告するパーセンタイル
+LATENCY_PERCENTILES = (50, 90, 99)
+# 要素と引用の数の名前(get_document_counts()を参照)
+COUNT_NAMES = ("headers", "figures", "tables", "code_blocks", "diagrams", "citations", "forward_references")
+
+
+class RunMetrics():
+    def __init__(self, output_path: str) -> None:
+        """1回の実行のメトリクス(JSON)の作成
+
+        多数のビルドの結果を集計できるように、ドキュメントの要素の数、図の出力結果、
+        Krokiサーバーへのリクエストの統計、段階ごとの処理時間を1つのJSONにまとめる。
+        Krokiクライアントはプロセス内で共有するので、作成した時点からの差分を報告する。
+
+        変換の方式ごとに、set_doc()またはset_result()で結果を設定する。
+        どちらも設定されていない(ドキュメントの読み込みの前にエラーで終了した)場合は、
+        処理時間とKrokiサーバーへのリクエストの統計だけを報告する。
+
+        Args:
+            output_path (str):
+                メトリクスの保存先
+        """
+        self.output_path: str = output_path
+        self.start: float = time.perf_counter()
+        self.kroki_stats: Dict = kroki.get_client().get_stats()
+        # 変換の方式("normal", "streaming", "parallel", "cache_hit", "cache_miss")
+        self.mode: str | None = None
+        # フィルターを適用したドキュメント
+        self.doc: pf.Doc | None = None
+        # ドキュメントを持たない変換方式の結果(set_result()を参照)
+        self.result: Dict | None = None
+        # このプロセスの外(ワーカープロセス)でのKrokiクライアントの統計
+        self.external_kroki_stats: Dict | None = None
+
+    def set_doc(self, doc: pf.Doc, mode: str) -> None:
+        """フィルターを適用するドキュメントを設定する
+
+        要素の数や図の出力結果は、メトリクスを保存する時点のドキュメントから求めるので、
+        prepare()の前に設定してよい
+
+        Args:
+            doc (pf.Doc):
+                フィルターを適用するドキュメント
+            mode (str):
+                変換の方式
+        """
+        self.doc = doc
+        self.mode = mode
+
+    def set_result(self,
+                   mode: str,
+                   output_format: str,
+                   counts: Dict,
+                   image_results: List[Dict],
+                   error_count: int,
+                   kroki_stats: Dict | None = None) -> None:
+        """ドキュメント全体を持たない変換方式(並列変換、キャッシュの利用)の結果を設定する
+
+        Args:
+            mode (str):
+                変換の方式
+            output_format (str):
+                出力フォーマット
+            counts (dict):
+                要素と引用の数(get_document_counts()の戻り値と同じ形式)
+            image_results (list(dict)):
+                図の出力結果(doc.image_resultsと同じ形式)
+            error_count (int):
+                エラーの数
+            kroki_stats (dict | None):
+                ワーカープロセスでのKrokiクライアントの統計の合計(KrokiClient.get_stats()と同じ形式)
+        """
+        self.mode = mode
+        self.result = {
+            "format": output_format,
+            "counts": counts,
+            "image_results": image_results,
+            "error_count": error_count
+        }
+        self.external_kroki_stats = kroki_stats
+
+    def get_metrics(self, profile_report: Dict | None = None) -> Dict:
+        """メトリクスを取得する
+
+        Args:
+            profile_report (dict | None):
+                Profiler.get_report()の戻り値(段階ごとの処理時間に使う)
+
+        Returns:
+            dict:
+                - mode (str | None): 変換の方式
+                - format (str | None): 出力フォーマット
+                - seconds (float): 全体の処理時間
+                - counts (dict): ヘッダー、図、表、コードブロック、引用、前方参照の数
+                - diagrams (dict): 図の出力結果(出力した数、キャッシュを使った数、書き込んだバイト数)
+                - kroki (dict): Krokiサーバーへのリクエストの数、失敗した数、時間のパーセンタイル
+                - phases (dict): 段階の名前 -> 処理時間
+                - error_count (int): エラーの数
+        """
+        # prepare()が終わる前にエラーで終了した場合は、ドキュメントの値を使わない
+        if self.doc is not None and hasattr(self.doc, "table_cross_ref"):
+            result = {
+                "format": self.doc.format,
+                "counts": get_document_counts(self.doc),
+                "image_results": self.doc.image_results,
+                "error_count": len(self.doc.diagnostics.list_error)
+            }
+        elif self.result is not None:
+            result = self.result
+        else:
+            result = {"format": None, "counts": get_empty_counts(), "image_results": [], "error_count": 0}
+        return {
+            "mode": self.mode,
+            "format": result["format"],
+            "seconds": time.perf_counter() - self.start,
+            "counts": result["counts"],
+            "diagrams": self._get_diagram_metrics(result["image_results"]),
+            "kroki": self._get_kroki_metrics(),
+            "phases": {span["name"]: span["seconds"]
+                       for span in (profile_report or {}).get("phases", [])
+                       if span["depth"] == 0},
+            "error_count": result["error_count"]
+        }
+
+    def write(self, profile_report: Dict | None = None) -> None:
+        """メトリクスを保存する(引数はget_metrics()と同じ)"""
+        try:
+            with open(self.output_path, "w", encoding="utf-8") as f:
+                json.dump(self.get_metrics(profile_report), f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            logger.warning(f"Failed to write the metrics '{self.output_path}': {e}")
+
+    def _get_diagram_metrics(self, list_result: List[Dict]) -> Dict:
+        """図の出力結果を集計する"""
+        stats = self._get_kroki_delta()
+        return {
+            "total": len(list_result),
+            "rendered": stats["requests"] - stats["errors"],
+            "cached": stats["memory_cache_hits"] + stats["file_cache_hits"],
+            "failed": sum(1 for result in list_result if result["error"] is not None),
+            "bytes_written": sum(result["bytes"] for result in list_result)
+        }
+
+    def _get_kroki_metrics(self) -> Dict:
+        """Krokiサーバーへのリクエストの統計を集計する"""
+        stats = self._get_kroki_delta()
+        return {
+            "requests": stats["requests"],
+            "errors": stats["errors"],
+            "memory_cache_hits": stats["memory_cache_hits"],
+            "file_cache_hits": stats["file_cache_hits"],
+            "latency": get_percentiles(stats["latencies"])
+        }
+
+    def _get_kroki_delta(self) -> Dict:
+        """作成した時点からの、Krokiクライアントの統計の差分を取得する(ワーカープロセスの統計を含む)"""
+        delta = get_kroki_delta(self.kroki_stats, kroki.get_client().get_stats())
+        if self.external_kroki_stats is not None:
+            delta = add_kroki_stats(delta, self.external_kroki_stats)
+        return delta
+
+
+def get_kroki_delta(before: Dict, after: Dict) -> Dict:
+    """Krokiクライアントの統計の差分を求める
+
+    Args:
+        before (dict):
+            前の時点の統計(KrokiClient.get_stats()の戻り値)
+        after (dict):
+            後の時点の統計(KrokiClient.get_stats()の戻り値)
+
+    Returns:
+        dict: 統計の差分(時間は、差分のリクエストの分だけ)
+    """
+    delta = {key: after[key] - before[key] for key in after if key != "latencies"}
+    num_latency = min(delta["requests"], len(after["latencies"]))
+    delta["latencies"] = after["latencies"][len(after["latencies"]) - num_latency:]
+    return delta
+
+
+def add_kroki_stats(stats1: Dict, stats2: Dict) -> Dict:
+    """Krokiクライアントの統計を合計する
+
+    Args:
+        stats1 (dict):
+            統計(KrokiClient.get_stats()の戻り値と同じ形式)
+        stats2 (dict):
+            統計(KrokiClient.get_stats()の戻り値と同じ形式)
+
+    Returns:
+        dict: 統計の合計
+    """
+    total = {key: stats1[key] + stats2[key] for key in stats1 if key != "latencies"}
+    total["latencies"] = stats1["latencies"] + stats2["latencies"]
+    return total
+
+
+def get_empty_counts() -> Dict:
+    """すべて0の、要素と引用の数を取得する(変換をしなかった場合に使う)"""
+    return dict.fromkeys(COUNT_NAMES, 0)
+
+
+def add_counts(counts1: Dict, counts2: Dict) -> Dict:
+    """要素と引用の数(get_document_counts()の戻り値)を合計する"""
+    return {key: counts1.get(key, 0) + counts2.get(key, 0)
+            for key in {**counts1, **counts2}}
+
+
+def get_document_counts(doc: pf.Doc) -> Dict:
+    """ドキュメントの要素と引用の数を取得する
+
+    Args:
+        doc (pf.Doc):
+            フィルターを適用したドキュメント
+
+    Returns:
+        dict:
+            - headers (int): ヘッダーの数
+            - figures (int): 番号を付けた図の数
+            - tables (int): 表の数
+            - code_blocks (int): コードブロックの数
+            - diagrams (int): PlantUML/Mermaidの図の数
+            - citations (int): 引用の数(コードブロック中の引用を含む)
+            - forward_references (int): 後続で定義されている参照への引用の数
+    """
+    registry_stats = doc.reference_registry.get_stats()
+    code_block_stats = doc.code_block_ref.get_stats()
+    counts = {}
+    counts.update(doc.section_cross_ref.get_stats())
+    counts.update(doc.figure_cross_ref.get_stats())
+    counts.update(doc.table_cross_ref.get_stats())
+    counts["code_blocks"] = code_block_stats["code_blocks"]
+    counts["diagrams"] = code_block_stats["diagrams"]
+    counts["citations"] = (registry_stats["backward"] + registry_stats["forward"]
+                           + code_block_stats["code_block_references"])
+    counts["forward_references"] = registry_stats["forward"]
+    return counts
+
+
+def get_percentiles(values: List[float]) -> Dict:
+    """パーセンタイル(最近傍順位法)と最大値を求める
+
+    Args:
+        values (list(float)):
+            値の一覧
+
+    Returns:
+        dict: "p50"などの名前 -> 値(値が無ければNone)
+    """
+    list_value = sorted(values)
+    ret = {}
+    for percentile in LATENCY_PERCENTILES:
+        if not list_value:
+            ret[f"p{percentile}"] = None
+            continue
+        rank = max(1, -(-percentile * len(list_value) // 100))
+        ret[f"p{percentile}"] = list_value[rank - 1]
+    ret["max"] = list_value[-1] if list_value else None
+    return ret
+
+
+# プロセス内で共有する、実行結果のメトリクス(有効でなければNone)
+_run_metrics: RunMetrics | None = None
+# メトリクスの作成を始めるときのロック(複数のスレッドから始めても、1つだけ作る)
+_run_metrics_lock = threading.Lock()
+
+
+def get_run_metrics() -> RunMetrics | None:
+    """プロセス内で共有する、実行結果のメトリクスを取得する
+
+    Returns:
+        RunMetrics | None: 保存先が指定されていなければNone
+    """
+    return _run_metrics
+
+
+def start_metrics(output_path: str) -> RunMetrics:
+    """実行結果のメトリクスの作成を始める(始めていれば、そのまま返す)
+
+    メトリクスには段階ごとの処理時間を含めるので、要約を出力せずにプロファイラーを有効にする
+
+    Args:
+        output_path (str):
+            メトリクスの保存先
+
+    Returns:
+        RunMetrics: プロセス内で共有する、実行結果のメトリクス
+    """
+    global _run_metrics
+    with _run_metrics_lock:
+        if _run_metrics is None:
+            profiler.enable_profiler(summary=False)
+            _run_metrics = RunMetrics(output_path)
+        return _run_metrics
+
+
+def setup_from_env() -> None:
+    """環境変数(config.METRICS_ENV)が指定されていれば、メトリクスの作成を始める"""
+    if os.environ.get(METRICS_ENV):
+        start_metrics(os.environ[METRICS_ENV])
+
+
+def setup_from_metadata(output_path: str | None) -> None:
+    """メタデータで保存先が指定されていれば、メトリクスの作成を始める(環境変数の指定を優先する)
+
+    Args:
+        output_path (str | None):
+            メタデータで指定された保存先
+    """
+    if output_path:
+        start_metrics(output_path)
+
+
+def set_doc(doc: pf.Doc, mode: str) -> None:
+    """メトリクスの作成を始めていれば、フィルターを適用するドキュメントを設定する(RunMetrics.set_doc()を参照)"""
+    if _run_metrics is not None:
+        _run_metrics.set_doc(doc, mode)
+
+
+def finish() -> None:
+    """メトリクスの作成を始めていれば、保存する(エラーで終了する場合も呼ぶ)"""
+    if _run_metrics is not None:
+        _run_metrics.write(profiler.get_profiler().get_report())
@@ -0,0 +1,115 @@
+from typing import List, Dict, Sequence, Tuple
+
+
+class SequenceCounter():
+    def __init__(self, count_level: int, delimiter: str) -> None:
+        """セクション番号ごとの連番
+
+        Args:
+            count_level (int):
+                連番のカウントをするレベル
+                例えば0なら、ドキュメント全体で連番をカウントする
+                例えば1なら、第一階層である章ごとにカウントする
+                負の値なら、常に一番深い階層ごとにカウントする
+            delimiter (str):
+                番号の区切り
+        """
+        self.count_level: int = count_level
+        self.delimiter: str = delimiter
+
+        # 連番をカウントする辞書 (セクション番号 -> 連番)
+        self.dict_increment: Dict[Tuple[int, ...], int] = {}
+        # 現在のセクション番号(カウントするレベルまで)
+        self.key: Tuple[int, ...] = ()
+        # 現在の番号の接頭辞 (例: "1-")
+        self.prefix: str = ""
+
+    def set_section_numbers(self, section_numbers: Tuple[int, ...]) -> None:
+        """セクション番号が変わったときに、カウントするキーと接頭辞を更新する
+
+        Args:
+            section_numbers (tuple(int)):
+                現在のセクション番号
+        """
+        if self.count_level >= 0:
+            section_numbers = section_numbers[:self.count_level]
+        if section_numbers == self.key:
+            return
+        self.key = section_numbers
+        if section_numbers:
+            self.prefix = self.delimiter.join(map(str, section_numbers)) + self.delimiter
+        else:
+            self.prefix = ""
+
+    def next_number(self) -> str:
+        """連番を加算して、番号の文字列を返す
+
+        Returns:
+            str: 番号 (例: "1-2")
+        """
+        number = self.dict_increment.get(self.key, 0) + 1
+        self.dict_increment[self.key] = number
+        return self.prefix + str(number)
+
+    def get_state(self) -> Dict[str, int]:
+        """連番の状態を取得する(他のドキュメントの続きから番号を付けるために使う)
+
+        Returns:
+            dict: 区切りで連結したセクション番号 -> 連番
+        """
+        return {self.delimiter.join(map(str, key)): number
+                for key, number in self.dict_increment.items()}
+
+    def set_state(self, state: Dict[str, int]) -> None:
+        """連番の状態を設定する
+
+        Args:
+            state (dict):
+                get_state()で取得した状態
+        """
+        self.dict_increment = {
+            tuple(int(v) for v in key.split(self.delimiter)) if key else (): number
+            for key, number in state.items()}
+
+
+class NumberingEngine():
+    def __init__(self) -> None:
+        """セクション番号に従って、図や表などの連番を管理する
+
+        セクション番号が変わったときだけ、各連番のキーと接頭辞を計算し直す
+        """
+        # 現在のセクション番号
+        self.section_numbers: Tuple[int, ...] = ()
+        # 連番の一覧
+        self.list_counter: List[SequenceCounter] = []
+
+    def add_counter(self, count_level: int, delimiter: str) -> SequenceCounter:
+        """連番を追加する
+
+        Args:
+            count_level (int):
+                連番のカウントをするレベル
+            delimiter (str):
+                番号の区切り
+
+        Returns:
+            SequenceCounter: 追加した連番
+        """
+        counter = SequenceCounter(count_level, delimiter)
+        counter.set_section_numbers(self.section_numbers)
+        self.list_counter.append(counter)
+        return counter
+
+    def set_section_numbers(self, section_numbers: Sequence[int]) -> None:
+        """現在のセクション番号を設定する
+
+        Args:
+            section_numbers (list(int)):
+                現在のセクション番号
+        """
+        section_numbers = tuple(section_numbers)
+        if section_numbers == self.section_numbers:
+            return
+        self.section_numbers = section_numbers
+        for counter in self.list_counter:
+            counter.set_section_numbers(section_numbers)
@@ -1,10 +1,23 @@
+import sys
+import time
+import sqlite3
+
 import panflute as pf
 
 from . import utils
+from . import profiler
 from .section_cross_ref import SectionCrossRef
 from .figure_cross_ref import FigureCrossRef
 from .table_cross_ref import TableCrossRef
 from .code_block_ref import CodeBlockRef
+from .counter_cross_ref import EquationCrossRef, ListingCrossRef
+from .cross_doc_index import CrossDocIndex
+from .format_tweaks import get_format_options
+from .registry import ReferenceRegistry, get_prefix
+from .numbering import NumberingEngine
+from .line_break import normalize_line_breaks
+from .diagnostics import Diagnostics
+from .toc import TableOfContents, PLACEHOLDER_KINDS
 
 
 logger = utils.get_logger()
@@ -15,95 +28,244 @@ CONFIG_SECTION = f"{CONFIG_ROOT}.section"
 CONFIG_IMAGE = f"{CONFIG_ROOT}.figure"
 CONFIG_TABLE = f"{CONFIG_ROOT}.table"
 CONFIG_CODE_BLOCK = f"{CONFIG_ROOT}.code_block"
+CONFIG_EQUATION = f"{CONFIG_ROOT}.equation"
+CONFIG_LISTING = f"{CONFIG_ROOT}.listing"
 CONFIG_TOP_INSERT_TEXT = f"{CONFIG_ROOT}.top_insert_text"
+CONFIG_INDEX = f"{CONFIG_ROOT}.index"
+CONFIG_LINE_BREAK = f"{CONFIG_ROOT}.line_break"
+CONFIG_TOC = f"{CONFIG_ROOT}.toc"
+CONFIG_PROFILE = f"{CONFIG_ROOT}.profile"
+CONFIG_METRICS = f"{CONFIG_ROOT}.metrics"
+
+# 要素の型 -> 処理時間を集計する名前(プロファイルが有効な場合に使う)
+# (段落は数が多く、目次などの目印かどうかの確認しかしないので、計測しない)
+ACTION_STAGES = {
+    pf.Header: "walk.register_section",
+    pf.CodeBlock: "walk.register_code_block",
+    pf.Figure: "walk.register_figure",
+    pf.Image: "walk.register_figure",
+    pf.Math: "walk.register_equation",
+    pf.Table: "walk.register_table",
+    pf.Cite: "walk.add_reference"
+}
+
+
+def prepare(doc, format_tweaks=None):
+    # 相互参照の管理クラスの初期化
+    init_cross_refs(doc, format_tweaks)
+    # メモリを計測する場合は、管理クラスが保持している要素の数も記録する
+    profiler.get_profiler().set_memory_probe(lambda: get_registry_sizes(doc))
+
+    # 他のドキュメント(章)をまたいだ参照のインデックス
+    index_config = doc.get_metadata(CONFIG_INDEX, {})
+    if index_config.get("path"):
+        setup_cross_doc_index(doc, index_config["path"], index_config.get("chapter"))
 
+    # SoftBreakと<br>を改行に変換
+    if doc.get_metadata(CONFIG_LINE_BREAK, True):
+        with profiler.get_profiler().phase("normalize_line_breaks"):
+            normalize_line_breaks(doc)
 
-def prepare(doc):
-    # 出力先がWordの場合のみ、相互参照のリンクを実装する
-    # (出力先がMarkdonwやHTML(Markdown Preview Enhancedのプレビュー)の場合、
-    # リンクがうまく動作しないパターンがある)
-    enable_link = doc.format == "docx"
-    # 図の幅の指定を無効にするかどうか
-    # AzureDevOpsの場合、幅の指定があると、画像が表示されないため、幅の指定を無効にするオプションを追加
-    disable_width = doc.format == "gfm"
+    # ドキュメントの先頭に任意のテキストを挿入
+    top_insert_text = doc.get_metadata(CONFIG_TOP_INSERT_TEXT, None)
+    if top_insert_text:
+        logger.error(top_insert_text)
+        doc.content.insert(0, make_top_insert_block(top_insert_text))
+
+
+def make_top_insert_block(top_insert_text):
+    """ドキュメントの先頭に挿入するブロックを作成する
+
+    "[@toc]"などの目印だけの場合は、目印の段落にする(最後に一覧に置き換える)
+    """
+    key = top_insert_text.strip()
+    if key.startswith("[@") and key.endswith("]") and key[2:-1] in PLACEHOLDER_KINDS:
+        return pf.Para(pf.Cite(pf.Str(key), citations=[pf.Citation(key[2:-1])]))
+    return pf.RawBlock(top_insert_text, format='markdown')
+
+
+def init_cross_refs(doc, format_tweaks=None):
+    """相互参照の管理クラスを初期化する
+
+    Args:
+        doc (pf.Doc):
+            ドキュメント
+        format_tweaks (FormatTweaks | None):
+            複数の出力フォーマットを作る場合に指定する。
+            出力フォーマットに関わらずリンクと幅の指定を残し、フォーマットごとの差分を記憶する
+    """
+    if format_tweaks is None:
+        enable_link, disable_width = get_format_options(doc.format)
+    else:
+        enable_link, disable_width = True, False
+    doc.format_tweaks = format_tweaks
+    # エラーの収集先(最後にまとめて報告する)
+    doc.diagnostics = Diagnostics()
+    # 画像の出力結果(export_images()で設定する)
+    doc.image_results = []
+    # 参照の登録先(セクション、図、表で共有する)
+    doc.reference_registry = ReferenceRegistry(doc.diagnostics)
+    # 図、表などの連番の管理(セクション番号に従って番号を付ける)
+    doc.numbering = NumberingEngine()
 
     # セクション番号管理
     doc.section_cross_ref = SectionCrossRef(
         doc.get_metadata(CONFIG_SECTION, {}),
-        enable_link)
+        enable_link,
+        doc.reference_registry,
+        doc.numbering)
     # コードブロック管理
     doc.code_block_ref = CodeBlockRef(
-        doc.get_metadata(CONFIG_CODE_BLOCK, {}))
+        doc.get_metadata(CONFIG_CODE_BLOCK, {}),
+        doc.diagnostics)
     # 図番号管理
     doc.figure_cross_ref = FigureCrossRef(
         doc.get_metadata(CONFIG_IMAGE, {}),
         enable_link,
-        disable_width)
+        disable_width,
+        doc.reference_registry,
+        doc.numbering)
     # 表番号管理
     doc.table_cross_ref = TableCrossRef(
         doc.get_metadata(CONFIG_TABLE, {}),
-        enable_link)
-    # 現在のセクション番号
-    doc.list_present_section_numbers = []
+        enable_link,
+        doc.reference_registry,
+        doc.numbering)
+    # 数式番号管理
+    doc.equation_cross_ref = EquationCrossRef(
+        doc.get_metadata(CONFIG_EQUATION, {}),
+        enable_link,
+        doc.reference_registry,
+        doc.numbering)
+    # コードリスト番号管理
+    doc.listing_cross_ref = ListingCrossRef(
+        doc.get_metadata(CONFIG_LISTING, {}),
+        enable_link,
+        doc.reference_registry,
+        doc.numbering)
+    # 参照IDの接頭辞 -> 管理クラス
+    doc.dict_cross_ref = {
+        "sec": doc.section_cross_ref,
+        "fig": doc.figure_cross_ref,
+        "tbl": doc.table_cross_ref,
+        "eq": doc.equation_cross_ref,
+        "lst": doc.listing_cross_ref
+    }
+    doc.figure_cross_ref.format_tweaks = format_tweaks
+    doc.table_cross_ref.format_tweaks = format_tweaks
+    doc.equation_cross_ref.format_tweaks = format_tweaks
+    # 目次、図目次、表目次
+    doc.toc = TableOfContents(
+        doc.get_metadata(CONFIG_TOC, {}),
+        doc.section_cross_ref,
+        doc.figure_cross_ref,
+        doc.table_cross_ref)
+    doc.toc.format_tweaks = format_tweaks
 
-    # ドキュメントの先頭に任意のテキストを挿入
-    top_insert_text = doc.get_metadata(CONFIG_TOP_INSERT_TEXT, None)
-    if top_insert_text:
-        logger.error(top_insert_text)
-        toc = pf.RawBlock(top_insert_text, format='markdown')
-        doc.content.insert(0, toc)
 
-def action(elem, doc):
+def get_registry_sizes(doc):
+    """相互参照の管理クラスが保持している要素の数を取得する(メモリの計測に使う)
+
+    Returns:
+        dict: 名前 -> 要素の数
     """
-    各ヘッダーにセクション番号を付与する。
+    sizes = {
+        f"list_replace_target.{prefix}": len(cross_ref.list_replace_target)
+        for prefix, cross_ref in doc.dict_cross_ref.items()}
+    sizes["list_replace_target.code_block"] = len(doc.code_block_ref.list_replace_target)
+    sizes["references"] = len(doc.reference_registry.records)
+    sizes["reference_strings"] = len(doc.reference_registry.dict_reference_string)
+    wrapper_puml, wrapper_mmd = doc.code_block_ref.list_wrapper
+    sizes["list_puml"] = len(wrapper_puml.list_puml)
+    sizes["list_mmd"] = len(wrapper_mmd.list_mmd)
+    return sizes
+
+
+def setup_cross_doc_index(doc, index_path, chapter):
+    """他のドキュメント(章)をまたいだ参照のインデックスを設定する
+
+    - 章の番号の開始状態を設定し、前の章の続きから番号を付ける
+    - ドキュメント内で見つからない参照を、インデックスから解決する
+    """
+    index = CrossDocIndex(index_path)
+    if chapter:
+        try:
+            state = index.get_chapter_state(chapter)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to read the index '{index_path}': {e}")
+            sys.exit(1)
+        if state is None:
+            logger.warning(f"Chapter '{chapter}' is not in the index '{index_path}'.")
+        else:
+            set_numbering_state(doc, state)
+
+    doc.reference_registry.cross_doc_index = index
+
+
+def get_numbering_state(doc):
+    """番号の状態を取得する
+
+    Returns:
+        dict: セクション番号、図番号、表番号の状態
     """
-    logger.debug("Elem:%s", elem)
+    return {
+        "section": doc.section_cross_ref.get_numbering_state(),
+        "figure": doc.figure_cross_ref.get_numbering_state(),
+        "table": doc.table_cross_ref.get_numbering_state(),
+        "equation": doc.equation_cross_ref.get_numbering_state(),
+        "listing": doc.listing_cross_ref.get_numbering_state()
+    }
 
-    if isinstance(elem, pf.SoftBreak):
-        """
-        例えば
 
-        ああ
-        いい
+def set_numbering_state(doc, state):
+    """番号の状態を設定する
 
-        のような文章の場合、Markdownでは
+    Args:
+        state (dict):
+            get_numbering_state()で取得した状態
+    """
+    doc.section_cross_ref.set_numbering_state(state.get("section", []))
+    doc.figure_cross_ref.set_numbering_state(state.get("figure", {}))
+    doc.table_cross_ref.set_numbering_state(state.get("table", {}))
+    doc.equation_cross_ref.set_numbering_state(state.get("equation", {}))
+    doc.listing_cross_ref.set_numbering_state(state.get("listing", {}))
 
-        ああいい
 
-        のように改行が無くなってしまう。
-        そこで、元の見た目と同じになるように、改行を追加する。
-        """
-        return [pf.LineBreak()]
+def action(elem, doc):
+    """
+    各ヘッダーにセクション番号を付与する。
+    """
+    # エラーの位置を報告するために、処理中の要素を記憶する
+    doc.diagnostics.current_elem = elem
 
-    elif (isinstance(elem, pf.RawInline)
-          and elem.text == "<br>"
-          and elem.format == "html"):
-        """
-        Tableの中で<br>を使うと、
-        pandocでwordに変換したときも、表の中で改行できるようにする
-        """
-        return [pf.LineBreak()]
+    # SoftBreakと<br>の改行への変換は、prepare()でまとめて行う
+    # (normalize_line_breaks()を参照)
 
     # ヘッダー -> セクション番号
-    elif isinstance(elem, pf.Header):
+    if isinstance(elem, pf.Header):
         # セクション番号の加算と参照の登録
+        # (図や表の連番には、SectionCrossRefから通知する)
         doc.section_cross_ref.register_section(elem)
-        # セクション番号の更新
-        doc.list_present_section_numbers = \
-            doc.section_cross_ref.get_present_section_numbers()
+        doc.diagnostics.set_header(elem)
+        # 目次の項目(セクション番号を付けた後の文字列を使う)
+        doc.toc.add_section(elem)
+
+    # 目次などの目印の段落
+    elif isinstance(elem, pf.Para):
+        doc.toc.register_placeholder(elem)
 
     # コードブロック
     elif isinstance(elem, pf.CodeBlock):
         # コードブロック中の参照を探して一時記憶しておく
         ret = doc.code_block_ref.register_code_block(elem)
 
+        # 画像ではないコードブロックは、コードリスト番号を付ける
         if ret is None:
-            return
+            return doc.listing_cross_ref.register_listing(elem)
 
         # コードブロックをイメージ要素に置き換える
         if isinstance(ret, (pf.Figure, pf.Image)):
-            figure = doc.figure_cross_ref.register_figure(
-                ret, doc.list_present_section_numbers)
+            figure = doc.figure_cross_ref.register_figure(ret)
             # Image要素の場合は、Para要素に変換しないとエラーになる
             if isinstance(ret, pf.Image):
                 figure = pf.Para(figure)
@@ -115,67 +277,136 @@ def action(elem, doc):
             identifier = ret[1]
             doc.figure_cross_ref.register_external_caption(
                 caption,
-                identifier,
-                doc.list_present_section_numbers
+                identifier
             )
             return [elem, caption]
 
     # 画像
     elif isinstance(elem, (pf.Figure, pf.Image)):
-        image = doc.figure_cross_ref.register_figure(
-            elem, doc.list_present_section_numbers)
+        image = doc.figure_cross_ref.register_figure(elem)
         return image
 
+    # 数式
+    elif isinstance(elem, pf.Math):
+        return doc.equation_cross_ref.register_equation(elem)
+
     # 表
     elif isinstance(elem, pf.Table):
-        doc.table_cross_ref.register_table(
-            elem, doc.list_present_section_numbers)
+        doc.table_cross_ref.register_table(elem)
 
     # 参照を上書きするべき対象を一時的に記憶しておく
     # (参照が後続で定義されているかもしれないので、ここでは上書きできない)
     elif isinstance(elem, pf.Cite):
         list_ret_elem = []
+        is_header = None
         for citation in elem.citations:
-            # セクション番号の参照
-            if citation.id.startswith("sec:"):
-                ret_elem = doc.section_cross_ref.add_reference(
-                    citation.id,
-                    isinstance(utils.get_root_elem(elem), pf.Header)
-                )
-                list_ret_elem.append(ret_elem)
-
-            # 図番号の参照
-            elif citation.id.startswith("fig:"):
-                ret_elem = doc.figure_cross_ref.add_reference(
-                    citation.id,
-                )
-                list_ret_elem.append(ret_elem)
-
-            # 表番号の参照
-            elif citation.id.startswith("tbl:"):
-                ret_elem = doc.table_cross_ref.add_reference(
-                    citation.id,
-                )
-                list_ret_elem.append(ret_elem)
+            # 接頭辞(sec:, fig:, tbl:)に対応する管理クラスに登録する
+            cross_ref = doc.dict_cross_ref.get(get_prefix(citation.id))
+            if cross_ref is None:
+                continue
+            if is_header is None:
+                is_header = isinstance(utils.get_root_elem(elem), pf.Header)
+            list_ret_elem.append(cross_ref.add_reference(citation.id, is_header))
 
         if len(list_ret_elem) > 0:
+            if doc.format_tweaks is not None:
+                for ret_elem in list_ret_elem:
+                    doc.format_tweaks.add_link(elem.parent, ret_elem)
             # pf.Citeをpf.Strで置き換える
             # (文字列の中身はfinalize()で書き換える)
             return list_ret_elem
 
 
+def get_action():
+    """走査に使う関数を取得する
+
+    プロファイルが有効な場合は、要素の型ごとに処理時間を集計する関数を返す
+    (無効な場合は、action()をそのまま返すので負荷は無い)
+    要素のトレースが有効な場合は、すべての要素の処理時間を記録する関数を返す
+    """
+    prof = profiler.get_profiler()
+    if not prof.enabled:
+        return action
+
+    if prof.trace:
+        def traced_action(elem, doc):
+            start = time.perf_counter()
+            ret = action(elem, doc)
+            seconds = time.perf_counter() - start
+            stage = ACTION_STAGES.get(type(elem))
+            if stage is not None:
+                prof.add(stage, seconds)
+            prof.trace_element(elem, seconds, doc.diagnostics.get_position)
+            return ret
+        return traced_action
+
+    def profiled_action(elem, doc):
+        stage = ACTION_STAGES.get(type(elem))
+        if stage is None:
+            return action(elem, doc)
+        start = time.perf_counter()
+        ret = action(elem, doc)
+        prof.add(stage, time.perf_counter() - start)
+        return ret
+    return profiled_action
+
+
 def finalize(doc):
+    prof = profiler.get_profiler()
+    # 参照を上書きする
+    with prof.phase("resolve_references"):
+        resolve_references(doc)
+    # 画像を出力する
+    with prof.phase("export_images"):
+        export_images(doc)
+    # エラーがあれば、まとめて報告して落とす
+    doc.diagnostics.exit_if_errors()
+
+
+def resolve_references(doc):
+    """参照を上書きする"""
+    # ここからは要素ごとの処理ではないので、エラーの位置は各参照が記憶した位置を使う
+    doc.diagnostics.current_elem = None
+    # 目次、図目次、表目次の目印を置き換える
+    doc.toc.expand()
     # セクション番号の参照を上書きする
     doc.section_cross_ref.replace_reference()
     # 図番号の参照を上書きする
     doc.figure_cross_ref.replace_reference()
     # 表番号の参照を上書きする
     doc.table_cross_ref.replace_reference()
+    # 数式番号、コードリスト番号の参照を上書きする
+    doc.equation_cross_ref.replace_reference()
+    doc.listing_cross_ref.replace_reference()
     # コードブロックの参照を上書きする
-    doc.code_block_ref.replace_reference(
-        doc.section_cross_ref,
-        doc.figure_cross_ref,
-        doc.table_cross_ref
-    )
-    # 画像を出力する
-    doc.code_block_ref.export_images()
+    doc.code_block_ref.replace_reference(doc.dict_cross_ref)
+    logger.debug("Reference resolution: %s", doc.reference_registry.get_stats())
+
+
+def export_images(doc):
+    """画像を出力する
+
+    出力に失敗した画像は、エラーとして記録する(finalize()でまとめて報告する)
+    """
+    list_result = doc.code_block_ref.export_images()
+    # 実行結果のメトリクスに使う
+    doc.image_results = list_result
+    for result in list_result:
+        if result["error"] is not None:
+            doc.diagnostics.error("diagram", result["error"], (None, None))
+
+
+def run_filter_on_doc(doc: pf.Doc) -> pf.Doc:
+    """読み込み済みのドキュメントにフィルターを適用する(pandocのフィルターとして実行する場合に使う)
+
+    エラーがあれば、finalize()でまとめて報告してsys.exit()する
+    (例外にする場合は、api.apply_filter()を使う)
+
+    Args:
+        doc (pf.Doc):
+            ドキュメント
+
+    Returns:
+        pf.Doc: フィルター適用後のドキュメント
+    """
+    return pf.run_filter(get_action(), prepare=prepare, finalize=finalize, doc=doc)
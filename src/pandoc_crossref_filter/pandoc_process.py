@@ -0,0 +1,86 @@
+import subprocess
+from typing import List, Sequence
+
+from .config import PANDOC_COMMAND
+
+
+class PandocError(Exception):
+    """pandocの実行に失敗したときの例外"""
+
+
+def read_json(source_path: str | None = None,
+              text: str | None = None,
+              from_format: str | None = None,
+              extra_args: Sequence[str] = ()) -> str:
+    """pandocでMarkdownなどを読み込み、JSONに変換する
+
+    Args:
+        source_path (str | None):
+            入力ファイルのパス。Noneの場合はtextを読み込む
+        text (str | None):
+            入力テキスト
+        from_format (str | None):
+            入力フォーマット。Noneの場合はpandocに推定させる
+        extra_args (list(str)):
+            pandocに渡す追加の引数
+
+    Returns:
+        str: pandocのJSON
+
+    Raises:
+        PandocError: pandocの実行に失敗した
+    """
+    command = [PANDOC_COMMAND, "-t", "json"]
+    if from_format:
+        command += ["-f", from_format]
+    command += list(extra_args)
+    if source_path is not None:
+        command.append(source_path)
+        input_bytes = None
+    else:
+        input_bytes = (text or "").encode("utf-8")
+
+    return _run(command, input_bytes).decode("utf-8")
+
+
+def write_output(json_text: str,
+                 to_format: str,
+                 output_path: str | None = None,
+                 extra_args: Sequence[str] = ()) -> bytes:
+    """pandocのJSONを、指定したフォーマットに変換する
+
+    Args:
+        json_text (str):
+            pandocのJSON
+        to_format (str):
+            出力フォーマット
+        output_path (str | None):
+            出力先のパス。Noneの場合は変換結果を返す
+        extra_args (list(str)):
+            pandocに渡す追加の引数
+
+    Returns:
+        bytes: 変換結果。output_pathを指定した場合は空
+
+    Raises:
+        PandocError: pandocの実行に失敗した
+    """
+    command: List[str] = [PANDOC_COMMAND, "-f", "json", "-t", to_format]
+    command += ["-o", output_path if output_path is not None else "-"]
+    command += list(extra_args)
+    return _run(command, json_text.encode("utf-8"))
+
+
+def _run(command: List[str], input_bytes: bytes | None) -> bytes:
+    """pandocを実行する"""
+    try:
+        ret = subprocess.run(
+            command,
+            input=input_bytes,
+            stdin=subprocess.DEVNULL if input_bytes is None else None,
+            capture_output=True)
+    except OSError as e:
+        raise PandocError(f"Failed to run {command[0]}: {e}") from e
+    if ret.returncode != 0:
+        raise PandocError(ret.stderr.decode("utf-8", errors="replace").strip())
+    return ret.stdout
@@ -0,0 +1,392 @@
+import os
+import json
+import logging
+import functools
+import collections
+from typing import List, Dict, Tuple
+from concurrent.futures import ProcessPoolExecutor
+
+import panflute as pf
+
+from . import utils
+from . import kroki
+from . import metrics
+from . import profiler
+from .pandoc_crossref_filter import (
+    CONFIG_INDEX,
+    action,
+    get_action,
+    prepare,
+    init_cross_refs,
+    setup_cross_doc_index,
+    get_numbering_state,
+    set_numbering_state,
+    resolve_references,
+    export_images
+)
+from .prescan import scan_block
+from .diagnostics import Diagnostics
+
+
+logger = utils.get_logger()
+
+# 1つのワーカープロセスあたりのチャンクの数(処理時間のばらつきを均すため)
+CHUNKS_PER_JOB = 4
+# チャンクに含めるトップレベルのブロックの最小数
+MIN_CHUNK_BLOCKS = 50
+# 並列に変換するトップレベルのブロックの最小数
+# (これより少ない場合は、ワーカープロセスの起動とチャンクの受け渡しの負荷の方が大きいので、通常の変換をする)
+MIN_PARALLEL_BLOCKS = 1000
+
+
+class WarningCollector(logging.Handler):
+    def __init__(self) -> None:
+        """出力した警告のメッセージを集める(事前スキャンで使う)"""
+        super().__init__(logging.WARNING)
+        self.messages: set = set()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.messages.add(record.getMessage())
+
+
+class DuplicateWarningFilter(logging.Filter):
+    def __init__(self, messages) -> None:
+        """事前スキャンで出力済みの警告を、ワーカープロセスで再度出力しないようにする
+
+        Args:
+            messages (set(str)):
+                事前スキャンで出力した警告のメッセージ
+        """
+        super().__init__()
+        self.messages = messages
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno != logging.WARNING or record.getMessage() not in self.messages
+
+
+class ChunkReferenceTable():
+    def __init__(self, dict_ref: Dict[str, Tuple[str, str]], fallback=None) -> None:
+        """他のチャンクで定義されている参照の一覧
+
+        ReferenceRegistry.cross_doc_indexとして使い、チャンク内で見つからない参照を解決する
+
+        Args:
+            dict_ref (dict):
+                参照ID -> (番号, タイトル)
+            fallback (CrossDocIndex | None):
+                ドキュメント内で見つからない場合に参照する、他のドキュメント(章)のインデックス
+        """
+        self.dict_ref: Dict[str, Tuple[str, str]] = dict_ref
+        self.fallback = fallback
+
+    def get_reference(self, identifier: str) -> Tuple[str, str] | None:
+        """参照IDから、番号とタイトルを取得する(CrossDocIndex.get_reference()と同じ)"""
+        ref = self.dict_ref.get(identifier)
+        if ref is None and self.fallback is not None:
+            ref = self.fallback.get_reference(identifier)
+        return ref
+
+
+def convert_json_parallel(json_text: str,
+                          output_format: str,
+                          jobs: int | None = None) -> Tuple[str, Diagnostics]:
+    """トップレベルのブロックをチャンクに分け、ワーカープロセスのプールでフィルターを適用する
+
+    1. 事前スキャン(prescan.scan_block())で、ドキュメント全体の参照と、
+       各チャンクの始まりの番号の状態を順番に求める
+    2. チャンクごとに、始まりの番号の状態から番号を付けて、表の書式の変換などを並列に行う
+       (他のチャンクの参照は、事前スキャンの結果から解決する)
+    3. 変換したチャンクを、元の順番に連結する
+
+    ワーカープロセスの数が1以下の場合(CPU数より多くは使わない)や、
+    トップレベルのブロックがMIN_PARALLEL_BLOCKSより少ない場合は、並列にせずに通常の変換をする
+
+    Args:
+        json_text (str):
+            pandocのJSON
+        output_format (str):
+            出力フォーマット
+        jobs (int | None):
+            ワーカープロセスの数。Noneの場合はCPU数
+
+    Returns:
+        str: フィルター適用後のpandocのJSON
+        Diagnostics: すべてのチャンクのエラー
+    """
+    num_cpu = os.cpu_count() or 1
+    jobs = min(jobs or num_cpu, num_cpu)
+    if jobs <= 1:
+        return _convert_json_normal(json_text, output_format)
+
+    prof = profiler.get_profiler()
+    with prof.phase("load"):
+        data = json.loads(json_text)
+    list_block = data.pop("blocks")
+    header = data
+    if len(list_block) < MIN_PARALLEL_BLOCKS:
+        return _convert_json_normal(json_text, output_format)
+
+    # チャンクの分割
+    num_chunk = jobs * CHUNKS_PER_JOB
+    chunk_size = max(MIN_CHUNK_BLOCKS, -(-len(list_block) // num_chunk))
+    list_start = list(range(0, len(list_block), chunk_size)) or [0]
+
+    # 事前スキャン
+    # (コードブロックの参照などの警告は、ドキュメント全体を順番にスキャンするここで出力する)
+    collector = WarningCollector()
+    logger.addHandler(collector)
+    try:
+        with prof.phase("prescan"):
+            list_state, list_header_title, dict_ref, toc_entries, prescan_diagnostics = \
+                _scan_chunks(header, list_block, list_start)
+    finally:
+        logger.removeHandler(collector)
+
+    # チャンクは、入れ子の辞書ではなくJSONの文字列で受け渡す
+    # (ワーカープロセスへの受け渡しと、ワーカープロセスでの読み込みを速くする)
+    head = json.dumps(dict(header, blocks=[]), separators=(",", ":"), ensure_ascii=False)
+    list_args = [
+        (_dump_blocks(list_block[start:start + chunk_size]), state, header_title, start, output_format)
+        for start, state, header_title in zip(list_start, list_state, list_header_title)]
+    initargs = (head, dict_ref, toc_entries, frozenset(collector.messages))
+    with prof.phase("transform"):
+        with ProcessPoolExecutor(max_workers=jobs,
+                                 initializer=_init_worker,
+                                 initargs=initargs) as executor:
+            list_result = list(executor.map(_transform_chunk, *zip(*list_args)))
+
+    # エラーをまとめる
+    # (参照IDの重複は、チャンクをまたいだものも含めて事前スキャンで検出している)
+    diagnostics = Diagnostics()
+    diagnostics.list_error.extend(
+        error for error in prescan_diagnostics.list_error
+        if error["code"] == "duplicate_identifier")
+    list_filename = []
+    for result in list_result:
+        diagnostics.list_error.extend(
+            error for error in result["errors"] if error["code"] != "duplicate_identifier")
+        list_filename.extend(result["filenames"])
+    for filename, count in collections.Counter(list_filename).items():
+        if count > 1:
+            diagnostics.error("diagram", f"Duplicate filename: {filename}.", (None, None))
+
+    # チャンクを連結する
+    with prof.phase("merge"):
+        output = _insert_blocks(
+            head, ",".join(result["blocks"] for result in list_result if result["blocks"]))
+
+    _set_metrics_result(list_result, output_format, len(diagnostics.list_error))
+    return output, diagnostics
+
+
+def _convert_json_normal(json_text: str, output_format: str) -> Tuple[str, Diagnostics]:
+    """並列にしない場合の、通常の変換(main.run_filter()と同じ段階で計測する)
+
+    Args:
+        json_text (str):
+            pandocのJSON
+        output_format (str):
+            出力フォーマット
+
+    Returns:
+        str: フィルター適用後のpandocのJSON
+        Diagnostics: エラー
+    """
+    prof = profiler.get_profiler()
+    with prof.phase("load"):
+        doc = utils.load_doc(json_text, output_format)
+    metrics.set_doc(doc, "normal")
+    with prof.phase("prepare"):
+        prepare(doc)
+    with prof.phase("walk"):
+        doc = doc.walk(get_action(), doc=doc)
+    with prof.phase("finalize"):
+        _finalize_chunk(doc)
+    with prof.phase("dump"):
+        output = utils.dump_doc(doc)
+    return output, doc.diagnostics
+
+
+def _dump_blocks(list_block: List[Dict]) -> str:
+    """トップレベルのブロックを、カンマ区切りのJSONの文字列にする"""
+    return json.dumps(list_block, separators=(",", ":"), ensure_ascii=False)[1:-1]
+
+
+def _insert_blocks(head: str, blocks: str) -> str:
+    """ブロックが空のドキュメントのJSONに、カンマ区切りのブロックのJSONを挿入する"""
+    index = head.rindex("[]")
+    return head[:index + 1] + blocks + head[index + 1:]
+
+
+def _set_metrics_result(list_result: List[Dict], output_format: str, error_count: int) -> None:
+    """メトリクスの作成を始めていれば、チャンクごとの結果を合計して設定する
+
+    Args:
+        list_result (list(dict)):
+            チャンクごとの結果(_transform_chunk()の戻り値)
+        output_format (str):
+            出力フォーマット
+        error_count (int):
+            エラーの数
+    """
+    run_metrics = metrics.get_run_metrics()
+    if run_metrics is None:
+        return
+    counts: Dict = {}
+    list_image_result = []
+    kroki_stats = None
+    for result in list_result:
+        counts = metrics.add_counts(counts, result["counts"])
+        list_image_result.extend(result["image_results"])
+        kroki_stats = result["kroki_stats"] if kroki_stats is None \
+            else metrics.add_kroki_stats(kroki_stats, result["kroki_stats"])
+    run_metrics.set_result(
+        "parallel", output_format, counts, list_image_result, error_count, kroki_stats)
+
+
+def _scan_chunks(header: Dict,
+                 list_block: List[Dict],
+                 list_start: List[int]) -> Tuple[List[Dict], List[str | None], Dict, Dict, Diagnostics]:
+    """ドキュメント全体を事前スキャンして、各チャンクの始まりの状態と、参照の一覧を求める
+
+    Args:
+        header (dict):
+            pandocのJSONの"blocks"以外の項目
+        list_block (list(dict)):
+            トップレベルのブロック
+        list_start (list(int)):
+            各チャンクの先頭のブロックの番号
+
+    Returns:
+        list(dict): 各チャンクの始まりの番号の状態
+        list(str | None): 各チャンクの直前のヘッダー
+        dict: 参照ID -> (番号, タイトル)
+        dict: 目次、図目次、表目次を作るための値(TableOfContents.get_entries())
+        Diagnostics: 事前スキャンのエラー
+    """
+    doc = json.loads(
+        json.dumps(dict(header, blocks=[])),
+        object_hook=pf.elements.from_json)
+    init_cross_refs(doc)
+    index_config = doc.get_metadata(CONFIG_INDEX, {})
+    if index_config.get("path"):
+        setup_cross_doc_index(doc, index_config["path"], index_config.get("chapter"))
+
+    list_state = []
+    list_header_title = []
+    list_end = list_start[1:] + [len(list_block)]
+    for start, end in zip(list_start, list_end):
+        list_state.append(get_numbering_state(doc))
+        header_elem = doc.diagnostics.header_elem
+        list_header_title.append(
+            None if header_elem is None else pf.stringify(header_elem.content))
+        for i in range(start, end):
+            scan_block(doc, list_block[i], i)
+
+    dict_ref = {identifier: (record.number, record.title)
+                for identifier, record in doc.reference_registry.items()}
+    return list_state, list_header_title, dict_ref, doc.toc.get_entries(), doc.diagnostics
+
+
+# ワーカープロセスで共有する値(_init_worker()で設定する)
+_worker_head: str = ""
+_worker_dict_ref: Dict[str, Tuple[str, str]] = {}
+_worker_toc_entries: Dict = {}
+_worker_warning_filter: DuplicateWarningFilter | None = None
+
+
+def _init_worker(head: str,
+                 dict_ref: Dict[str, Tuple[str, str]],
+                 toc_entries: Dict,
+                 prescan_warnings: frozenset) -> None:
+    """ワーカープロセスの初期化
+
+    メタデータ(ブロックが空のドキュメントのJSON)、参照の一覧、目次などの一覧は、
+    チャンクごとではなくワーカープロセスごとに1回だけ受け取る
+    事前スキャンで出力済みの警告は、チャンクの変換では出力しない
+    """
+    global _worker_head, _worker_dict_ref, _worker_toc_entries, _worker_warning_filter
+    _worker_head = head
+    _worker_dict_ref = dict_ref
+    _worker_toc_entries = toc_entries
+    if _worker_warning_filter is not None:
+        logger.removeFilter(_worker_warning_filter)
+    _worker_warning_filter = DuplicateWarningFilter(prescan_warnings)
+    logger.addFilter(_worker_warning_filter)
+
+
+def _transform_chunk(blocks: str,
+                     state: Dict,
+                     header_title: str | None,
+                     block_offset: int,
+                     output_format: str) -> Dict:
+    """1つのチャンクにフィルターを適用する
+
+    Args:
+        blocks (str):
+            チャンクのトップレベルのブロックのJSON(カンマ区切り)
+        state (dict):
+            チャンクの始まりの番号の状態
+        header_title (str | None):
+            チャンクの直前のヘッダー(エラーの位置の報告に使う)
+        block_offset (int):
+            チャンクの先頭のブロックの番号
+        output_format (str):
+            出力フォーマット
+
+    Returns:
+        dict:
+            - blocks (str): フィルター適用後のブロックのJSON(カンマ区切り)
+            - errors (list(dict)): エラーの一覧
+            - filenames (list(str)): 出力したPlantUML/Mermaidの画像のファイル名
+            - counts (dict): 要素と引用の数(metrics.get_document_counts()を参照)
+            - image_results (list(dict)): 図の出力結果
+            - kroki_stats (dict): チャンクの変換でのKrokiクライアントの統計
+    """
+    kroki_stats = kroki.get_client().get_stats()
+    doc = utils.load_doc(_insert_blocks(_worker_head, blocks), output_format)
+    pf.run_filter(
+        action,
+        prepare=functools.partial(
+            _prepare_chunk, state=state, header_title=header_title, block_offset=block_offset),
+        finalize=_finalize_chunk,
+        doc=doc)
+
+    blocks = json.dumps(
+        doc.content.list,
+        default=lambda elem: elem.to_json(),
+        check_circular=False,
+        separators=(",", ":"),
+        ensure_ascii=False)
+    return {
+        "blocks": blocks[1:-1],
+        "errors": doc.diagnostics.list_error,
+        "filenames": doc.code_block_ref.get_filenames(),
+        "counts": metrics.get_document_counts(doc),
+        "image_results": doc.image_results,
+        "kroki_stats": metrics.get_kroki_delta(kroki_stats, kroki.get_client().get_stats())
+    }
+
+
+def _prepare_chunk(doc: pf.Doc, state: Dict, header_title: str | None, block_offset: int) -> None:
+    """チャンクの前処理
+
+    prepare()の後に、チャンクの始まりの番号の状態と、他のチャンクの参照、目次などの一覧を設定する
+    """
+    num_block = len(doc.content)
+    prepare(doc)
+    # 先頭に挿入する文章(top_insert_text)は、最初のチャンクだけに挿入する
+    if block_offset > 0:
+        del doc.content[:len(doc.content) - num_block]
+    set_numbering_state(doc, state)
+    doc.reference_registry.cross_doc_index = ChunkReferenceTable(
+        _worker_dict_ref, doc.reference_registry.cross_doc_index)
+    doc.toc.set_entries(_worker_toc_entries)
+    doc.diagnostics.block_offset = block_offset
+    doc.diagnostics.header_title = header_title
+
+
+def _finalize_chunk(doc: pf.Doc) -> None:
+    """チャンクの後処理(参照の上書きと画像の出力。エラーは呼び出し元でまとめて報告する)"""
+    resolve_references(doc)
+    export_images(doc)
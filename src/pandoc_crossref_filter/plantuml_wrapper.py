@@ -1,13 +1,13 @@
 from typing import Tuple, List, Dict
+import os
 import json
-import sys
 import re
 
-import requests
 import panflute as pf
 
 from . import utils
-from .config import KROKI_SERVER_URL
+from . import kroki
+from . import profiler
 
 logger = utils.get_logger()
 
@@ -145,36 +145,54 @@ class PlantUMLWrapper():
         """
         return [puml["filename"] for puml in self.list_puml]
 
-    def export_images(self) -> None:
-        """PlantUML画像の出力"""
-        # 画像に変換する
-        for puml in self.list_puml:
-            self._export_image(puml["filename"], puml["elem"].text)
+    def export_images(self) -> List[Dict]:
+        """PlantUML画像の出力
 
-    def _export_image(self, filename: str, text: str) -> None:
+        Returns:
+            list(dict):
+                画像ごとの出力結果
+                - filename (str): 出力先の画像ファイル名
+                - diagram_type (str): 図の種類
+                - error (str | None): 失敗した場合はエラーの内容
+                - bytes (int): 書き込んだ画像のバイト数(失敗した場合は0)
+        """
+        list_result = []
+        prof = profiler.get_profiler()
+        # 画像に変換する(プロファイルが有効な場合は、図ごとの時間を計測する)
+        for puml in self.list_puml:
+            with prof.phase(puml["filename"], "export_images.plantuml"):
+                error = self._export_image(puml["filename"], puml["elem"].text)
+            list_result.append({
+                "filename": puml["filename"],
+                "diagram_type": "plantuml",
+                "error": error,
+                "bytes": os.path.getsize(puml["filename"]) if error is None else 0
+            })
+        return list_result
+
+    def _export_image(self, filename: str, text: str) -> str | None:
         """PlantUMLのテキストを画像に出力する
 
         Args:
             filename (str): 出力先の画像ファイル名
             text (str): PlantUMLのテキスト
+
+        Returns:
+            str | None: 失敗した場合はエラーの内容
         """
         fmt = "svg" if filename.endswith(".svg") else "png"
 
         try:
-            ret = requests.post(
-                KROKI_SERVER_URL,
-                json={
-                    "diagram_source": text,
-                    "diagram_type": "plantuml",
-                    "output_format": fmt
-                }
-            )
-        except Exception:
-            logger.error(f"Failed to connect to {KROKI_SERVER_URL}.")
-            sys.exit(1)
-        if ret.status_code != 200:
-            logger.error(f"Failed to export {filename}.")
-            sys.exit(1)
-
-        with open(filename, "wb") as f:
-            f.write(ret.content)
+            content = kroki.get_client().render("plantuml", fmt, text)
+        except kroki.KrokiConnectionError:
+            return f"Failed to connect to {kroki.get_client().server_url}."
+        except kroki.KrokiRenderError:
+            return f"Failed to export {filename}."
+
+        # ファイル保存
+        try:
+            with open(filename, "wb") as f:
+                f.write(content)
+        except OSError as e:
+            return f"Failed to write {filename}: {e}"
+        return None
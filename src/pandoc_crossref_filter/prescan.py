@@ -0,0 +1,217 @@
+import json
+from typing import List, Dict, Tuple, Sequence
+from concurrent.futures import ThreadPoolExecutor
+
+import panflute as pf
+from panflute.containers import ListContainer, DictContainer
+
+from . import utils
+from .pandoc_crossref_filter import (
+    action,
+    init_cross_refs,
+    get_numbering_state,
+    set_numbering_state
+)
+from .cross_doc_index import CrossDocIndex, CrossDocIndexError
+from .pandoc_process import read_json
+
+
+logger = utils.get_logger()
+
+# 番号付けに関係する要素の種類(これらを含まないブロックは、事前スキャンで読み飛ばす)
+NUMBERED_ELEMENT_TYPES = {"Header", "Image", "Figure", "Table", "CodeBlock", "Math"}
+# 事前スキャンで、番号付けと参照の登録をする要素の種類
+SCANNED_ELEMENT_TYPES = {pf.Header, pf.Image, pf.Figure, pf.Table, pf.CodeBlock, pf.Math}
+# 中の引用が、登録するタイトルに含まれる要素の種類(これら以外の中の引用は、事前スキャンでは処理しない)
+TITLED_ELEMENT_TYPES = (pf.Header, pf.Caption, pf.Image)
+
+
+def scan_chapter(json_text: str,
+                 state: Dict | None) -> Tuple[List[Tuple[str, str, str, str]], Dict]:
+    """1つの章をスキャンして、参照と、章の終わりの番号の状態を取得する
+
+    番号付けに関係する要素を含まないトップレベルのブロックは、panfluteの要素に変換せずに読み飛ばす。
+    また、表は番号付けにキャプションしか使わないので、最初の行以外を除いてから変換する。
+
+    Args:
+        json_text (str):
+            章のpandocのJSON
+        state (dict | None):
+            章の始まりの番号の状態(前の章の終わりの状態)。最初の章はNoneまたは空
+
+    Returns:
+        list(tuple(str, str, str, str)):
+            参照の一覧(参照ID、種類、番号、タイトル)
+        dict:
+            章の終わりの番号の状態
+
+    Raises:
+        CrossDocIndexError: 参照IDの重複など、章の中にエラーがある
+    """
+    data = json.loads(json_text)
+
+    # メタデータだけのドキュメントを作り、フィルターの設定を読み込む
+    doc = json.loads(
+        json.dumps({
+            "pandoc-api-version": data["pandoc-api-version"],
+            "meta": data["meta"],
+            "blocks": []
+        }),
+        object_hook=pf.elements.from_json)
+    init_cross_refs(doc)
+    if state:
+        set_numbering_state(doc, state)
+
+    for i, block in enumerate(data["blocks"]):
+        scan_block(doc, block, i)
+
+    if doc.diagnostics.has_errors():
+        raise CrossDocIndexError(doc.diagnostics.get_report_text())
+
+    list_ref = [(identifier, record.kind, record.number, record.title)
+                for identifier, record in doc.reference_registry.items()]
+    return list_ref, get_numbering_state(doc)
+
+
+def scan_block(doc: pf.Doc, block: Dict, block_index: int) -> None:
+    """トップレベルのブロックを1つスキャンして、番号を付けて参照を登録する
+
+    番号付けに関係する要素を含まないブロックは、panfluteの要素に変換せずに読み飛ばす。
+    番号付けに関係する要素を含むブロックは、JSONの文字列を経由せずにpanfluteの要素に変換し、
+    番号付けと参照の登録だけを行う(_scan_element()を参照)。
+
+    Args:
+        doc (pf.Doc):
+            init_cross_refs()で初期化したドキュメント(ブロックは含まなくてよい)
+        block (dict):
+            ブロックのpandocのJSON(json.loads()したもの)
+        block_index (int):
+            ブロックの番号(0始まり。エラーの位置の報告に使う)
+    """
+    if not _contains_numbered_element(block):
+        return
+    elem = _load_element(_strip_table_rows(block))
+    # ドキュメントから切り離して処理するので、エラーの位置はブロックの番号で指定する
+    doc.diagnostics.block_index = block_index
+    _scan_element(elem, doc)
+
+
+def _scan_element(elem: pf.Element, doc: pf.Doc) -> None:
+    """要素を子要素から順に走査し、番号付けと参照の登録だけを行う
+
+    pf.Element.walk()と同じ順番で走査するが、要素の置き換えはしない(事前スキャンの要素は捨てるので)。
+    目次などの目印の段落と、タイトルに含まれない引用(本文の引用)は、チャンクの変換で処理するので読み飛ばす
+    """
+    for child_name in elem._children:
+        child = getattr(elem, child_name)
+        if isinstance(child, ListContainer):
+            for item in child.list:
+                _scan_element(item, doc)
+        elif isinstance(child, DictContainer):
+            for item in child.dict.values():
+                _scan_element(item, doc)
+        elif child is not None:
+            _scan_element(child, doc)
+
+    if type(elem) in SCANNED_ELEMENT_TYPES:
+        action(elem, doc)
+    elif isinstance(elem, pf.Cite) and _is_in_title(elem):
+        action(elem, doc)
+
+
+def _is_in_title(elem: pf.Element) -> bool:
+    """要素が、ヘッダーやキャプションなど、登録するタイトルの中にあるかどうか判定する"""
+    parent = elem.parent
+    while parent is not None:
+        if isinstance(parent, TITLED_ELEMENT_TYPES):
+            return True
+        parent = parent.parent
+    return False
+
+
+def _load_element(node):
+    """json.loads()したpandocのJSONを、panfluteの要素に変換する
+
+    json.loads()のobject_hookにpf.elements.from_jsonを指定した場合と同じ結果になる
+    (JSONの文字列に戻して読み込み直さない)
+    """
+    if isinstance(node, list):
+        return [_load_element(child) for child in node]
+    if isinstance(node, dict):
+        return pf.elements.from_json({key: _load_element(value) for key, value in node.items()})
+    return node
+
+
+def _contains_numbered_element(node) -> bool:
+    """番号付けに関係する要素を含むかどうか判定する"""
+    if isinstance(node, dict):
+        if node.get("t") in NUMBERED_ELEMENT_TYPES:
+            return True
+        return _contains_numbered_element(node.get("c"))
+    if isinstance(node, list):
+        return any(_contains_numbered_element(child) for child in node)
+    return False
+
+
+def _strip_table_rows(node):
+    """表の行を、列数の確認に必要な最初の1行だけにする
+
+    番号付けにはキャプションと列の定義しか使わないので、残りの行はpanfluteの要素に変換しない
+    """
+    if isinstance(node, list):
+        return [_strip_table_rows(child) for child in node]
+    if not isinstance(node, dict) or "c" not in node:
+        return node
+    if node.get("t") == "Table":
+        attr, caption, colspecs, head, bodies, foot = node["c"]
+        head = [head[0], head[1][:1]]
+        bodies = [[body[0], body[1], [], body[3][:1]] for body in bodies[:1]]
+        foot = [foot[0], []]
+        return {
+            "t": "Table",
+            "c": _strip_table_rows([attr, caption, colspecs, head, bodies, foot])
+        }
+    return {"t": node["t"], "c": _strip_table_rows(node["c"])}
+
+
+def build_index(index_path: str,
+                list_source: Sequence[str],
+                from_format: str | None = None,
+                jobs: int | None = None) -> None:
+    """入力ファイルをpandocで読み込み、インデックスを作る
+
+    pandocでの読み込みは並列に行い、スキャンは本の順番に行う
+
+    Args:
+        index_path (str):
+            インデックスのファイルのパス
+        list_source (list(str)):
+            入力ファイルの一覧(本の順番に並べる)
+        from_format (str | None):
+            入力フォーマット。Noneの場合はpandocに推定させる
+        jobs (int | None):
+            pandocを並列に実行する数
+
+    Raises:
+        PandocError: pandocの実行に失敗した
+        CrossDocIndexError: 参照IDが複数の章で重複している、または章の中にエラーがある
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list_json = list(executor.map(
+            lambda source: read_json(source, from_format=from_format), list_source))
+
+    list_chapter = []
+    state = {}
+    for source, json_text in zip(list_source, list_json):
+        try:
+            list_ref, next_state = scan_chapter(json_text, state)
+        except CrossDocIndexError as e:
+            raise CrossDocIndexError(f"{source}: {e}") from e
+        list_chapter.append((source, state, list_ref))
+        state = next_state
+
+    index = CrossDocIndex(index_path)
+    try:
+        index.write(list_chapter)
+    finally:
+        index.close()
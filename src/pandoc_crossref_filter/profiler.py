@@ -0,0 +1,558 @@
+import gc
+import os
+import sys
+import json
+import time
+import heapq
+import threading
+import collections
+import contextlib
+import tracemalloc
+from typing import List, Dict, Tuple, Callable
+
+import panflute as pf
+
+from . import utils
+from .config import (
+    PROFILE_ENV,
+    PROFILE_OUTPUT_ENV,
+    PROFILE_FORMAT_ENV,
+    PROFILE_MEMORY_ENV,
+    PROFILE_TRACE_ENV
+)
+
+
+logger = utils.get_logger()
+
+# 出力ファイルのフォーマット
+PROFILE_FORMATS = ("json", "chrome")
+# メモリの計測で報告する、確保したメモリの大きい箇所の数
+MEMORY_TOP_ALLOCATIONS = 10
+# メモリの計測で報告する、生存しているpanfluteの要素の型の数
+MEMORY_TOP_ELEMENT_TYPES = 10
+# 確保したメモリの集計から除外するファイル
+MEMORY_IGNORE_FILES = (tracemalloc.__file__, "<frozen importlib._bootstrap>", "<unknown>")
+# 要素のトレースで記録する、処理時間の長い要素の数
+TRACE_SLOW_NODES = 10
+
+
+class Profiler():
+    def __init__(self,
+                 output_path: str | None = None,
+                 output_format: str = "json",
+                 memory: bool = False,
+                 trace: bool = False,
+                 summary: bool = True) -> None:
+        """フィルターの処理時間の計測
+
+        - phase(): JSONの読み込み、prepare()、走査などの段階の時間を計測する(入れ子にできる)
+        - add(): 要素の登録など、回数の多い処理の時間を名前ごとに集計する
+        - count(): キャッシュのヒット数などを数える
+
+        memoryを指定した場合は、tracemallocでメモリも計測する。
+        一番外側の段階の終わりごとに、メモリの使用量とピーク、生存しているpanfluteの要素の数、
+        参照の管理クラスが保持している要素の数(set_memory_probe()を参照)を記録し、
+        メモリの使用量が一番大きかった時点で、確保したメモリの大きい箇所を記録する。
+
+        traceを指定した場合は、要素の型ごとに処理した数と処理時間を集計し、
+        処理時間の長い要素を記録する(trace_element()を参照)。
+
+        変換サービスなど、複数のスレッドから計測できるように、集計結果の更新はロックする。
+        段階の深さはスレッドごとに数える。
+
+        Args:
+            output_path (str | None):
+                計測結果の保存先。Noneの場合は標準エラー出力に要約を出力するだけ
+            output_format (str):
+                計測結果のフォーマット
+                - json: 段階ごとの時間と集計結果のJSON
+                - chrome: Chromeのトレースイベントの形式(chrome://tracingやPerfettoで表示できる)
+            memory (bool):
+                メモリも計測するかどうか(処理は大幅に遅くなる)
+            trace (bool):
+                要素ごとの処理時間を記録するかどうか
+            summary (bool):
+                終了時に、標準エラー出力に要約を出力するかどうか
+                (実行結果のメトリクスのために、段階ごとの時間だけを計測する場合はFalse)
+        """
+        if output_format not in PROFILE_FORMATS:
+            logger.warning(f"Unknown profile format '{output_format}'. Use 'json'.")
+            output_format = "json"
+        self.enabled: bool = True
+        self.output_path: str | None = output_path
+        self.output_format: str = output_format
+        self.summary: bool = summary
+        # 計測の開始時刻(各段階の開始時刻は、ここからの経過時間にする)
+        self.origin: float = time.perf_counter()
+        # 段階の一覧(終わった順)
+        self.list_span: List[Dict] = []
+        # 名前 -> 集計結果
+        self.stats: Dict[str, Dict] = {}
+        # 名前 -> 回数
+        self.counters: Dict[str, int] = {}
+        # 集計結果を更新するときのロック
+        self.lock: threading.RLock = threading.RLock()
+        # スレッドごとの、実行中の段階の深さ
+        self.local: threading.local = threading.local()
+
+        # メモリの計測
+        self.memory: bool = memory
+        # 参照の管理クラスが保持している要素の数を返す関数
+        self.memory_probe: Callable[[], Dict[str, int]] | None = None
+        # メモリの使用量が一番大きかった時点の、段階の名前と確保したメモリの大きい箇所
+        self.memory_max_phase: str | None = None
+        self.memory_max_current: int = -1
+        self.list_allocation: List[Dict] = []
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        # 要素のトレース
+        self.trace: bool = trace
+        # 要素の型の名前 -> 処理した数と処理時間
+        self.trace_stats: Dict[str, List] = {}
+        # 処理時間の長い要素(処理時間の短い順のヒープ)
+        self.list_slow_node: List[Tuple[float, int, Dict]] = []
+        self.num_traced: int = 0
+
+    def merge(self,
+              output_path: str | None = None,
+              output_format: str = "json",
+              memory: bool = False,
+              trace: bool = False,
+              summary: bool = True) -> None:
+        """有効になっているプロファイラーに、後から指定された設定を追加する
+
+        実行結果のメトリクスのために要約なしで有効にした後で、メタデータで計測を指定された場合などに使う。
+        計測の種類と要約の出力は、どちらかで指定されていれば有効にする。
+        保存先は、先に指定されたものを優先する。
+
+        Args:
+            引数はコンストラクタと同じ
+        """
+        if self.output_path is None and output_path:
+            if output_format not in PROFILE_FORMATS:
+                logger.warning(f"Unknown profile format '{output_format}'. Use 'json'.")
+                output_format = "json"
+            self.output_path = output_path
+            self.output_format = output_format
+        self.summary = self.summary or summary
+        if memory and not self.memory:
+            self.memory = True
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+        self.trace = self.trace or trace
+
+    @contextlib.contextmanager
+    def phase(self, name: str, group: str | None = None):
+        """withで囲んだ段階の時間を計測する
+
+        Args:
+            name (str):
+                段階の名前
+            group (str | None):
+                図ごとの出力など、同じ種類の段階をまとめて集計する場合の名前
+        """
+        depth = getattr(self.local, "depth", 0)
+        if self.memory and depth == 0:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        self.local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self.local.depth = depth
+            seconds = time.perf_counter() - start
+            span = {
+                "name": name,
+                "group": group,
+                "start": start - self.origin,
+                "seconds": seconds,
+                "depth": depth
+            }
+            with self.lock:
+                if self.memory and depth == 0:
+                    span["memory"] = self._measure_memory(name)
+                self.list_span.append(span)
+                if group is not None:
+                    self.add(group, seconds, name)
+
+    def trace_element(self,
+                      elem: pf.Element,
+                      seconds: float,
+                      get_position: Callable[[], Tuple[int | None, str | None]]) -> None:
+        """要素の処理時間を記録する
+
+        Args:
+            elem (pf.Element):
+                処理した要素
+            seconds (float):
+                処理時間(子要素の処理時間は含まない)
+            get_position (Callable):
+                要素の位置(トップレベルのブロックの番号、直前のヘッダー)を返す関数。
+                処理時間の長い要素として記録する場合だけ呼ぶ
+        """
+        name = type(elem).__name__
+        with self.lock:
+            stat = self.trace_stats.get(name)
+            if stat is None:
+                stat = self.trace_stats[name] = [0, 0.0]
+            stat[0] += 1
+            stat[1] += seconds
+
+            self.num_traced += 1
+            if len(self.list_slow_node) >= TRACE_SLOW_NODES and \
+                    seconds <= self.list_slow_node[0][0]:
+                return
+            block, header = get_position()
+            node = {
+                "type": name,
+                "seconds": seconds,
+                "identifier": getattr(elem, "identifier", "") or "",
+                "block": block,
+                "header": header
+            }
+            if len(self.list_slow_node) < TRACE_SLOW_NODES:
+                heapq.heappush(self.list_slow_node, (seconds, self.num_traced, node))
+            else:
+                heapq.heapreplace(self.list_slow_node, (seconds, self.num_traced, node))
+
+    def set_memory_probe(self, probe: Callable[[], Dict[str, int]]) -> None:
+        """メモリの計測で、参照の管理クラスが保持している要素の数を取得する関数を設定する
+
+        Args:
+            probe (Callable):
+                名前 -> 要素の数の辞書を返す関数
+        """
+        self.memory_probe = probe
+
+    def _measure_memory(self, name: str) -> Dict:
+        """段階の終わりのメモリを計測する
+
+        Args:
+            name (str):
+                段階の名前
+
+        Returns:
+            dict:
+                - current (int): メモリの使用量(バイト)
+                - peak (int): 段階の中でのメモリの使用量のピーク(バイト)
+                - elements (dict): panfluteの要素の型 -> 生存している数(多い順)
+                - registries (dict): 名前 -> 参照の管理クラスが保持している要素の数
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        counter = collections.Counter(
+            type(obj).__name__ for obj in gc.get_objects() if isinstance(obj, pf.Element))
+        if current > self.memory_max_current:
+            self.memory_max_current = current
+            self.memory_max_phase = name
+            self.list_allocation = self._get_top_allocations()
+        return {
+            "current": current,
+            "peak": peak,
+            "elements": dict(counter.most_common(MEMORY_TOP_ELEMENT_TYPES)),
+            "registries": self.memory_probe() if self.memory_probe is not None else {}
+        }
+
+    @staticmethod
+    def _get_top_allocations() -> List[Dict]:
+        """確保したメモリの大きい箇所を取得する
+
+        Returns:
+            list(dict):
+                - location (str): ファイル名と行番号
+                - size (int): 確保しているメモリ(バイト)
+                - count (int): 確保しているメモリのブロックの数
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, filename) for filename in MEMORY_IGNORE_FILES])
+        list_allocation = []
+        for stat in snapshot.statistics("lineno")[:MEMORY_TOP_ALLOCATIONS]:
+            frame = stat.traceback[0]
+            list_allocation.append({
+                "location": f"{frame.filename}:{frame.lineno}",
+                "size": stat.size,
+                "count": stat.count
+            })
+        return list_allocation
+
+    def add(self, name: str, seconds: float, label: str | None = None) -> None:
+        """処理時間を名前ごとに集計する
+
+        Args:
+            name (str):
+                集計する名前
+            seconds (float):
+                処理時間
+            label (str | None):
+                一番時間のかかった処理として記録する名前(図のファイル名など)
+        """
+        with self.lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = \
+                    {"count": 0, "seconds": 0.0, "max": 0.0, "max_label": None}
+            stat["count"] += 1
+            stat["seconds"] += seconds
+            if seconds > stat["max"]:
+                stat["max"] = seconds
+                stat["max_label"] = label
+
+    def count(self, name: str, num: int = 1) -> None:
+        """回数を数える
+
+        Args:
+            name (str):
+                数える名前
+            num (int):
+                加算する数
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + num
+
+    def get_report(self) -> Dict:
+        """計測結果を取得する
+
+        Returns:
+            dict:
+                - total (float): 計測の開始からの経過時間
+                - phases (list(dict)): 段階の一覧(開始順)
+                - items (list(dict)): 図ごとの出力など、まとめて集計する段階の一覧(開始順)
+                - stages (dict): 名前 -> 回数、合計時間、最大時間
+                - counters (dict): 名前 -> 回数
+                - memory (dict): メモリも計測した場合のみ
+                    - max_phase (str): メモリの使用量が一番大きかった段階
+                    - allocations (list(dict)): その時点で確保したメモリの大きい箇所
+                - trace (dict): 要素をトレースした場合のみ
+                    - elements (dict): 要素の型の名前 -> 処理した数と処理時間(処理時間の長い順)
+                    - slow_nodes (list(dict)): 処理時間の長い要素(型、処理時間、ID、位置)
+        """
+        with self.lock:
+            list_span = sorted(self.list_span, key=lambda span: span["start"])
+            report = {
+                "total": time.perf_counter() - self.origin,
+                "phases": [span for span in list_span if span["group"] is None],
+                "items": [span for span in list_span if span["group"] is not None],
+                "stages": {name: dict(stat) for name, stat in self.stats.items()},
+                "counters": dict(self.counters)
+            }
+            if self.memory:
+                report["memory"] = {
+                    "max_phase": self.memory_max_phase,
+                    "allocations": self.list_allocation
+                }
+            if self.trace:
+                list_stat = sorted(self.trace_stats.items(), key=lambda item: -item[1][1])
+                report["trace"] = {
+                    "elements": {name: {"count": count, "seconds": seconds}
+                                 for name, (count, seconds) in list_stat},
+                    "slow_nodes": [node for _, _, node
+                                   in sorted(self.list_slow_node, reverse=True)]
+                }
+        return report
+
+    def get_report_text(self, report: Dict | None = None) -> str:
+        """計測結果の要約を、人が読む形式で取得する"""
+        if report is None:
+            report = self.get_report()
+        total = report["total"]
+        list_line = [f"Profile: total {total:.3f}s"]
+        for span in report["phases"]:
+            ratio = span["seconds"] / total * 100 if total > 0 else 0.0
+            name = "  " * span["depth"] + span["name"]
+            line = f"  {name:<32} {span['seconds']:9.3f}s {ratio:5.1f}%"
+            if "memory" in span:
+                line += (f" current {_format_mb(span['memory']['current'])}"
+                         f" peak {_format_mb(span['memory']['peak'])}")
+            list_line.append(line)
+        for name, stat in sorted(report["stages"].items()):
+            line = f"  {name:<32} {stat['seconds']:9.3f}s n={stat['count']}"
+            if stat["max_label"] is not None:
+                line += f" max={stat['max']:.3f}s ({stat['max_label']})"
+            list_line.append(line)
+        for name, num in sorted(report["counters"].items()):
+            list_line.append(f"  {name:<32} {num:>10}")
+        if "memory" in report:
+            list_line.extend(self._get_memory_report_lines(report))
+        if "trace" in report:
+            list_line.extend(self._get_trace_report_lines(report))
+        return "\n".join(list_line)
+
+    @staticmethod
+    def _get_trace_report_lines(report: Dict) -> List[str]:
+        """要素のトレースの結果の要約を取得する"""
+        list_line = ["Trace: elements"]
+        for name, stat in report["trace"]["elements"].items():
+            list_line.append(f"  {name:<32} {stat['seconds']:9.3f}s n={stat['count']}")
+        list_line.append("Trace: slow nodes")
+        for node in report["trace"]["slow_nodes"]:
+            identifier = f" #{node['identifier']}" if node["identifier"] else ""
+            list_line.append(
+                f"  {node['seconds']:9.6f}s {node['type']}{identifier}"
+                f" (block: {node['block']}, header: {node['header']})")
+        return list_line
+
+    @staticmethod
+    def _get_memory_report_lines(report: Dict) -> List[str]:
+        """メモリの計測結果の要約を取得する"""
+        max_phase = report["memory"]["max_phase"]
+        list_line = [f"Memory: largest after '{max_phase}'"]
+        for span in report["phases"]:
+            if span["name"] != max_phase or "memory" not in span:
+                continue
+            for name, num in span["memory"]["elements"].items():
+                list_line.append(f"  element {name:<24} {num:>10}")
+            for name, num in span["memory"]["registries"].items():
+                list_line.append(f"  {name:<32} {num:>10}")
+        for allocation in report["memory"]["allocations"]:
+            list_line.append(
+                f"  {_format_mb(allocation['size'])} {allocation['count']:>8} {allocation['location']}")
+        return list_line
+
+    def get_chrome_trace(self, report: Dict | None = None) -> Dict:
+        """計測結果を、Chromeのトレースイベントの形式で取得する"""
+        if report is None:
+            report = self.get_report()
+        pid = os.getpid()
+        list_event = [{
+            "name": span["name"],
+            "cat": span["group"] or "phase",
+            "ph": "X",
+            "ts": span["start"] * 1e6,
+            "dur": span["seconds"] * 1e6,
+            "pid": pid,
+            "tid": 0
+        } for span in report["phases"] + report["items"]]
+        if report["counters"]:
+            list_event.append({
+                "name": "counters",
+                "ph": "C",
+                "ts": report["total"] * 1e6,
+                "pid": pid,
+                "args": report["counters"]
+            })
+        return {"traceEvents": list_event, "displayTimeUnit": "ms"}
+
+    def finish(self) -> None:
+        """計測結果の要約を標準エラー出力に出力し、保存先が指定されていればファイルに保存する"""
+        report = self.get_report()
+        # 標準出力はpandocが使うので、標準エラー出力に出力する
+        if self.summary:
+            sys.stderr.write(self.get_report_text(report) + "\n")
+        if not self.output_path:
+            return
+        data = report if self.output_format == "json" else self.get_chrome_trace(report)
+        try:
+            with open(self.output_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            logger.warning(f"Failed to write the profile '{self.output_path}': {e}")
+
+
+def _format_mb(size: int) -> str:
+    """バイト数をMB単位の文字列にする"""
+    return f"{size / 1024 / 1024:8.1f}MB"
+
+
+class NullProfiler():
+    """プロファイルが無効な場合の、何もしないプロファイラー
+
+    計測する箇所からは常にget_profiler()経由で呼び出すので、無効な場合の負荷は関数呼び出しだけになる
+    """
+    enabled: bool = False
+    trace: bool = False
+
+    def phase(self, name: str, group: str | None = None):
+        return _NULL_PHASE
+
+    def add(self, name: str, seconds: float, label: str | None = None) -> None:
+        pass
+
+    def count(self, name: str, num: int = 1) -> None:
+        pass
+
+    def set_memory_probe(self, probe: Callable[[], Dict[str, int]]) -> None:
+        pass
+
+    def finish(self) -> None:
+        pass
+
+
+# 何もしないwithの対象(使いまわす)
+_NULL_PHASE = contextlib.nullcontext()
+
+# プロセス内で共有するプロファイラー
+_profiler: Profiler | NullProfiler = NullProfiler()
+# プロファイラーを有効にするときのロック(複数のスレッドから有効にしても、1つだけ作る)
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> Profiler | NullProfiler:
+    """プロセス内で共有するプロファイラーを取得する
+
+    Returns:
+        Profiler | NullProfiler: 有効でなければNullProfiler
+    """
+    return _profiler
+
+
+def enable_profiler(output_path: str | None = None,
+                    output_format: str = "json",
+                    memory: bool = False,
+                    trace: bool = False,
+                    summary: bool = True) -> Profiler:
+    """プロファイラーを有効にする(有効になっていれば、設定を追加する。Profiler.merge()を参照)
+
+    Args:
+        output_path (str | None):
+            計測結果の保存先
+        output_format (str):
+            計測結果のフォーマット("json", "chrome")
+        memory (bool):
+            メモリも計測するかどうか
+        trace (bool):
+            要素ごとの処理時間を記録するかどうか
+        summary (bool):
+            終了時に、標準エラー出力に要約を出力するかどうか
+
+    Returns:
+        Profiler: プロセス内で共有するプロファイラー
+    """
+    global _profiler
+    with _profiler_lock:
+        if _profiler.enabled:
+            _profiler.merge(output_path, output_format, memory, trace, summary)
+        else:
+            _profiler = Profiler(output_path, output_format, memory, trace, summary)
+        return _profiler
+
+
+def setup_from_env() -> None:
+    """環境変数(config.PROFILE_ENV, config.PROFILE_MEMORY_ENV, config.PROFILE_TRACE_ENV)が
+    指定されていれば、プロファイラーを有効にする
+    """
+    memory = bool(os.environ.get(PROFILE_MEMORY_ENV))
+    trace = bool(os.environ.get(PROFILE_TRACE_ENV))
+    if os.environ.get(PROFILE_ENV) or memory or trace:
+        enable_profiler(
+            os.environ.get(PROFILE_OUTPUT_ENV),
+            os.environ.get(PROFILE_FORMAT_ENV, "json"),
+            memory,
+            trace)
+
+
+def setup_from_metadata(config: Dict) -> None:
+    """メタデータで指定されていれば、プロファイラーを有効にする
+
+    Args:
+        config (dict):
+            設定
+            - enable (bool): 有効にするかどうか
+            - output (str): 計測結果の保存先
+            - format (str): 計測結果のフォーマット("json", "chrome")
+            - memory (bool): メモリも計測するかどうか
+            - trace (bool): 要素ごとの処理時間を記録するかどうか
+    """
+    memory = bool(config.get("memory", False))
+    trace = bool(config.get("trace", False))
+    if config.get("enable", False) or memory or trace:
+        enable_profiler(config.get("output"), config.get("format", "json"), memory, trace)
@@ -0,0 +1,181 @@
+import sys
+from typing import Callable, Dict, Iterator, Tuple
+
+import panflute as pf
+
+from . import utils
+from .diagnostics import Diagnostics, MISSING_REFERENCE_TEXT
+
+
+logger = utils.get_logger()
+
+# 参照IDの接頭辞と、参照の種類
+PREFIX_KINDS: Dict[str, str] = {
+    "sec": "section",
+    "fig": "figure",
+    "tbl": "table",
+    "eq": "equation",
+    "lst": "listing",
+}
+
+
+def get_prefix(identifier: str) -> str:
+    """参照IDの接頭辞を取得する
+
+    例: "fig:test" -> "fig"
+    """
+    return identifier.partition(":")[0]
+
+
+class RefRecord():
+    """登録済みの参照(番号とタイトル)"""
+    __slots__ = ("number", "title", "kind")
+
+    def __init__(self, number: str, title: str, kind: str) -> None:
+        self.number: str = number
+        self.title: str = title
+        self.kind: str = kind
+
+
+class PendingRef():
+    """書き換えを待っている参照(最後に書き換える)"""
+    __slots__ = ("key", "target", "add_title", "is_header", "position")
+
+    def __init__(self,
+                 key: str,
+                 target: pf.Str,
+                 add_title: bool,
+                 is_header: bool,
+                 position: Tuple[int | None, str | None] | None = None) -> None:
+        self.key: str = key
+        self.target: pf.Str = target
+        self.add_title: bool = add_title
+        self.is_header: bool = is_header
+        # 引用の位置(Diagnostics.get_position()の戻り値)
+        self.position: Tuple[int | None, str | None] | None = position
+
+
+class ReferenceRegistry():
+    def __init__(self, diagnostics: Diagnostics | None = None) -> None:
+        """参照の登録先
+
+        セクション、図、表の参照を、参照IDをキーとして1つの辞書で管理する
+
+        Args:
+            diagnostics (Diagnostics | None):
+                エラーの収集先。Noneの場合は新しく作成する
+        """
+        # 参照ID -> RefRecord
+        self.records: Dict[str, RefRecord] = {}
+        # 他のドキュメントの参照を解決するためのインデックス
+        self.cross_doc_index = None
+        # エラーの収集先(参照を登録する各クラスで共有する)
+        self.diagnostics: Diagnostics = \
+            diagnostics if diagnostics is not None else Diagnostics()
+        # 参照の文字列のキャッシュ (参照ID, タイトルを追加するか, ヘッダーか) -> 文字列
+        self.dict_reference_string: Dict[Tuple[str, bool, bool], str] = {}
+        # 登録済みの参照への引用(すぐに書き換えた)の数
+        self.num_backward_ref: int = 0
+        # 未登録の参照への引用(最後に書き換える)の数
+        self.num_forward_ref: int = 0
+
+    def add(self, identifier: str, number: str, title: str) -> bool:
+        """参照を登録する
+
+        Args:
+            identifier (str):
+                参照ID
+            number (str):
+                番号
+            title (str):
+                タイトル
+
+        Returns:
+            bool: 登録済みの参照IDの場合はFalse(登録しない)
+        """
+        if identifier in self.records:
+            return False
+        self.records[identifier] = RefRecord(
+            number, title, PREFIX_KINDS.get(get_prefix(identifier), ""))
+        return True
+
+    def has(self, identifier: str) -> bool:
+        """ドキュメント内で登録済みの参照かどうか判定する(インデックスは見ない)"""
+        return identifier in self.records
+
+    def get(self, identifier: str) -> RefRecord | None:
+        """参照を取得する
+
+        ドキュメント内で見つからない場合は、インデックスから読み込む
+
+        Args:
+            identifier (str):
+                参照ID
+
+        Returns:
+            RefRecord | None: 見つからなければNone
+        """
+        record = self.records.get(identifier)
+        if record is None and self.cross_doc_index is not None:
+            ref = self.cross_doc_index.get_reference(identifier)
+            if ref is not None:
+                self.add(identifier, ref[0], ref[1])
+                record = self.records[identifier]
+        return record
+
+    def get_reference_string(self,
+                             key: str,
+                             add_title: bool,
+                             is_header: bool,
+                             format_reference: Callable[[str, bool, bool], str],
+                             position: Tuple[int | None, str | None] | None = None) -> str:
+        """参照の文字列を取得する
+
+        同じ参照の文字列は1回だけ作成し、同じ文字列オブジェクトを返す
+        参照が見つからない場合は、エラーを記録してMISSING_REFERENCE_TEXTを返す
+
+        Args:
+            key (str):
+                参照ID
+            add_title (bool):
+                タイトルを追加するかどうか
+            is_header (bool):
+                ヘッダーかどうか
+            format_reference (callable):
+                キャッシュに無い場合に、参照の文字列を作成する関数(参照は登録済み)
+            position (tuple | None):
+                引用の位置(エラーの報告に使う)
+
+        Returns:
+            str: 参照の文字列
+        """
+        cache_key = (key, add_title, is_header)
+        reference_string = self.dict_reference_string.get(cache_key)
+        if reference_string is None:
+            if self.get(key) is None:
+                self.diagnostics.error(
+                    "missing_reference", f"No such reference: '{key}'.", position)
+                return MISSING_REFERENCE_TEXT
+            reference_string = format_reference(key, add_title, is_header)
+            self.dict_reference_string[cache_key] = reference_string
+        return reference_string
+
+    def get_stats(self) -> Dict:
+        """引用の解決の統計を取得する
+
+        Returns:
+            dict:
+                - backward (int): すぐに書き換えた引用の数
+                - forward (int): 最後に書き換えた引用の数
+                - saved_pending_bytes (int): すぐに書き換えたことで記憶せずに済んだPendingRefのバイト数
+        """
+        pending_size = sys.getsizeof(PendingRef("", None, False, False))
+        return {
+            "backward": self.num_backward_ref,
+            "forward": self.num_forward_ref,
+            "saved_pending_bytes": self.num_backward_ref * pending_size
+        }
+
+    def items(self) -> Iterator[Tuple[str, RefRecord]]:
+        """登録済みの参照を、登録順に返す"""
+        return iter(self.records.items())
@@ -0,0 +1,162 @@
+import os
+import json
+import hashlib
+import tempfile
+from typing import List, Sequence
+
+from . import utils
+
+
+logger = utils.get_logger()
+
+# キャッシュの形式が変わったときに更新する
+CACHE_VERSION = "1"
+# キャッシュファイルの拡張子
+CACHE_SUFFIX = ".cache"
+
+
+class ResultCache():
+    """フィルターの変換結果のキャッシュ
+
+    入力されたJSONのバイト列と出力フォーマットのハッシュをキーとして、
+    変換後のJSONを保存する。
+    pandoc_crossref_filterの設定(メタデータ)は入力JSONに含まれているので、
+    設定が変わればキーも変わる。
+    他のドキュメント(章)の参照のインデックスなど、入力JSON以外に変換結果が依存するファイルは、
+    内容のハッシュをキーに含める。
+
+    キャッシュファイルは以下の形式で保存する。
+    - 1行目: 出力した画像のファイル名の一覧(JSON)
+    - 2行目以降: 変換後のJSON
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int) -> None:
+        """コンストラクタ
+
+        Args:
+            cache_dir (str):
+                キャッシュの保存先のディレクトリ
+            max_bytes (int):
+                キャッシュの合計サイズの上限。超えた場合は古いものから削除する
+        """
+        self.cache_dir: str = cache_dir
+        self.max_bytes: int = max_bytes
+
+    @staticmethod
+    def make_key(input_bytes: bytes,
+                 output_format: str,
+                 dependency_paths: Sequence[str] = ()) -> str:
+        """キャッシュのキーを生成する
+
+        Args:
+            input_bytes (bytes):
+                pandocから受け取ったJSONのバイト列
+            output_format (str):
+                出力フォーマット(doc.format)
+            dependency_paths (list(str)):
+                変換結果が依存するファイルのパス(存在しないファイルも、存在しないことをキーに含める)
+
+        Returns:
+            str: キャッシュのキー
+        """
+        hash_object = hashlib.sha256()
+        hash_object.update(CACHE_VERSION.encode())
+        hash_object.update(b"\0")
+        hash_object.update(output_format.encode())
+        hash_object.update(b"\0")
+        hash_object.update(input_bytes)
+        for path in dependency_paths:
+            hash_object.update(b"\0")
+            hash_object.update(os.path.abspath(path).encode())
+            try:
+                with open(path, "rb") as f:
+                    hash_object.update(b"\1" + hashlib.sha256(f.read()).digest())
+            except OSError:
+                hash_object.update(b"\2")
+        return hash_object.hexdigest()
+
+    def get(self, key: str) -> bytes | None:
+        """キャッシュから変換結果を取得する
+
+        出力済みの画像が1つでも存在しない場合は、キャッシュミスとして扱う。
+
+        Args:
+            key (str):
+                キャッシュのキー
+
+        Returns:
+            bytes | None:
+                変換後のJSON。キャッシュが無ければNone
+        """
+        path = self._get_path(key)
+        try:
+            with open(path, "rb") as f:
+                list_filename = json.loads(f.readline())
+                output = f.read()
+        except (OSError, ValueError):
+            return None
+
+        # 画像が削除されていれば、再度フィルターを実行して出力させる
+        if not all(os.path.exists(filename) for filename in list_filename):
+            return None
+
+        # 最終アクセス日時を更新する(古いものから削除するため)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return output
+
+    def put(self, key: str, output: bytes, list_filename: List[str]) -> None:
+        """変換結果をキャッシュに保存する
+
+        Args:
+            key (str):
+                キャッシュのキー
+            output (bytes):
+                変換後のJSON
+            list_filename (list(str)):
+                出力した画像のファイル名の一覧
+        """
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # 別プロセスと同時に書き込んでも壊れないように、一時ファイル経由で保存する
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, "wb") as f:
+                f.write(json.dumps(list_filename).encode() + b"\n")
+                f.write(output)
+            os.replace(tmp_path, self._get_path(key))
+        except OSError as e:
+            # キャッシュの保存に失敗しても、変換結果には影響しない
+            logger.warning(f"Failed to save the result cache: {e}")
+            return
+
+        self._evict()
+
+    def _get_path(self, key: str) -> str:
+        """キャッシュファイルのパスを取得する"""
+        return os.path.join(self.cache_dir, key + CACHE_SUFFIX)
+
+    def _evict(self) -> None:
+        """合計サイズが上限を超えていれば、最終アクセスが古いものから削除する"""
+        list_entry = []
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(CACHE_SUFFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            list_entry.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+
+        list_entry.sort()
+        for _, size, path in list_entry:
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
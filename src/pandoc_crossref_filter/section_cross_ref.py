@@ -1,16 +1,25 @@
-import sys
 from typing import List, Dict
 
 import panflute as pf
 
 from . import utils
+from .registry import ReferenceRegistry
+from .cross_ref_base import CrossRefBase
+from .numbering import NumberingEngine
 
 
 logger = utils.get_logger()
 
 
-class SectionCrossRef():
-    def __init__(self, config: Dict, enable_link: bool) -> None:
+class SectionCrossRef(CrossRefBase):
+    # ヘッダー内の参照は、リンクを張らずにセクション番号だけにする
+    format_header_reference = True
+
+    def __init__(self,
+                 config: Dict,
+                 enable_link: bool,
+                 registry: ReferenceRegistry | None = None,
+                 numbering: NumberingEngine | None = None) -> None:
         """コンストラクタ
 
         Args:
@@ -28,6 +37,10 @@ class SectionCrossRef():
                     セクション番号の参照のテンプレート。レベルに応じて配列で設定できる
             enable_link (bool):
                 参照にリンクを張るかどうか
+            registry (ReferenceRegistry | None):
+                参照の登録先(図、表と共有する)。Noneの場合は新しく作成する
+            numbering (NumberingEngine | None):
+                連番の管理(図、表と共有する)。セクション番号が変わったときに通知する
         """
         self.auto_section: bool = bool(
             config.get("auto_section", False))
@@ -39,16 +52,15 @@ class SectionCrossRef():
             config.get("delimiter", ".")
         self.section_ref_template: List[str] = \
             config.get("section_ref_template", ["第%s章", "%s節", "%s項", "%s目"])
-        self.enable_link: bool = enable_link
+        super().__init__(enable_link, registry)
 
         # 現在のセクション番号
         self.list_present_section_numbers: List[int] = []
-        # 参照用のセクション番号を格納する辞書
-        self.references: Dict = {}
-        # 参照用のセクションのタイトルを格納する辞書
-        self.references_title: Dict = {}
-        # 書き換えるべき項目を記憶する(最後に書き換える)
-        self.list_replace_target: List[Dict] = []
+        # 連番の管理
+        self.numbering: NumberingEngine = \
+            numbering if numbering is not None else NumberingEngine()
+        # 登録したヘッダーの数(番号を付けないヘッダーも含む)
+        self.num_header: int = 0
 
     def register_section(self, elem: pf.Header) -> None:
         """セクション番号の登録
@@ -57,6 +69,8 @@ class SectionCrossRef():
             elem: pf.Header:
                 ヘッダー
         """
+        self.num_header += 1
+
         # セクション番号カウントの除外
         if self._is_unnumbered(elem.classes):
             return
@@ -115,6 +129,9 @@ class SectionCrossRef():
             self.list_present_section_numbers = \
                 self.list_present_section_numbers[:relative_header_level]
 
+        # 図や表の連番に、セクション番号の変更を通知する
+        self.numbering.set_section_numbers(self.list_present_section_numbers)
+
     def _get_section_number_str(self) -> str:
         """現在のセクション番号を文字列で取得する
 
@@ -130,7 +147,8 @@ class SectionCrossRef():
         """元のヘッダー内容の前にセクション番号を追加する
         """
         section_str = self._get_section_str(
-            section_number_str, self.section_title_template) + " "
+            section_number_str, self.section_title_template,
+            len(self.list_present_section_numbers) - 1) + " "
         content.insert(0, pf.Str(section_str))
 
     def _add_section_identifier(self,
@@ -151,57 +169,13 @@ class SectionCrossRef():
         if identifier.startswith("sec:") is False:
             return
 
-        # 重複登録はエラーで落とす
-        if identifier in self.references:
-            logger.error(f"Duplicate identifier: '{identifier}'")
-            sys.exit(1)
-
-        # 登録
-        self.references[identifier] = section_number_str
-
-        # タイトルも登録
-        self.references_title[identifier] = section_title
-
-    def add_reference(self,
-                      key: str,
-                      is_header: bool) -> pf.Str | pf.Link:
-        """参照を上書きするべき対象を一時的に記憶しておく
-
-        Args:
-            key (str): 参照の目印となるキー
-            is_header (bool): 上書き対象がヘッダーかどうか
+        # 登録(重複登録はエラーとして記録し、最初の登録を残す)
+        if not self.registry.add(identifier, section_number_str, section_title):
+            self.registry.diagnostics.error(
+                "duplicate_identifier", f"Duplicate identifier: '{identifier}'")
 
-        Returns:
-            pf.Str | pf.Link:
-                参照追加後の要素
-        """
-        key, is_add_title = utils.split_key_title(key)
-        target = pf.Str("")
-        self.list_replace_target.append({
-            "key": key,
-            "target": target,
-            "is_header": is_header,
-            "add_title": is_add_title
-        })
-
-        # ヘッダー内の参照なら終了
-        if is_header:
-            return target
-
-        if self.enable_link:
-            # 参照先へのリンクを張る
-            return pf.Link(target, url=f"#{key}")
-        else:
-            return target
-
-    def replace_reference(self) -> None:
-        """参照の上書き"""
-        for replace_target in self.list_replace_target:
-            replace_target["target"].text = self.get_reference_string(
-                replace_target["key"], replace_target["add_title"], replace_target["is_header"])
-
-    def get_reference_string(self, key: str, add_title: bool, is_header: bool=False) -> str:
-        """参照キーから、セクション番号の文字列を返す
+    def _format_reference(self, key: str, add_title: bool, is_header: bool) -> str:
+        """参照キーから、セクション番号の文字列を作成する
 
         Args:
             key (str):
@@ -215,12 +189,9 @@ class SectionCrossRef():
             str:
                 セクション番号の文字列
         """
-        # 参照キーが見つからない
-        if key not in self.references:
-            logger.error(f"No such reference: '{key}'.")
-            sys.exit(1)
+        record = self.registry.get(key)
 
-        section_number_str = self.references[key]
+        section_number_str = record.number
         # ヘッダー内の引用なら、セクション番号をそのまま返す
         if is_header is True:
             return section_number_str
@@ -230,7 +201,7 @@ class SectionCrossRef():
 
         # タイトルの追加
         if add_title is True:
-            section_title = self.references_title[key]
+            section_title = record.title
             if section_title != "":
                 reference_string += " " + section_title
 
@@ -238,7 +209,8 @@ class SectionCrossRef():
 
     def _get_section_str(self,
                          section_number_str: str,
-                         section_template: List[str]) -> str:
+                         section_template: List[str],
+                         level: int | None = None) -> str:
         """セクション番号の文字列を返す
 
         Args:
@@ -246,16 +218,44 @@ class SectionCrossRef():
                 セクション番号
             section_template (list(str)):
                 セクション文字列のテンプレート
+            level (int | None):
+                セクション番号の階層(0始まり)。Noneの場合は区切りの数から求める
 
         Returns:
             str: セクション文字列
         """
-        level = min(
-            len(section_template) - 1,
-            section_number_str.count(self.delimiter)
-        )
+        if level is None:
+            level = section_number_str.count(self.delimiter)
+        level = min(len(section_template) - 1, level)
         return section_template[level] % section_number_str
 
+    def get_stats(self) -> Dict:
+        """登録の統計を取得する
+
+        Returns:
+            dict:
+                - headers (int): 登録したヘッダーの数
+        """
+        return {"headers": self.num_header}
+
+    def get_numbering_state(self) -> List[int]:
+        """番号の状態を取得する(他のドキュメントの続きから番号を付けるために使う)
+
+        Returns:
+            list(int): 現在のセクション番号
+        """
+        return self.list_present_section_numbers.copy()
+
+    def set_numbering_state(self, state: List[int]) -> None:
+        """番号の状態を設定する
+
+        Args:
+            state (list(int)):
+                get_numbering_state()で取得した状態
+        """
+        self.list_present_section_numbers = list(state)
+        self.numbering.set_section_numbers(self.list_present_section_numbers)
+
     def get_present_section_numbers(self) -> List[int]:
         """現在のセクション番号を返す
 
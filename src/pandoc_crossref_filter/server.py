@@ -0,0 +1,419 @@
+import os
+import json
+import time
+import base64
+import mimetypes
+import tempfile
+import threading
+import collections
+import http.server
+import contextlib
+from typing import Dict, Iterator, Tuple
+
+import panflute as pf
+
+from . import utils
+from . import api
+from .pandoc_process import read_json, write_output, PandocError
+from .pandoc_crossref_filter import CONFIG_ROOT
+
+
+logger = utils.get_logger()
+
+# 出力フォーマットごとのContent-Type
+CONTENT_TYPES = {
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "html": "text/html; charset=utf-8",
+    "gfm": "text/markdown; charset=utf-8",
+}
+# レイテンシの統計に使う、直近のリクエスト数
+LATENCY_WINDOW = 1024
+# リクエストの本文の最大サイズ(バイト)
+MAX_REQUEST_BYTES = 10 * 1024 * 1024
+# pandocに常に渡す引数(リクエストのMarkdownから、サーバーのファイルを読み込めないようにする。
+# リクエストでは無効にできない。pandoc 2.15以降が必要)
+PANDOC_ARGS = ("--sandbox",)
+# リクエスト(メタデータとMarkdownの先頭のメタデータ)で指定できる、フィルターの設定
+# (画像の出力先、インデックス、プロファイル、メトリクスなど、サーバーのファイルを扱う設定は指定できない)
+ALLOWED_CONFIG_KEYS = (
+    "section",
+    "figure",
+    "table",
+    "equation",
+    "listing",
+    "toc",
+    "line_break",
+    "top_insert_text",
+)
+
+
+class ServiceBusyError(Exception):
+    """変換サービスが混雑していて、リクエストを受け付けられないときの例外"""
+
+
+class RequestTooLargeError(Exception):
+    """リクエストの本文が大きすぎるときの例外"""
+
+
+class LatencyRecorder():
+    def __init__(self, window: int) -> None:
+        """リクエストのレイテンシを記録する
+
+        Args:
+            window (int):
+                統計に使う直近のリクエスト数
+        """
+        self.lock: threading.Lock = threading.Lock()
+        self.latencies: collections.deque = collections.deque(maxlen=window)
+        self.counts: collections.Counter = collections.Counter()
+
+    def record(self, status: str, seconds: float) -> None:
+        """レイテンシを記録する
+
+        Args:
+            status (str):
+                結果("ok", "error", "rejected")
+            seconds (float):
+                レイテンシ(秒)
+        """
+        with self.lock:
+            self.counts[status] += 1
+            if status != "rejected":
+                self.latencies.append(seconds)
+
+    def get_summary(self) -> Dict:
+        """レイテンシの統計を取得する"""
+        with self.lock:
+            list_latency = sorted(self.latencies)
+            counts = dict(self.counts)
+
+        summary = {"requests": counts, "latency_ms": {}}
+        if len(list_latency) > 0:
+            for name, ratio in [("p50", 0.5), ("p90", 0.9), ("p99", 0.99)]:
+                index = min(len(list_latency) - 1, int(len(list_latency) * ratio))
+                summary["latency_ms"][name] = round(list_latency[index] * 1000, 3)
+            summary["latency_ms"]["max"] = round(list_latency[-1] * 1000, 3)
+            summary["latency_ms"]["samples"] = len(list_latency)
+        return summary
+
+
+class ConversionService():
+    def __init__(self,
+                 pandoc_workers: int = 4,
+                 max_pending: int = 16,
+                 queue_timeout: float = 10.0) -> None:
+        """Markdownを変換するサービス
+
+        - フィルターはプロセス内で適用する
+        - PlantUML/Mermaidの画像は、リクエストごとの一時ディレクトリに出力する
+          (同時に処理しているリクエストの画像が、互いに上書きしないようにする)
+        - pandocは--sandboxで実行する(リクエストのMarkdownで、サーバーのファイルを埋め込めないようにする)。
+          一時ディレクトリに出力した画像は、pandocから読み込めないので、data URIにして埋め込む
+        - 同時に起動するpandocのプロセス数をpandoc_workersまでに制限する
+        - 処理中のリクエストがmax_pendingを超えた場合や、
+          pandocの空きをqueue_timeout秒待っても空かない場合は、リクエストを拒否する
+
+        Args:
+            pandoc_workers (int):
+                同時に起動するpandocのプロセスの最大数
+            max_pending (int):
+                同時に受け付けるリクエストの最大数(pandocの空き待ちを含む)
+            queue_timeout (float):
+                pandocの空きを待つ最大の時間(秒)
+        """
+        self.pandoc_workers: int = pandoc_workers
+        self.max_pending: int = max_pending
+        self.queue_timeout: float = queue_timeout
+
+        self.pandoc_slots: threading.BoundedSemaphore = \
+            threading.BoundedSemaphore(pandoc_workers)
+        self.pending_slots: threading.BoundedSemaphore = \
+            threading.BoundedSemaphore(max_pending)
+        self.recorder: LatencyRecorder = LatencyRecorder(LATENCY_WINDOW)
+
+        # 処理中のリクエスト数
+        self.lock: threading.Lock = threading.Lock()
+        self.num_pending: int = 0
+
+    def convert(self,
+                markdown: str,
+                to: str,
+                metadata: Dict | None = None,
+                from_format: str = "markdown") -> bytes:
+        """Markdownを変換する
+
+        Args:
+            markdown (str):
+                入力テキスト
+            to (str):
+                出力フォーマット
+            metadata (dict | None):
+                ドキュメントのメタデータに追加する値
+            from_format (str):
+                入力フォーマット
+
+        Returns:
+            bytes: 変換結果
+
+        Raises:
+            ServiceBusyError: 混雑していてリクエストを受け付けられない
+            PandocError: pandocの実行に失敗した
+            api.ConvertError: フィルターの適用に失敗した
+        """
+        if not self.pending_slots.acquire(blocking=False):
+            raise ServiceBusyError("Too many pending requests.")
+        with self.lock:
+            self.num_pending += 1
+        try:
+            with self._pandoc_slot():
+                json_text = read_json(text=markdown, from_format=from_format,
+                                      extra_args=PANDOC_ARGS)
+
+            with tempfile.TemporaryDirectory(prefix="pandoc_crossref_filter_") as output_dir:
+                doc = utils.load_doc(json_text, to)
+                api.update_metadata(doc, metadata or {})
+                restrict_config(doc, output_dir)
+                list_diagram = api.apply_filter(doc)
+                list_error = [diagram["error"] for diagram in list_diagram
+                              if diagram["error"] is not None]
+                if len(list_error) > 0:
+                    raise api.ConvertError(" ".join(list_error))
+                embed_images(doc, output_dir)
+                json_text = utils.dump_doc(doc)
+
+            with self._pandoc_slot():
+                return write_output(json_text, to, extra_args=PANDOC_ARGS)
+        finally:
+            with self.lock:
+                self.num_pending -= 1
+            self.pending_slots.release()
+
+    @contextlib.contextmanager
+    def _pandoc_slot(self) -> Iterator[None]:
+        """pandocのプロセスの空きを確保する"""
+        if not self.pandoc_slots.acquire(timeout=self.queue_timeout):
+            raise ServiceBusyError("Timed out waiting for a pandoc worker.")
+        try:
+            yield
+        finally:
+            self.pandoc_slots.release()
+
+    def get_metrics(self) -> Dict:
+        """サービスのメトリクスを取得する"""
+        metrics = self.recorder.get_summary()
+        with self.lock:
+            metrics["pending"] = self.num_pending
+        metrics["max_pending"] = self.max_pending
+        metrics["pandoc_workers"] = self.pandoc_workers
+        return metrics
+
+
+def restrict_config(doc, output_dir: str) -> None:
+    """リクエストで指定できないフィルターの設定を削除し、画像の出力先を一時ディレクトリにする
+
+    Args:
+        doc (pf.Doc):
+            ドキュメント
+        output_dir (str):
+            リクエストごとの、画像の出力先の一時ディレクトリ
+    """
+    config = doc.get_metadata(CONFIG_ROOT, {})
+    if not isinstance(config, dict):
+        config = {}
+    config = {key: value for key, value in config.items() if key in ALLOWED_CONFIG_KEYS}
+    config["code_block"] = {"save_dir": output_dir, "allow_path_in_filename": False}
+    doc.metadata[CONFIG_ROOT] = config
+
+
+def embed_images(doc: pf.Doc, output_dir: str) -> None:
+    """一時ディレクトリに出力した画像を、data URIにして埋め込む
+
+    pandocは--sandboxで実行するので、画像のファイルを読み込めない。
+    一時ディレクトリの外の画像(リクエストのMarkdownで指定された画像)は、そのままにする
+
+    Args:
+        doc (pf.Doc):
+            ドキュメント
+        output_dir (str):
+            リクエストごとの、画像の出力先の一時ディレクトリ
+    """
+    root = os.path.realpath(output_dir)
+
+    def action(elem, doc):
+        if not isinstance(elem, pf.Image):
+            return
+        path = os.path.realpath(elem.url)
+        if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+            return
+        mime_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        with open(path, "rb") as f:
+            data = base64.b64encode(f.read()).decode("ascii")
+        elem.url = f"data:{mime_type};base64,{data}"
+
+    doc.walk(action)
+
+
+def parse_request(body) -> Tuple[str, str, Dict | None, str]:
+    """POST /convertのリクエストの値を取り出し、型を確認する
+
+    Args:
+        body (object):
+            リクエストの本文(JSON)
+
+    Returns:
+        str: 入力テキスト
+        str: 出力フォーマット
+        dict | None: ドキュメントのメタデータに追加する値
+        str: 入力フォーマット
+
+    Raises:
+        TypeError: 値の型が正しくない
+        KeyError: markdownが無い
+        ValueError: 対応していない出力フォーマット
+    """
+    if not isinstance(body, dict):
+        raise TypeError("The request body must be a JSON object.")
+    markdown = body["markdown"]
+    to = body.get("to", "docx")
+    metadata = body.get("metadata")
+    from_format = body.get("from", "markdown")
+    if not isinstance(markdown, str):
+        raise TypeError("'markdown' must be a string.")
+    if not isinstance(to, str):
+        raise TypeError("'to' must be a string.")
+    if metadata is not None and not isinstance(metadata, dict):
+        raise TypeError("'metadata' must be an object.")
+    if not isinstance(from_format, str):
+        raise TypeError("'from' must be a string.")
+    if to not in CONTENT_TYPES:
+        raise ValueError(f"Unsupported output format: '{to}'.")
+    return markdown, to, metadata, from_format
+
+
+class ConversionRequestHandler(http.server.BaseHTTPRequestHandler):
+    """変換サービスのHTTPリクエストのハンドラ
+
+    - POST /convert: {"markdown": "...", "to": "docx", "metadata": {...}} を変換する
+    - GET /metrics: リクエスト数とレイテンシの統計を返す
+    """
+
+    # HTTPServerに設定したサービス
+    server: "ConversionHTTPServer"
+
+    def do_GET(self) -> None:
+        if self.path == "/metrics":
+            self._send_json(200, self.server.service.get_metrics())
+        else:
+            self._send_json(404, {"error": "Not found."})
+
+    def do_POST(self) -> None:
+        if self.path != "/convert":
+            self._send_json(404, {"error": "Not found."})
+            return
+
+        start = time.perf_counter()
+        service = self.server.service
+        try:
+            markdown, to, metadata, from_format = parse_request(json.loads(self._read_body()))
+            output = service.convert(markdown, to, metadata, from_format)
+        except RequestTooLargeError as e:
+            service.recorder.record("error", time.perf_counter() - start)
+            # 本文を読まずに応答するので、接続を閉じる
+            self.close_connection = True
+            self._send_json(413, {"error": str(e)})
+            return
+        except ServiceBusyError as e:
+            service.recorder.record("rejected", time.perf_counter() - start)
+            self._send_json(503, {"error": str(e)}, {"Retry-After": "1"})
+            return
+        except (ValueError, KeyError, TypeError) as e:
+            service.recorder.record("error", time.perf_counter() - start)
+            self._send_json(400, {"error": f"Invalid request: {e}"})
+            return
+        except PandocError as e:
+            service.recorder.record("error", time.perf_counter() - start)
+            self._send_json(422, {"error": str(e)})
+            return
+        except api.ConvertError as e:
+            service.recorder.record("error", time.perf_counter() - start)
+            self._send_json(422, {"error": str(e), "diagnostics": e.list_error})
+            return
+        except Exception:
+            # 想定していないエラーでも、接続を切らずに応答する
+            logger.exception("Unexpected error while converting a request.")
+            service.recorder.record("error", time.perf_counter() - start)
+            self._send_json(500, {"error": "Internal server error."})
+            return
+
+        service.recorder.record("ok", time.perf_counter() - start)
+        self._send(200, output, CONTENT_TYPES[to])
+
+    def _read_body(self) -> bytes:
+        """リクエストの本文を読み込む
+
+        Raises:
+            ValueError: Content-Lengthが正しくない
+            RequestTooLargeError: 本文がMAX_REQUEST_BYTESより大きい
+        """
+        length = int(self.headers.get("Content-Length", 0))
+        if length < 0:
+            raise ValueError("Invalid Content-Length.")
+        if length > MAX_REQUEST_BYTES:
+            raise RequestTooLargeError(
+                f"Request body is too large ({length} bytes, max {MAX_REQUEST_BYTES} bytes).")
+        return self.rfile.read(length)
+
+    def _send_json(self, status: int, obj: Dict, headers: Dict | None = None) -> None:
+        """JSONのレスポンスを返す"""
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self._send(status, body, "application/json; charset=utf-8", headers)
+
+    def _send(self,
+              status: int,
+              body: bytes,
+              content_type: str,
+              headers: Dict | None = None) -> None:
+        """レスポンスを返す"""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.info(format % args)
+
+
+class ConversionHTTPServer(http.server.ThreadingHTTPServer):
+    def __init__(self, address, service: ConversionService) -> None:
+        """変換サービスのHTTPサーバー
+
+        Args:
+            address (tuple(str, int)):
+                待ち受けるホストとポート
+            service (ConversionService):
+                変換サービス
+        """
+        super().__init__(address, ConversionRequestHandler)
+        self.service: ConversionService = service
+
+
+def serve(host: str, port: int, service: ConversionService) -> None:
+    """変換サービスを起動する(Ctrl+Cで終了する)
+
+    Args:
+        host (str):
+            待ち受けるホスト
+        port (int):
+            待ち受けるポート
+        service (ConversionService):
+            変換サービス
+    """
+    with ConversionHTTPServer((host, port), service) as httpd:
+        print(f"Serving on http://{host}:{httpd.server_address[1]}")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
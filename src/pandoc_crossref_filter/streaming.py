@@ -0,0 +1,324 @@
+import re
+import json
+import tempfile
+from typing import List, Dict, Tuple, Iterator, TextIO
+
+import panflute as pf
+
+from . import utils
+from . import metrics
+from . import profiler
+from .pandoc_crossref_filter import (
+    CONFIG_LINE_BREAK,
+    get_action,
+    prepare,
+    export_images
+)
+from .registry import PendingRef, get_prefix
+from .line_break import normalize_line_breaks
+
+
+logger = utils.get_logger()
+
+# 入力を読み込む単位(文字数)
+READ_CHUNK_SIZE = 1 << 16
+
+# 後から書き換える参照の目印
+# (JSONに書き出すと、制御文字は"\u001f"にエスケープされる)
+PLACEHOLDER_TEMPLATE = "\x1fCRXREF:%d\x1f"
+PLACEHOLDER_PATTERN = re.compile(r"\\u001fCRXREF:(\d+)\\u001f")
+PLACEHOLDER_MARK = "\\u001fCRXREF:"
+# 後から一覧に置き換える、目次などの目印の段落
+TOC_PLACEHOLDER_TEMPLATE = "\x1fCRXTOC:%d\x1f"
+TOC_PLACEHOLDER_PATTERN = re.compile(
+    r'\{"t":"Para","c":\[\{"t":"Str","c":"\\u001fCRXTOC:(\d+)\\u001f"\}\]\}')
+TOC_PLACEHOLDER_MARK = "\\u001fCRXTOC:"
+
+
+class BlockStreamReader():
+    def __init__(self, stream: TextIO, chunk_size: int = READ_CHUNK_SIZE) -> None:
+        """pandocのJSONを、トップレベルのブロックごとに読み込む
+
+        ドキュメント全体を読み込まずに、少しずつ読み込みながらブロックを1つずつ返す。
+        pandocの出力と同じく、"blocks"の前に"pandoc-api-version"と"meta"が書かれている必要がある。
+
+        Args:
+            stream (TextIO):
+                pandocのJSONの入力
+            chunk_size (int):
+                1回に読み込む文字数
+        """
+        self.stream: TextIO = stream
+        self.chunk_size: int = chunk_size
+        # 読み込んだ文字列と、次に読む位置
+        self.buffer: str = ""
+        self.pos: int = 0
+        self.eof: bool = False
+        self.decoder = json.JSONDecoder()
+        self.block_decoder = json.JSONDecoder(object_hook=pf.elements.from_json)
+
+    def read_header(self) -> Dict:
+        """"blocks"より前の項目を読み込む
+
+        Returns:
+            dict: "pandoc-api-version"、"meta"などの項目
+
+        Raises:
+            ValueError: JSONの形式が正しくない
+        """
+        self._expect("{")
+        header = {}
+        while True:
+            key = self._decode(self.decoder)
+            self._expect(":")
+            if key == "blocks":
+                self._expect("[")
+                break
+            header[key] = self._decode(self.decoder)
+            self._expect(",")
+        if "meta" not in header:
+            raise ValueError("'meta' must precede 'blocks' in the pandoc JSON.")
+        return header
+
+    def iter_blocks(self) -> Iterator[pf.Block]:
+        """トップレベルのブロックを1つずつ返す(read_header()の後に呼ぶ)"""
+        if self._peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self._decode(self.block_decoder)
+            if self._expect(",]") == "]":
+                return
+
+    def _peek(self) -> str:
+        """空白を読み飛ばして、次の文字を返す"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read_more():
+                raise ValueError("Unexpected end of the pandoc JSON.")
+
+    def _expect(self, chars: str) -> str:
+        """次の文字が、指定した文字のいずれかであることを確認して読み進める"""
+        char = self._peek()
+        if char not in chars:
+            raise ValueError(
+                f"Unexpected character {char!r} in the pandoc JSON (expected {chars!r}).")
+        self.pos += 1
+        return char
+
+    def _decode(self, decoder: json.JSONDecoder):
+        """次の値を読み込む
+
+        値の終わりまで読み込めていなければ、読み込む量を増やしてやり直す。
+        (読み込む値はオブジェクト、配列、文字列なので、途中までで読み込みに成功することは無い)
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._read_more(len(self.buffer) - self.pos):
+                    raise
+                continue
+            self.pos = end
+            return value
+
+    def _read_more(self, size: int = 0) -> bool:
+        """入力を読み込み、読み込み済みの部分を捨てる
+
+        Args:
+            size (int):
+                読み込む文字数の目安(chunk_sizeより小さい場合はchunk_size)
+
+        Returns:
+            bool: 入力の終わりに達していればFalse
+        """
+        if self.eof:
+            return False
+        text = self.stream.read(max(size, self.chunk_size))
+        if not text:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return True
+
+
+class BlockSpool():
+    def __init__(self) -> None:
+        """変換したブロックを一時ファイルに書き出しておく
+
+        1行に1つのブロックのJSONを書き出す
+        (JSONの文字列の中の改行はエスケープされるので、1つのブロックが複数行になることは無い)
+        """
+        self.file = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+
+    def write_blocks(self, list_block: List[pf.Block]) -> None:
+        """ブロックを書き出す"""
+        for block in list_block:
+            self.file.write(_dump_block(block))
+            self.file.write("\n")
+
+    def iter_lines(self) -> Iterator[str]:
+        """書き出したブロックのJSONを、先頭から1つずつ返す"""
+        self.file.seek(0)
+        for line in self.file:
+            yield line.rstrip("\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def _dump_block(block: pf.Block) -> str:
+    """ブロックを1行のJSONにする"""
+    return json.dumps(
+        block,
+        default=lambda elem: elem.to_json(),
+        check_circular=False,
+        separators=(",", ":"),
+        ensure_ascii=False)
+
+
+def run_streaming(input_stream: TextIO, output_stream: TextIO, output_format: str) -> None:
+    """ブロックごとに読み込みながらフィルターを適用する
+
+    1回目の走査では、ブロックを1つずつ読み込んで番号を付け、一時ファイルに書き出す。
+    まだ番号が分からない参照と、目次などの一覧は、目印の文字列にしておく。
+    2回目の走査では、一時ファイルからブロックを読み込み、目印を参照の文字列と一覧に書き換えて出力する。
+    ドキュメント全体をpanfluteの要素として持たないので、メモリの使用量は一番大きいブロックで決まる。
+
+    Args:
+        input_stream (TextIO):
+            pandocのJSONの入力
+        output_stream (TextIO):
+            フィルター適用後のpandocのJSONの出力
+        output_format (str):
+            出力フォーマット
+    """
+    prof = profiler.get_profiler()
+    reader = BlockStreamReader(input_stream)
+    header = reader.read_header()
+
+    # ブロックの無いドキュメントを作り、フィルターの設定を読み込む
+    doc = json.loads(
+        json.dumps(dict(header, blocks=[])),
+        object_hook=pf.elements.from_json)
+    doc.format = output_format
+    metrics.set_doc(doc, "streaming")
+    with prof.phase("prepare"):
+        prepare(doc)
+    is_normalize_line_breaks = doc.get_metadata(CONFIG_LINE_BREAK, True)
+    action = get_action()
+
+    spool = BlockSpool()
+    try:
+        # 1回目: 番号を付けて一時ファイルに書き出す
+        # (ブロックの読み込みと書き出しも含めて計測する)
+        with prof.phase("first_pass"):
+            list_pending: List[Tuple[object, PendingRef]] = []
+            # 目次などの一覧の種類(目印の番号は、この一覧の位置)
+            list_toc_kind: List[str] = []
+            # prepare()で挿入したブロック(top_insert_text)
+            doc.walk(action)
+            _detach_toc_placeholders(doc, list_toc_kind)
+            spool.write_blocks(doc.content)
+            for i, block in enumerate(reader.iter_blocks()):
+                doc.content = [block]
+                doc.diagnostics.block_offset = i
+                if is_normalize_line_breaks:
+                    normalize_line_breaks(doc)
+                doc.walk(action)
+                _detach_pending_references(doc, list_pending)
+                _detach_toc_placeholders(doc, list_toc_kind)
+                spool.write_blocks(doc.content)
+            doc.content = []
+
+        # 一覧と参照の文字列を求め、画像を出力する
+        doc.diagnostics.current_elem = None
+        with prof.phase("resolve_references"):
+            entries = doc.toc.get_entries()
+            list_toc_value = [
+                _dump_block(doc.toc.make_block(kind, entries)) for kind in list_toc_kind]
+            list_value = [
+                json.dumps(cross_ref.get_pending_string(pending), ensure_ascii=False)[1:-1]
+                for cross_ref, pending in list_pending]
+            doc.code_block_ref.replace_reference(doc.dict_cross_ref)
+        logger.debug("Reference resolution: %s", doc.reference_registry.get_stats())
+        with prof.phase("export_images"):
+            export_images(doc)
+        doc.diagnostics.exit_if_errors()
+
+        # 2回目: 目印を書き換えて出力する
+        with prof.phase("second_pass"):
+            head = utils.dump_doc(doc)
+            output_stream.write(head[:head.rindex("[]")] + "[")
+            for i, line in enumerate(spool.iter_lines()):
+                if i > 0:
+                    output_stream.write(",")
+                if TOC_PLACEHOLDER_MARK in line:
+                    line = TOC_PLACEHOLDER_PATTERN.sub(
+                        lambda match: list_toc_value[int(match.group(1))], line)
+                if PLACEHOLDER_MARK in line:
+                    line = PLACEHOLDER_PATTERN.sub(
+                        lambda match: list_value[int(match.group(1))], line)
+                output_stream.write(line)
+            output_stream.write(head[head.rindex("[]") + 1:])
+    finally:
+        spool.close()
+
+
+def _detach_pending_references(doc: pf.Doc, list_pending: List[Tuple[object, PendingRef]]) -> None:
+    """書き換えを待っている参照を目印の文字列にして、要素から切り離す
+
+    ブロックを書き出した後に要素を保持しないように、PendingRefからは要素への参照を外す。
+    ただし、PlantUML/Mermaidの図のソースは画像の出力に使うので、そのまま残す。
+
+    Args:
+        doc (pf.Doc):
+            ドキュメント
+        list_pending (list(tuple)):
+            (参照の管理クラス, PendingRef)の一覧。目印の番号は、この一覧の位置
+    """
+    for cross_ref in doc.dict_cross_ref.values():
+        for pending in cross_ref.list_replace_target:
+            pending.target.text = PLACEHOLDER_TEMPLATE % len(list_pending)
+            pending.target = None
+            list_pending.append((cross_ref, pending))
+        cross_ref.list_replace_target.clear()
+
+    code_block_ref = doc.code_block_ref
+    list_diagram_template = []
+    for template in code_block_ref.list_replace_target:
+        if template.is_diagram:
+            list_diagram_template.append(template)
+            continue
+        list_text = [template.segments[0]]
+        for key_tmp, segment in zip(template.keys, template.segments[1:]):
+            key, add_title = utils.split_key_title(key_tmp)
+            list_text.append(PLACEHOLDER_TEMPLATE % len(list_pending))
+            list_text.append(segment)
+            list_pending.append((
+                doc.dict_cross_ref[get_prefix(key)],
+                PendingRef(key, None, add_title, False, template.position)))
+        template.elem.text = "".join(list_text)
+    code_block_ref.list_replace_target = list_diagram_template
+
+
+def _detach_toc_placeholders(doc: pf.Doc, list_toc_kind: List[str]) -> None:
+    """目次などの目印の段落を、目印の文字列だけの段落にする
+
+    一覧はドキュメントの最後まで読まないと作れないので、2回目の走査で置き換える
+
+    Args:
+        doc (pf.Doc):
+            ドキュメント
+        list_toc_kind (list(str)):
+            一覧の種類の一覧。目印の番号は、この一覧の位置
+    """
+    for elem, kind in doc.toc.list_placeholder:
+        elem.content = [pf.Str(TOC_PLACEHOLDER_TEMPLATE % len(list_toc_kind))]
+        list_toc_kind.append(kind)
+    doc.toc.list_placeholder = []
@@ -1,17 +1,26 @@
-import sys
 from typing import List, Dict, Tuple
 import re
 
 import panflute as pf
 
 from . import utils
+from .registry import ReferenceRegistry
+from .cross_ref_base import CrossRefBase
+from .numbering import NumberingEngine
 
 
 logger = utils.get_logger()
 
+# セルの結合の目印(左隣のセルと結合、上のセルと結合)
+MERGE_MARKERS = ("->", "〃")
 
-class TableCrossRef():
-    def __init__(self, config: Dict, enable_link: bool) -> None:
+
+class TableCrossRef(CrossRefBase):
+    def __init__(self,
+                 config: Dict,
+                 enable_link: bool,
+                 registry: ReferenceRegistry | None = None,
+                 numbering: NumberingEngine | None = None) -> None:
         """コンストラクタ
 
         Args:
@@ -28,6 +37,10 @@ class TableCrossRef():
                     表番号の区切り
             enable_link (bool):
                 参照にリンクを張るかどうか
+            registry (ReferenceRegistry | None):
+                参照の登録先(セクション、図と共有する)。Noneの場合は新しく作成する
+            numbering (NumberingEngine | None):
+                連番の管理(セクション番号と共有する)。Noneの場合は新しく作成する
         """
         self.table_number_count_level = int(
             config.get("table_number_count_level", "0"))
@@ -35,29 +48,24 @@ class TableCrossRef():
             config.get("table_title_template", "[表%s]")
         self.delimiter: str = \
             config.get("delimiter", "-")
-        self.enable_link: bool = enable_link
-
-        # 参照用の表番号を格納する辞書
-        self.references: Dict = {}
-        # 参照用の表のタイトルを格納する辞書
-        self.references_title: Dict = {}
-        # 書き換えるべき項目を記憶する(最後に書き換える)
-        self.list_replace_target: List[Dict] = []
-        # 表番号の連番をカウントする辞書
-        self.dict_table_number_increment: Dict = {}
+        super().__init__(enable_link, registry)
+        # 登録した表の数(番号を付けない表も含む)
+        self.num_table: int = 0
+        # 表番号の連番
+        numbering = numbering if numbering is not None else NumberingEngine()
+        self.counter = numbering.add_counter(self.table_number_count_level, self.delimiter)
 
     def register_table(self,
-                       elem: pf.Table,
-                       list_present_section_numbers: List
+                       elem: pf.Table
                        ) -> None:
         """表番号の登録
 
         Args:
             elem: pf.Table:
                 表
-            list_present_section_numbers: List:
-                セクション番号
         """
+        self.num_table += 1
+
         # 表の整形
         self._format_table(elem)
 
@@ -76,20 +84,24 @@ class TableCrossRef():
 
         if self.enable_link and identifier:
             # Table要素に参照元(identifier)を設定する
+            if self.format_tweaks is not None:
+                self.format_tweaks.add_identifier(elem, elem.identifier)
             elem.identifier = identifier
 
         # colwidth指定があればcolspecに追加
         if colwidth:
             # テーブルのカラム数をチェック
             num_columns = len(elem.colspec) if hasattr(elem, 'colspec') else 0
-            colwidth_valid = self._validate_colwidth(colwidth, num_columns)
-            if not colwidth_valid:
-                logger.error(f"Colwidth specification '{colwidth}' is invalid.")
-                sys.exit(1)
-
-            list_colwidth = [float(v.strip()) / 100 for v in colwidth.split(',')]
-            for icol in range(num_columns):
-                elem.colspec[icol] = (elem.colspec[icol][0], list_colwidth[icol])
+            colwidth_error = self._validate_colwidth(colwidth, num_columns)
+            if colwidth_error is not None:
+                # エラーを記録し、幅の指定は適用しない
+                self.registry.diagnostics.error(
+                    "invalid_colwidth",
+                    f"Colwidth specification '{colwidth}' is invalid. {colwidth_error}")
+            else:
+                list_colwidth = [float(v.strip()) / 100 for v in colwidth.split(',')]
+                for icol in range(num_columns):
+                    elem.colspec[icol] = (elem.colspec[icol][0], list_colwidth[icol])
             # キャプション文字列を更新（colwidth部分を削除）
             self._set_caption_text(caption, new_caption_text)
 
@@ -98,7 +110,7 @@ class TableCrossRef():
             return
 
         # 表番号の取得
-        table_number = self._get_table_number(list_present_section_numbers)
+        table_number = self.counter.next_number()
 
         # identifierの登録
         self._add_table_ref(identifier, table_number, new_caption_text)
@@ -142,7 +154,7 @@ class TableCrossRef():
         else:
             return None, "", caption_text
 
-    def _validate_colwidth(self, colwidth: str, num_columns: int) -> bool:
+    def _validate_colwidth(self, colwidth: str, num_columns: int) -> str | None:
         """幅の値が有効か検証する
 
         Args:
@@ -152,8 +164,8 @@ class TableCrossRef():
                 テーブルのカラム数
 
         Returns:
-            bool:
-                有効な場合 True、以下の場合 False:
+            str | None:
+                有効な場合 None、以下の場合はエラーの内容:
                 - 数値に変換できない
                 - 合計が100を超える
                 - カラム数と幅指定の個数が異なる
@@ -164,27 +176,18 @@ class TableCrossRef():
 
             # カラム数と幅指定の個数が一致するかをチェック
             if len(colwidth_values) != num_columns:
-                logger.error(
-                    f"Number of colwidth specifications ({len(colwidth_values)}) "
-                    f"does not match the number of columns ({num_columns})."
-                )
-                return False
+                return (f"Number of colwidth specifications ({len(colwidth_values)}) "
+                        f"does not match the number of columns ({num_columns}).")
 
             # 合計が100を超えないかをチェック
             total = sum(colwidth_values)
             if total > 100:
-                logger.error(
-                    f"Sum of colwidths ({total}) must be less than or equal to 100."
-                )
-                return False
+                return f"Sum of colwidths ({total}) must be less than or equal to 100."
 
-            return True
+            return None
         except (ValueError, AttributeError):
-            # 数値に変換できない場合は False
-            logger.error(
-                f"Colwidth specification '{colwidth}' contains invalid values."
-            )
-            return False
+            # 数値に変換できない場合
+            return f"Colwidth specification '{colwidth}' contains invalid values."
 
     def _add_table_ref(self,
                        identifier: str,
@@ -200,48 +203,10 @@ class TableCrossRef():
             table_title (str):
                 表のタイトル
         """
-        # 重複登録はエラーで落とす
-        if identifier in self.references:
-            logger.error(f"Duplicate identifier: '{identifier}'")
-            sys.exit(1)
-
-        # 登録
-        self.references[identifier] = table_number
-
-        # タイトルも登録
-        self.references_title[identifier] = table_title
-
-    def _get_table_number(self,
-                          list_present_section_numbers: List[int]) -> str:
-        """表番号の取得
-
-        Args:
-            list_present_section_numbers (list):
-                セクション番号の配列
-
-        Returns:
-            str: 表番号を返します。
-        """
-        # カウントを開始するレベルの調整
-        if self.table_number_count_level >= 0 and \
-           len(list_present_section_numbers) > self.table_number_count_level:
-            list_present_section_numbers = \
-                list_present_section_numbers[:self.table_number_count_level]
-        # 番号のカウント
-        start_number = \
-            self.delimiter.join(map(str, list_present_section_numbers))
-        if start_number not in self.dict_table_number_increment:
-            self.dict_table_number_increment[start_number] = 0
-        self.dict_table_number_increment[start_number] += 1
-
-        if start_number != "":
-            table_number = \
-                start_number + \
-                self.delimiter + \
-                str(self.dict_table_number_increment[start_number])
-        else:
-            table_number = str(self.dict_table_number_increment[start_number])
-        return table_number
+        # 登録(重複登録はエラーとして記録し、最初の登録を残す)
+        if not self.registry.add(identifier, table_number, table_title):
+            self.registry.diagnostics.error(
+                "duplicate_identifier", f"Duplicate identifier: '{identifier}'")
 
     def _set_caption_text(self, elem: pf.Caption, caption_text: str) -> None:
         """キャプションのテキスト情報を設定する
@@ -254,58 +219,52 @@ class TableCrossRef():
         """
         elem.content[0].content = [pf.Str(caption_text)]
 
-    def add_reference(self,
-                      key: str) -> pf.Str | pf.Link:
-        """参照を上書きするべき対象を一時的に記憶しておく
+    def get_stats(self) -> Dict:
+        """登録の統計を取得する
 
-        Args:
-            key (str): 参照の目印となるキー
+        Returns:
+            dict:
+                - tables (int): 登録した表の数
+        """
+        return {"tables": self.num_table}
+
+    def get_numbering_state(self) -> Dict:
+        """番号の状態を取得する(他のドキュメントの続きから番号を付けるために使う)
 
         Returns:
-            pf.Str | pf.Link:
-                参照追加後の要素
+            dict: 表番号の連番をカウントする辞書
         """
-        key, is_add_title = utils.split_key_title(key)
-        target = pf.Str("")
-        self.list_replace_target.append({
-            "key": key,
-            "target": target,
-            "add_title": is_add_title
-        })
-
-        if self.enable_link:
-            # 参照先へのリンクを張る
-            return pf.Link(target, url=f"#{key}")
-        else:
-            return target
+        return self.counter.get_state()
 
-    def replace_reference(self) -> None:
-        """参照の上書き"""
-        for replace_target in self.list_replace_target:
-            replace_target["target"].text = self.get_reference_string(
-                replace_target["key"], replace_target["add_title"])
+    def set_numbering_state(self, state: Dict) -> None:
+        """番号の状態を設定する
+
+        Args:
+            state (dict):
+                get_numbering_state()で取得した状態
+        """
+        self.counter.set_state(state)
 
-    def get_reference_string(self, key: str, add_title: bool) -> str:
-        """参照キーから、表番号の文字列を返す
+    def _format_reference(self, key: str, add_title: bool, is_header: bool) -> str:
+        """参照キーから、表番号の文字列を作成する
 
         Args:
             key (str):
                 参照キー
             add_title (bool):
                 タイトルを追加するかどうか
+            is_header (bool):
+                ヘッダーかどうか(使わない)
 
         Returns:
             str:
-                セクション番号の文字列
+                表番号の文字列
         """
-        # 参照キーが見つからない
-        if key not in self.references:
-            logger.error(f"No such reference: '{key}'.")
-            sys.exit(1)
-        table_number = self.table_title_template % self.references[key]
+        record = self.registry.get(key)
+        table_number = self.table_title_template % record.number
 
         if add_title is True:
-            table_title = self.references_title[key]
+            table_title = record.title
             if table_title != "":
                 table_number += " " + table_title
 
@@ -332,35 +291,60 @@ class TableCrossRef():
         """表の書式を整える
 
         self._format_tableから呼び出される関数
+
+        結合の目印("->", "〃")の判定は、_get_merge_marker()を参照。
+        目印が無い場合は何もせず、目印がある場合は、最初に目印が見つかった行から結合する。
         """
-        num_columns = len(elem.content[0].content) if elem.content else 0
+        list_row = elem.content.list
+        first_row_index = self._find_merge_marker_row(list_row)
+        if first_row_index is None:
+            return
+
+        # 目印が見つかった行より上の行は結合しないので、各列の上のセルは直前の行になる
+        num_columns = len(list_row[0].content.list)
         list_upper_row_index = [None] * num_columns
-        for irow, row in enumerate(elem.content):
+        for irow in range(first_row_index - 1, -1, -1):
+            for icol in range(min(num_columns, len(list_row[irow].content.list))):
+                if list_upper_row_index[icol] is None:
+                    list_upper_row_index[icol] = irow
+            if None not in list_upper_row_index:
+                break
+
+        for irow in range(first_row_index, len(list_row)):
+            row = list_row[irow]
+            list_cell = row.content.list
             left_cell_index = None
             formatted_row = []
             is_required_merge = False
-            for icol, cell in enumerate(row.content):
-                # セル内の内容を文字列化
-                cell_text = pf.stringify(cell.content)
+            for icol, cell in enumerate(list_cell):
+                marker = self._get_merge_marker(cell)
+                # 結合できない目印は、エラーを記録して通常のセルとして扱う
+                if marker == "->" and left_cell_index is None:
+                    self.registry.diagnostics.error(
+                        "invalid_merge",
+                        "'->' found in the first cell of a row, which cannot be merged.")
+                    marker = None
+                elif marker == "〃" and list_upper_row_index[icol] is None:
+                    self.registry.diagnostics.error(
+                        "invalid_merge",
+                        "'〃' found in the first row of a table, which cannot be merged.")
+                    marker = None
+
                 # -> を左隣のセルと結合
-                if "->" == cell_text:
-                    if left_cell_index is None:
-                        logger.error("'->' found in the first cell of a row, which cannot be merged.")
-                        sys.exit(1)
+                if marker == "->":
+                    left_cell = list_cell[left_cell_index]
                     # 強制的にHTML形式のテーブルにするために、初回は空のdivを挿入する
-                    if row.content[left_cell_index].colspan == 1:
-                        row.content[left_cell_index].content.append(pf.Div())
-                    row.content[left_cell_index].colspan += 1
+                    if left_cell.colspan == 1:
+                        left_cell.content.append(pf.Div())
+                    left_cell.colspan += 1
                     is_required_merge = True
-                elif "〃" == cell_text:
+                elif marker == "〃":
                     upper_row_index = list_upper_row_index[icol]
-                    if upper_row_index is None:
-                        logger.error("'〃' found in the first row of a table, which cannot be merged.")
-                        sys.exit(1)
+                    upper_cell = list_row[upper_row_index].content.list[icol]
                     # 強制的にHTML形式のテーブルにするために、初回は空のdivを挿入する
-                    if elem.content[upper_row_index].content[icol].rowspan == 1:
-                        elem.content[upper_row_index].content[icol].content.append(pf.Div())
-                    elem.content[upper_row_index].content[icol].rowspan += 1
+                    if upper_cell.rowspan == 1:
+                        upper_cell.content.append(pf.Div())
+                    upper_cell.rowspan += 1
                     is_required_merge = True
                 else:
                     left_cell_index = icol
@@ -369,3 +353,47 @@ class TableCrossRef():
             # 書式を整えた行で上書き
             if is_required_merge:
                 row.content = formatted_row
+
+    def _find_merge_marker_row(self, list_row: List[pf.TableRow]) -> int | None:
+        """結合の目印("->", "〃")がある最初の行を探す
+
+        Args:
+            list_row (list(pf.TableRow)):
+                表の行
+
+        Returns:
+            int | None: 目印がある最初の行。目印が無ければNone
+        """
+        get_merge_marker = self._get_merge_marker
+        for irow, row in enumerate(list_row):
+            for cell in row.content.list:
+                if get_merge_marker(cell) is not None:
+                    return irow
+        return None
+
+    @staticmethod
+    def _get_merge_marker(cell: pf.TableCell) -> str | None:
+        """セルの結合の目印を取得する
+
+        セルが1つのPlainまたはPara(グリッドテーブルのセル)の、1つのStrだけを含む場合は、
+        文字列に変換せずに判定する。それ以外で判定できない場合は、セルの文字列で判定する
+
+        Args:
+            cell (pf.TableCell):
+                セル
+
+        Returns:
+            str | None: セルの文字列が"->"または"〃"の場合はその文字列。それ以外はNone
+        """
+        list_block = cell.content.list
+        if len(list_block) == 0:
+            return None
+        if len(list_block) == 1 and type(list_block[0]) in (pf.Plain, pf.Para):
+            list_inline = list_block[0].content.list
+            if len(list_inline) == 0:
+                return None
+            if len(list_inline) == 1 and type(list_inline[0]) is pf.Str:
+                text = list_inline[0].text
+                return text if text in MERGE_MARKERS else None
+        text = pf.stringify(cell).strip()
+        return text if text in MERGE_MARKERS else None
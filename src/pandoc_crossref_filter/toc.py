@@ -0,0 +1,202 @@
+from typing import List, Dict, Tuple
+
+import panflute as pf
+
+from . import utils
+from .section_cross_ref import SectionCrossRef
+from .figure_cross_ref import FigureCrossRef
+from .table_cross_ref import TableCrossRef
+
+
+logger = utils.get_logger()
+
+# 目印の参照ID -> 一覧の種類
+PLACEHOLDER_KINDS: Dict[str, str] = {
+    "toc": "section",
+    "lof": "figure",
+    "lot": "table",
+}
+
+
+class TableOfContents():
+    def __init__(self,
+                 config: Dict,
+                 section_cross_ref: SectionCrossRef,
+                 figure_cross_ref: FigureCrossRef,
+                 table_cross_ref: TableCrossRef) -> None:
+        """目次、図目次、表目次の作成
+
+        "[@toc]"、"[@lof]"、"[@lot]"だけを書いた段落を目印として記憶しておき、
+        最後に、番号付けで集めたセクション、図、表の一覧に置き換える。
+        (一覧を作るために、ドキュメントを走査し直すことはしない)
+
+        Args:
+            config (dict):
+                設定
+                - toc_depth (int):
+                    目次に含めるヘッダーのレベル(デフォルトは3)
+            section_cross_ref (SectionCrossRef):
+                セクション番号の管理
+            figure_cross_ref (FigureCrossRef):
+                図番号の管理
+            table_cross_ref (TableCrossRef):
+                表番号の管理
+        """
+        self.toc_depth: int = int(config.get("toc_depth", "3"))
+        self.section_cross_ref: SectionCrossRef = section_cross_ref
+        self.figure_cross_ref: FigureCrossRef = figure_cross_ref
+        self.table_cross_ref: TableCrossRef = table_cross_ref
+        # 複数の出力フォーマットを作る場合の差分の管理(FormatTweaks)
+        self.format_tweaks = None
+
+        # 目次に含めるヘッダー (レベル, 文字列, ID)
+        self.list_section: List[Tuple[int, str, str]] = []
+        # 他で集めた一覧を使う場合に設定する(set_entries()を参照)
+        self.entries: Dict | None = None
+        # 目印の段落と、一覧の種類
+        self.list_placeholder: List[Tuple[pf.Para, str]] = []
+
+    @staticmethod
+    def get_placeholder_kind(elem: pf.Para) -> str | None:
+        """目印の段落であれば、一覧の種類を返す
+
+        Args:
+            elem (pf.Para):
+                段落
+
+        Returns:
+            str | None: 一覧の種類("section", "figure", "table")。目印でなければNone
+        """
+        if len(elem.content) != 1:
+            return None
+        cite = elem.content[0]
+        if type(cite) is not pf.Cite or len(cite.citations) != 1:
+            return None
+        return PLACEHOLDER_KINDS.get(cite.citations[0].id)
+
+    def register_placeholder(self, elem: pf.Para) -> None:
+        """目印の段落であれば、記憶しておく
+
+        Args:
+            elem (pf.Para):
+                段落
+        """
+        kind = self.get_placeholder_kind(elem)
+        if kind is not None:
+            self.list_placeholder.append((elem, kind))
+
+    def add_section(self, elem: pf.Header) -> None:
+        """目次に含めるヘッダーを追加する
+
+        セクション番号の登録の後に呼び、ヘッダーに表示する文字列(セクション番号を含む)を目次に使う
+
+        Args:
+            elem (pf.Header):
+                ヘッダー
+        """
+        if elem.level > self.toc_depth or "unlisted" in elem.classes:
+            return
+        self.list_section.append((elem.level, pf.stringify(elem.content), elem.identifier))
+
+    def get_entries(self) -> Dict:
+        """一覧を作るための値を取得する(他のドキュメントで一覧を作るために使う)
+
+        Returns:
+            dict:
+                - section (list(tuple)): 目次に含めるヘッダー
+                - figure (list(str)): 図のID
+                - table (list(str)): 表のID
+        """
+        if self.entries is not None:
+            return self.entries
+        registry = self.section_cross_ref.registry
+        return {
+            "section": list(self.list_section),
+            "figure": [identifier for identifier, record in registry.items()
+                       if record.kind == "figure"],
+            "table": [identifier for identifier, record in registry.items()
+                      if record.kind == "table"]
+        }
+
+    def set_entries(self, entries: Dict) -> None:
+        """このドキュメントで集めた値の代わりに、get_entries()で取得した値から一覧を作る
+
+        Args:
+            entries (dict):
+                get_entries()の戻り値
+        """
+        self.entries = entries
+
+    def expand(self) -> None:
+        """目印の段落を、一覧に置き換える
+
+        参照を上書きする前(resolve_references()の最初)に呼ぶ
+        """
+        if len(self.list_placeholder) == 0:
+            return
+        entries = self.get_entries()
+        for elem, kind in self.list_placeholder:
+            elem.parent.content[elem.index] = self.make_block(kind, entries)
+        self.list_placeholder = []
+
+    def make_block(self, kind: str, entries: Dict) -> pf.Div:
+        """一覧を作成する
+
+        Args:
+            kind (str):
+                一覧の種類("section", "figure", "table")
+            entries (dict):
+                get_entries()の戻り値
+
+        Returns:
+            pf.Div: 一覧(箇条書き)
+        """
+        if kind == "section":
+            bullet_list = self._make_section_list(entries["section"])
+            classes = ["toc"]
+        else:
+            cross_ref = self.figure_cross_ref if kind == "figure" else self.table_cross_ref
+            bullet_list = pf.BulletList(*[
+                pf.ListItem(self._make_entry(
+                    cross_ref.get_reference_string(identifier, True),
+                    identifier,
+                    cross_ref.enable_link))
+                for identifier in entries[kind]])
+            classes = ["lof"] if kind == "figure" else ["lot"]
+
+        if len(bullet_list.content) == 0:
+            return pf.Div(classes=classes)
+        return pf.Div(bullet_list, classes=classes)
+
+    def _make_section_list(self, list_section: List[Tuple[int, str, str]]) -> pf.BulletList:
+        """ヘッダーのレベルに従って、入れ子の箇条書きを作成する"""
+        root = pf.BulletList()
+        # (レベル, 箇条書き)のスタック
+        stack: List[Tuple[int, pf.BulletList]] = []
+        for level, text, identifier in list_section:
+            item = pf.ListItem(self._make_entry(
+                text, identifier, self.section_cross_ref.enable_link))
+            if len(stack) == 0:
+                stack.append((level, root))
+            # 深いレベルの箇条書きを閉じる
+            while len(stack) > 1 and stack[-1][0] > level:
+                stack.pop()
+            top_level, top_list = stack[-1]
+            if level > top_level:
+                # 直前の項目の下に、1段深い箇条書きを作る
+                sub_list = pf.BulletList()
+                top_list.content[-1].content.append(sub_list)
+                stack.append((level, sub_list))
+                top_list = sub_list
+            top_list.content.append(item)
+        return root
+
+    def _make_entry(self, text: str, identifier: str, enable_link: bool) -> pf.Plain:
+        """一覧の項目を作成する(リンクを張る場合は、IDへのリンクにする)"""
+        if not enable_link or not identifier:
+            return pf.Plain(pf.Str(text))
+        link = pf.Link(pf.Str(text), url=f"#{identifier}")
+        plain = pf.Plain(link)
+        if self.format_tweaks is not None:
+            self.format_tweaks.add_link(plain, link)
+        return plain
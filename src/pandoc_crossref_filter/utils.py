@@ -1,3 +1,4 @@
+import json
 import logging
 import sys
 
@@ -76,4 +77,43 @@ def split_key_title(key: str) -> tuple[str, bool]:
     if len(key_parts) == 2:
         return key_parts[0], True
     else:
-        return key, False
\ No newline at end of file
+        return key, False
+
+
+def load_doc(json_text: str, output_format: str) -> pf.Doc:
+    """pandocのJSONからドキュメントを生成する
+
+    pf.load()は出力フォーマットをコマンドライン引数から取得するため、
+    フィルター以外から呼び出す場合はこちらを使う
+
+    Args:
+        json_text (str):
+            pandocのJSON
+        output_format (str):
+            出力フォーマット
+
+    Returns:
+        pf.Doc: ドキュメント
+    """
+    doc = json.loads(json_text, object_hook=pf.elements.from_json)
+    doc.format = output_format
+    return doc
+
+
+def dump_doc(doc: pf.Doc) -> str:
+    """ドキュメントをpandocのJSONに変換する
+
+    Args:
+        doc (pf.Doc):
+            ドキュメント
+
+    Returns:
+        str: pandocのJSON
+    """
+    return json.dumps(
+        doc,
+        default=lambda elem: elem.to_json(),
+        check_circular=False,
+        separators=(",", ":"),
+        ensure_ascii=False
+    )
@@ -0,0 +1,191 @@
+import os
+import time
+from typing import List, Dict, Set, Sequence, Tuple
+
+import panflute as pf
+
+from . import utils
+from . import api
+from .batch import collect_sources, get_input_root, get_output_path
+from .pandoc_process import read_json, write_output, PandocError
+
+
+logger = utils.get_logger()
+
+
+class Watcher():
+    def __init__(self,
+                 list_pattern: Sequence[str],
+                 to_format: str,
+                 output_dir: str | None = None,
+                 from_format: str | None = None,
+                 extra_args: Sequence[str] = (),
+                 interval: float = 0.5,
+                 debounce: float = 0.3) -> None:
+        """入力ファイルを監視し、変更があれば再変換する
+
+        - インタプリタ、Krokiクライアント(コネクションプールと画像のキャッシュ)を
+          再変換の間で使いまわす
+        - 入力ファイルごとに、フィルター適用後のJSONを保持しておき、
+          画像などの依存ファイルだけが変更された場合は、pandocでの出力だけをやり直す
+        - 参照の管理クラス(番号付け)は再変換のたびに作り直す
+          (番号はドキュメント全体で決まるので、入力ファイルが変更されれば全体を数え直す必要がある)
+        - 1つの入力ファイルの変換に失敗しても、ログを出力して監視を続ける
+
+        Args:
+            list_pattern (list(str)):
+                入力ファイルのパスまたはglobのパターン
+            to_format (str):
+                出力フォーマット
+            output_dir (str | None):
+                出力先のディレクトリ。Noneなら入力ファイルと同じディレクトリ
+            from_format (str | None):
+                入力フォーマット。Noneの場合はpandocに推定させる
+            extra_args (list(str)):
+                出力時にpandocに渡す追加の引数
+            interval (float):
+                ファイルの更新を確認する間隔(秒)
+            debounce (float):
+                連続した保存をまとめるために、最後の更新から待つ時間(秒)
+        """
+        self.list_pattern: List[str] = list(list_pattern)
+        self.to_format: str = to_format
+        self.output_dir: str | None = output_dir
+        self.from_format: str | None = from_format
+        self.extra_args: Tuple[str, ...] = tuple(extra_args)
+        self.interval: float = interval
+        self.debounce: float = debounce
+
+        # 入力ファイルごとの、フィルター適用後のJSON
+        self.dict_filtered_json: Dict[str, str] = {}
+        # 入力ファイルごとの、依存ファイル(画像)の一覧
+        self.dict_dependency: Dict[str, Set[str]] = {}
+        # ファイルごとの更新日時とサイズ
+        self.dict_stat: Dict[str, Tuple[int, int] | None] = {}
+
+    def run(self) -> None:
+        """監視を開始する(Ctrl+Cで終了する)"""
+        if self.output_dir is not None:
+            os.makedirs(self.output_dir, exist_ok=True)
+
+        for source in collect_sources(self.list_pattern):
+            self._rebuild(source, {source})
+        self._update_stats()
+
+        try:
+            while True:
+                time.sleep(self.interval)
+                set_changed = self._wait_for_changes()
+                if len(set_changed) > 0:
+                    self._rebuild_affected(set_changed)
+        except KeyboardInterrupt:
+            pass
+
+    def _wait_for_changes(self) -> Set[str]:
+        """更新されたファイルを取得する
+
+        更新があった場合は、更新が止まるまで待ってから返す(デバウンス)
+        """
+        set_changed = self._update_stats()
+        if len(set_changed) == 0:
+            return set_changed
+
+        while True:
+            time.sleep(self.debounce)
+            set_changed_more = self._update_stats()
+            if len(set_changed_more) == 0:
+                return set_changed
+            set_changed |= set_changed_more
+
+    def _update_stats(self) -> Set[str]:
+        """監視対象のファイルの更新日時を更新し、更新されたファイルを返す"""
+        set_path = set(collect_sources(self.list_pattern))
+        for set_dependency in self.dict_dependency.values():
+            set_path |= set_dependency
+
+        set_changed = set()
+        for path in set_path:
+            stat = self._get_stat(path)
+            if self.dict_stat.get(path, None) != stat:
+                set_changed.add(path)
+            self.dict_stat[path] = stat
+        return set_changed
+
+    @staticmethod
+    def _get_stat(path: str) -> Tuple[int, int] | None:
+        """ファイルの更新日時とサイズを取得する"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _rebuild_affected(self, set_changed: Set[str]) -> None:
+        """更新されたファイルの影響を受ける出力だけを再変換する
+
+        Args:
+            set_changed (set(str)):
+                更新されたファイル
+        """
+        for source in collect_sources(self.list_pattern):
+            if source in set_changed or \
+               len(self.dict_dependency.get(source, set()) & set_changed) > 0:
+                self._rebuild(source, set_changed)
+
+    def _rebuild(self, source: str, set_changed: Set[str]) -> None:
+        """1つの入力ファイルを再変換する
+
+        Args:
+            source (str):
+                入力ファイルのパス
+            set_changed (set(str)):
+                更新されたファイル
+        """
+        start = time.perf_counter()
+        output = get_output_path(source, self.to_format, self.output_dir,
+                                 get_input_root(collect_sources(self.list_pattern)))
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+            # 入力ファイル自体が更新されていなければ、フィルター適用後のJSONを使いまわす
+            if source in set_changed or source not in self.dict_filtered_json:
+                self._apply_filter(source)
+            write_output(self.dict_filtered_json[source], self.to_format, output, self.extra_args)
+        except (PandocError, api.ConvertError) as e:
+            # 変換に失敗しても監視は続ける
+            self.dict_filtered_json.pop(source, None)
+            logger.error(f"Failed to convert {source}: {e}")
+            return
+        except Exception:
+            # 想定していないエラー(壊れた入力ファイルなど)でも、他の入力ファイルの監視は続ける
+            self.dict_filtered_json.pop(source, None)
+            logger.exception(f"Failed to convert {source}.")
+            return
+
+        list_changed = sorted(set_changed & ({source} | self.dict_dependency[source]))
+        print(f"Rebuilt {source} -> {output} in {time.perf_counter() - start:.3f}s "
+              f"(changed: {', '.join(list_changed)})")
+
+    def _apply_filter(self, source: str) -> None:
+        """入力ファイルを読み込んでフィルターを適用し、結果を保持する"""
+        doc = utils.load_doc(read_json(source, from_format=self.from_format), self.to_format)
+        list_diagram = api.apply_filter(doc)
+        for diagram in list_diagram:
+            if diagram["error"] is not None:
+                logger.error(diagram["error"])
+
+        self.dict_filtered_json[source] = utils.dump_doc(doc)
+        # フィルターが出力した画像は、依存ファイルから除く(自分の出力で再変換しないようにする)
+        self.dict_dependency[source] = \
+            self._collect_image_paths(doc) - set(doc.code_block_ref.get_filenames())
+
+    @staticmethod
+    def _collect_image_paths(doc: pf.Doc) -> Set[str]:
+        """ドキュメントが参照している、ローカルの画像ファイルの一覧を取得する"""
+        set_path = set()
+
+        def collect(elem, doc):
+            if isinstance(elem, pf.Image) and os.path.isfile(elem.url):
+                set_path.add(elem.url)
+
+        doc.walk(collect)
+        return set_path
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+import panflute as pf
+
+from pandoc_crossref_filter import utils
+from pandoc_crossref_filter.pandoc_crossref_filter import action, prepare, resolve_references
+
+
+def cite(key):
+    return pf.Cite(pf.Str(f"[@{key}]"), citations=[pf.Citation(key)])
+
+
+def make_section(i, num_section):
+    """前方参照と後方参照を含む、1つのセクションのブロックを作成する"""
+    next_section = (i + 1) % num_section
+    return [
+        pf.Header(pf.Str(f"Section{i}"), level=i % 2 + 1, identifier=f"sec:s{i}"),
+        pf.Para(pf.Str("see"), pf.Space, cite(f"sec:s{i}"), pf.Space,
+                cite(f"fig:f{next_section}"), pf.Space, cite(f"sec:s{next_section}+title")),
+        pf.Figure(
+            pf.Plain(pf.Image(pf.Str(f"Figure{i}"), url="image.png")),
+            caption=pf.Caption(pf.Plain(pf.Str(f"Figure{i}"))),
+            identifier=f"fig:f{i}"),
+        pf.CodeBlock(f"# [@sec:s{i}] and [@fig:f{next_section}]", classes=["python"]),
+    ]
+
+
+@pytest.fixture
+def make_json():
+    """セクションの数を指定して、pandocのJSONを作成する関数"""
+    def make(num_section):
+        list_block = []
+        for i in range(num_section):
+            list_block.extend(make_section(i, num_section))
+        return json.dumps(pf.Doc(*list_block, format="html").to_json())
+    return make
+
+
+@pytest.fixture
+def run_filter():
+    """pandocのJSONにフィルターを適用して、フィルター適用後のJSONとドキュメントを返す関数"""
+    def run(json_text, output_format="html"):
+        doc = utils.load_doc(json_text, output_format)
+        pf.run_filter(action, prepare=prepare, finalize=resolve_references, doc=doc)
+        return utils.dump_doc(doc), doc
+    return run
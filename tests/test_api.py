@@ -0,0 +1,55 @@
+import json
+
+import pytest
+import panflute as pf
+
+from pandoc_crossref_filter import api, utils
+
+
+def cite(key):
+    return pf.Cite(pf.Str(f"[@{key}]"), citations=[pf.Citation(key)])
+
+
+def load(*list_block):
+    return utils.load_doc(json.dumps(pf.Doc(*list_block, format="html").to_json()), "html")
+
+
+def test_apply_filter_returns_diagram_results(make_json):
+    doc = utils.load_doc(make_json(2), "html")
+    assert api.apply_filter(doc) == []
+    assert not doc.diagnostics.has_errors()
+
+
+def test_apply_filter_raises_convert_error_with_all_errors():
+    doc = load(
+        pf.Header(pf.Str("A"), level=1, identifier="sec:a"),
+        pf.Para(cite("sec:missing1")),
+        pf.Para(cite("fig:missing2"), pf.Space, cite("sec:a")))
+
+    with pytest.raises(api.ConvertError) as exc_info:
+        api.apply_filter(doc)
+
+    # 最初のエラーで終了せずに、すべてのエラーを集めて1回だけ例外にする
+    list_error = exc_info.value.list_error
+    assert [error["code"] for error in list_error] == ["missing_reference", "missing_reference"]
+    assert "sec:missing1" in str(exc_info.value)
+    assert "fig:missing2" in str(exc_info.value)
+
+
+def test_apply_filter_reports_duplicate_identifiers():
+    doc = load(
+        pf.Header(pf.Str("A"), level=1, identifier="sec:a"),
+        pf.Header(pf.Str("B"), level=1, identifier="sec:a"))
+
+    with pytest.raises(api.ConvertError) as exc_info:
+        api.apply_filter(doc)
+    assert [error["code"] for error in exc_info.value.list_error] == ["duplicate_identifier"]
+
+
+def test_update_metadata_merges_dicts():
+    doc = load(pf.Para(pf.Str("text")))
+    doc.metadata["pandoc_crossref_filter"] = {"section": {"auto_section": False, "separator": "."}}
+
+    api.update_metadata(doc, {"pandoc_crossref_filter": {"section": {"auto_section": True}}})
+    assert doc.get_metadata("pandoc_crossref_filter") == {
+        "section": {"auto_section": True, "separator": "."}}
@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+from pandoc_crossref_filter import api, batch
+from pandoc_crossref_filter.pandoc_process import PandocError
+
+
+def test_output_paths_keep_the_directory_tree(tmp_path):
+    list_source = [str(tmp_path / "docs" / "a" / "index.md"), str(tmp_path / "docs" / "b" / "index.md")]
+    output_dir = str(tmp_path / "out")
+    assert batch.get_output_paths(list_source, "docx", output_dir) == [
+        os.path.join(output_dir, "a", "index.docx"), os.path.join(output_dir, "b", "index.docx")]
+
+
+def test_output_paths_next_to_the_inputs(tmp_path):
+    list_source = [str(tmp_path / "a.md"), str(tmp_path / "b.html")]
+    assert batch.get_output_paths(list_source, "html", None) == [
+        str(tmp_path / "a.html"), str(tmp_path / "b.out.html")]
+
+
+def test_duplicate_outputs_are_rejected_before_converting(tmp_path, monkeypatch):
+    list_source = [str(tmp_path / "index.md"), str(tmp_path / "index.markdown")]
+    monkeypatch.setattr(batch, "ProcessPoolExecutor", None)
+    with pytest.raises(batch.DuplicateOutputError) as exc_info:
+        batch.run_batch(list_source, "docx", output_dir=str(tmp_path / "out"))
+    assert "index.md, " in str(exc_info.value)
+    assert not (tmp_path / "out").exists()
+
+
+@pytest.mark.parametrize("exception", [
+    PandocError("pandoc failed"),
+    api.ConvertError("No such reference: 'sec:missing'."),
+    ValueError("broken document"),
+])
+def test_per_file_errors_are_recorded(monkeypatch, exception):
+    def convert_file(*args, **kwargs):
+        raise exception
+
+    monkeypatch.setattr(api, "convert_file", convert_file)
+    result = batch.convert_file("a.md", "a.docx", "docx")
+    assert result["source"] == "a.md"
+    assert result["output"] == "a.docx"
+    assert str(exception) in result["error"]
+
+
+def test_collect_sources_removes_duplicates(tmp_path):
+    for name in ("b.md", "a.md"):
+        (tmp_path / name).write_text("text")
+    pattern = str(tmp_path / "*.md")
+    assert batch.collect_sources([str(tmp_path / "b.md"), pattern]) == [
+        str(tmp_path / "b.md"), str(tmp_path / "a.md")]
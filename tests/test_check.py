@@ -0,0 +1,44 @@
+import json
+
+import panflute as pf
+
+from pandoc_crossref_filter import check
+from pandoc_crossref_filter.pandoc_process import PandocError
+
+
+def cite(key):
+    return pf.Cite(pf.Str(f"[@{key}]"), citations=[pf.Citation(key)])
+
+
+def test_check_json_reports_all_errors(make_json):
+    data = json.loads(make_json(2))
+    data["blocks"].extend(block.to_json() for block in [
+        pf.Para(cite("sec:missing")),
+        pf.Header(pf.Str("Again"), level=1, identifier="sec:s0")])
+
+    report = check.check_json(json.dumps(data))
+
+    assert report["identifiers"] == {"section": 2, "figure": 2}
+    assert report["references"] == {"backward": 4, "forward": 3, "code_block": 4}
+    assert report["diagrams"] == 0
+    # エラーは最初の1つで終了せずに、ブロックの番号と直前のヘッダーとともにすべて報告する
+    assert report["error_count"] == 2
+    assert report["errors"] == [
+        {"code": "missing_reference", "message": "No such reference: 'sec:missing'.",
+         "block": 9, "header": "Section1"},
+        {"code": "duplicate_identifier", "message": "Duplicate identifier: 'sec:s0'",
+         "block": 10, "header": "Section1"},
+    ]
+
+
+def test_check_file_reports_pandoc_errors(monkeypatch):
+    def read_json(source, from_format=None):
+        raise PandocError("pandoc failed")
+
+    monkeypatch.setattr(check, "read_json", read_json)
+    result = check.check_file("missing.md")
+
+    assert result["source"] == "missing.md"
+    assert result["error_count"] == 1
+    assert result["errors"] == [
+        {"code": "pandoc", "message": "pandoc failed", "block": None, "header": None}]
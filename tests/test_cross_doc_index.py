@@ -0,0 +1,59 @@
+import json
+
+import panflute as pf
+
+from pandoc_crossref_filter import prescan
+from pandoc_crossref_filter.cross_doc_index import CrossDocIndex
+from pandoc_crossref_filter.pandoc_crossref_filter import CONFIG_ROOT
+
+
+def cite(key):
+    return pf.Cite(pf.Str(f"[@{key}]"), citations=[pf.Citation(key)])
+
+
+def make_figure(identifier, title):
+    return pf.Figure(
+        pf.Plain(pf.Image(pf.Str(title), url="image.png")),
+        caption=pf.Caption(pf.Plain(pf.Str(title))),
+        identifier=identifier)
+
+
+def make_chapters():
+    """2つの章のpandocのJSONを作成する(2章目から1章目を参照する)"""
+    chapter1 = pf.Doc(
+        pf.Header(pf.Str("Intro"), level=1, identifier="sec:intro"),
+        make_figure("fig:a", "First"))
+    chapter2 = pf.Doc(
+        pf.Header(pf.Str("Usage"), level=1, identifier="sec:usage"),
+        pf.Para(cite("sec:intro"), pf.Space, cite("fig:a"), pf.Space, cite("fig:b")),
+        make_figure("fig:b", "Second"))
+    return [json.dumps(doc.to_json()) for doc in (chapter1, chapter2)]
+
+
+def test_chapters_continue_numbering_through_the_index(tmp_path, monkeypatch, run_filter):
+    list_source = [str(tmp_path / "ch1.md"), str(tmp_path / "ch2.md")]
+    dict_json = dict(zip(list_source, make_chapters()))
+    monkeypatch.setattr(prescan, "read_json", lambda source, from_format=None: dict_json[source])
+    index_path = str(tmp_path / "index.db")
+
+    prescan.build_index(index_path, list_source)
+
+    # インデックスに保存した参照と章の始まりの状態を読み込める
+    index = CrossDocIndex(index_path)
+    try:
+        assert index.get_reference("fig:a") == ("1", "First")
+        assert index.get_reference("fig:missing") is None
+        assert index.get_chapter_state(list_source[0]) == {}
+        assert index.get_chapter_state(list_source[1])["section"] != []
+    finally:
+        index.close()
+
+    # 2章目だけを変換しても、1章目の続きから番号を付け、1章目の参照を解決する
+    data = json.loads(dict_json[list_source[1]])
+    data["meta"] = pf.Doc(metadata={CONFIG_ROOT: {
+        "index": {"path": index_path, "chapter": list_source[1]}}}).to_json()["meta"]
+    _, doc = run_filter(json.dumps(data))
+
+    assert pf.stringify(doc.content[1]).strip() == "第1章 [図1] [図2]"
+    assert doc.reference_registry.records["sec:usage"].number == "2"
+    assert doc.diagnostics.list_error == []
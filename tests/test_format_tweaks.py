@@ -0,0 +1,45 @@
+import json
+
+import pytest
+import panflute as pf
+
+from pandoc_crossref_filter import api, utils
+from pandoc_crossref_filter.format_tweaks import FormatTweaks, sort_formats
+
+
+@pytest.fixture
+def json_text(make_json):
+    """参照と、幅の指定がある画像を含むpandocのJSON"""
+    data = json.loads(make_json(3))
+    figure = pf.Figure(
+        pf.Plain(pf.Image(pf.Str("Wide"), url="wide.png", attributes={"width": "50%"})),
+        caption=pf.Caption(pf.Plain(pf.Str("Wide"))),
+        identifier="fig:wide")
+    data["blocks"].append(figure.to_json())
+    return json.dumps(data)
+
+
+def test_sort_formats():
+    assert sort_formats(["gfm", "html", "docx"]) == ["docx", "html", "gfm"]
+
+
+def test_apply_matches_a_direct_conversion(json_text, run_filter):
+    doc = utils.load_doc(json_text, "docx")
+    format_tweaks = FormatTweaks()
+    api.apply_filter(doc, format_tweaks)
+
+    # 1回のフィルター適用の結果を書き換えても、それぞれのフォーマットで変換した結果と同じになる
+    for output_format in ["docx", "html", "gfm"]:
+        format_tweaks.apply(output_format)
+        expected, _ = run_filter(json_text, output_format)
+        assert utils.dump_doc(doc) == expected, output_format
+
+
+def test_removed_links_cannot_be_restored(json_text):
+    doc = utils.load_doc(json_text, "docx")
+    format_tweaks = FormatTweaks()
+    api.apply_filter(doc, format_tweaks)
+    format_tweaks.apply("html")
+
+    with pytest.raises(ValueError):
+        format_tweaks.apply("docx")
@@ -0,0 +1,29 @@
+import panflute as pf
+
+from pandoc_crossref_filter.line_break import normalize_line_breaks
+
+
+def test_each_line_break_has_its_own_parent():
+    para = pf.Para(pf.Str("a"), pf.SoftBreak, pf.Str("b"))
+    cell_text = pf.Plain(pf.Str("c"), pf.RawInline("<br>", format="html"), pf.Str("d"))
+    table = pf.Table(
+        pf.TableBody(pf.TableRow(pf.TableCell(cell_text))),
+        colspec=[("AlignDefault", "ColWidthDefault")])
+    doc = pf.Doc(para, table)
+
+    normalize_line_breaks(doc)
+
+    line_break1 = para.content.list[1]
+    line_break2 = cell_text.content.list[1]
+    assert type(line_break1) is pf.LineBreak and type(line_break2) is pf.LineBreak
+    assert line_break1 is not line_break2
+    assert line_break1.parent is para and line_break1.index == 1
+    assert line_break2.parent is cell_text and line_break2.index == 1
+    assert line_break1.location == para.content.location
+    assert line_break2.location == cell_text.content.location
+
+
+def test_other_raw_inlines_are_kept():
+    para = pf.Para(pf.Str("a"), pf.RawInline("<br>", format="latex"), pf.RawInline("<hr>", format="html"))
+    normalize_line_breaks(pf.Doc(para))
+    assert [type(item) for item in para.content.list] == [pf.Str, pf.RawInline, pf.RawInline]
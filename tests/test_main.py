@@ -0,0 +1,40 @@
+import pytest
+
+from pandoc_crossref_filter import main
+from pandoc_crossref_filter.config import STREAMING_ENV, PARALLEL_JOBS_ENV, RESULT_CACHE_DIR_ENV
+
+
+@pytest.fixture(autouse=True)
+def clear_env(monkeypatch):
+    for name in (STREAMING_ENV, PARALLEL_JOBS_ENV, RESULT_CACHE_DIR_ENV):
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_conversion_mode_precedence(monkeypatch, caplog):
+    assert main.get_conversion_mode() == "normal"
+
+    monkeypatch.setenv(RESULT_CACHE_DIR_ENV, "cache")
+    assert main.get_conversion_mode() == "cache"
+
+    monkeypatch.setenv(PARALLEL_JOBS_ENV, "2")
+    assert main.get_conversion_mode() == "parallel"
+    assert f"{RESULT_CACHE_DIR_ENV} is ignored because {PARALLEL_JOBS_ENV} is set." in caplog.text
+
+    caplog.clear()
+    monkeypatch.setenv(STREAMING_ENV, "1")
+    assert main.get_conversion_mode() == "streaming"
+    assert f"{PARALLEL_JOBS_ENV} is ignored because {STREAMING_ENV} is set." in caplog.text
+    assert f"{RESULT_CACHE_DIR_ENV} is ignored because {STREAMING_ENV} is set." in caplog.text
+
+
+def test_parallel_jobs(monkeypatch):
+    monkeypatch.setenv(PARALLEL_JOBS_ENV, "3")
+    assert main.get_parallel_jobs() == 3
+
+
+@pytest.mark.parametrize("value", ["", "0", "-1", "auto"])
+def test_invalid_parallel_jobs_exit(monkeypatch, value):
+    monkeypatch.setenv(PARALLEL_JOBS_ENV, value)
+    assert main.get_conversion_mode() == "parallel"
+    with pytest.raises(SystemExit):
+        main.get_parallel_jobs()
@@ -0,0 +1,122 @@
+import json
+
+import pytest
+
+from pandoc_crossref_filter import kroki, metrics, profiler
+
+
+def make_stats(requests=0, errors=0, memory_cache_hits=0, latencies=()):
+    return {
+        "requests": requests,
+        "errors": errors,
+        "memory_cache_hits": memory_cache_hits,
+        "file_cache_hits": 0,
+        "latencies": list(latencies)
+    }
+
+
+class FakeClient():
+    """統計だけを返すKrokiクライアント"""
+
+    def __init__(self):
+        self.stats = make_stats()
+
+    def get_stats(self):
+        return dict(self.stats, latencies=list(self.stats["latencies"]))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    fake_client = FakeClient()
+    monkeypatch.setattr(kroki, "get_client", lambda: fake_client)
+    monkeypatch.setattr(metrics, "_run_metrics", None)
+    monkeypatch.setattr(profiler, "_profiler", profiler.NullProfiler())
+    return fake_client
+
+
+def test_percentiles_use_nearest_rank():
+    values = [float(v) for v in range(100, 0, -1)]
+    assert metrics.get_percentiles(values) == {"p50": 50.0, "p90": 90.0, "p99": 99.0, "max": 100.0}
+    assert metrics.get_percentiles([0.5]) == {"p50": 0.5, "p90": 0.5, "p99": 0.5, "max": 0.5}
+    assert metrics.get_percentiles([]) == {"p50": None, "p90": None, "p99": None, "max": None}
+
+
+def test_kroki_delta_keeps_only_new_latencies():
+    before = make_stats(requests=2, latencies=[9.0, 9.0])
+    after = make_stats(requests=5, errors=1, latencies=[9.0, 9.0, 0.1, 0.2, 0.3])
+    delta = metrics.get_kroki_delta(before, after)
+    assert delta == make_stats(requests=3, errors=1, latencies=[0.1, 0.2, 0.3])
+
+
+def test_add_kroki_stats_and_counts():
+    total = metrics.add_kroki_stats(make_stats(1, latencies=[0.1]), make_stats(2, latencies=[0.2, 0.3]))
+    assert total == make_stats(3, latencies=[0.1, 0.2, 0.3])
+    assert metrics.add_counts({"headers": 1}, {"headers": 2, "tables": 1}) == {"headers": 3, "tables": 1}
+
+
+def test_metrics_of_a_document(client, make_json, run_filter, tmp_path):
+    client.stats = make_stats(requests=4, latencies=[1.0] * 4)
+    run_metrics = metrics.RunMetrics(str(tmp_path / "metrics.json"))
+    _, doc = run_filter(make_json(3))
+    client.stats = make_stats(requests=6, memory_cache_hits=1, latencies=[1.0] * 4 + [0.1, 0.3])
+    run_metrics.set_doc(doc, "normal")
+    run_metrics.write()
+
+    with open(tmp_path / "metrics.json", encoding="utf-8") as f:
+        result = json.load(f)
+    assert result["mode"] == "normal"
+    assert result["format"] == "html"
+    assert result["counts"] == {
+        "headers": 3, "figures": 3, "tables": 0, "code_blocks": 3, "diagrams": 0,
+        "citations": 15, "forward_references": 4}
+    # 作成した時点からの差分だけを報告する
+    assert result["kroki"]["requests"] == 2
+    assert result["kroki"]["latency"] == {"p50": 0.1, "p90": 0.3, "p99": 0.3, "max": 0.3}
+    assert result["diagrams"]["rendered"] == 2
+    assert result["diagrams"]["cached"] == 1
+    assert result["error_count"] == 0
+
+
+def test_cache_hit_reports_no_work(client):
+    run_metrics = metrics.RunMetrics("unused.json")
+    run_metrics.set_result("cache_hit", "html", metrics.get_empty_counts(), [], 0)
+    result = run_metrics.get_metrics()
+    assert result["mode"] == "cache_hit"
+    assert set(result["counts"].values()) == {0}
+    assert result["diagrams"] == {"total": 0, "rendered": 0, "cached": 0, "failed": 0, "bytes_written": 0}
+    assert result["kroki"]["requests"] == 0
+
+
+def test_worker_process_stats_are_added(client):
+    run_metrics = metrics.RunMetrics("unused.json")
+    image_results = [{"error": None, "bytes": 10}, {"error": "failed", "bytes": 0}]
+    run_metrics.set_result("parallel", "html", {"diagrams": 2}, image_results, 1,
+                           make_stats(requests=3, errors=1, latencies=[0.1, 0.2, 0.3]))
+    result = run_metrics.get_metrics()
+    assert result["kroki"]["requests"] == 3
+    assert result["diagrams"] == {"total": 2, "rendered": 2, "cached": 0, "failed": 1, "bytes_written": 10}
+    assert result["error_count"] == 1
+
+
+def test_metrics_before_the_document_is_loaded(client):
+    result = metrics.RunMetrics("unused.json").get_metrics({"phases": [
+        {"name": "load", "group": None, "start": 0.0, "seconds": 0.5, "depth": 0},
+        {"name": "inner", "group": None, "start": 0.0, "seconds": 0.1, "depth": 1}]})
+    assert result["mode"] is None
+    assert result["counts"] == metrics.get_empty_counts()
+    assert result["phases"] == {"load": 0.5}
+
+
+def test_start_metrics_enables_a_quiet_profiler(client, tmp_path):
+    run_metrics = metrics.start_metrics(str(tmp_path / "metrics.json"))
+    assert metrics.start_metrics("other.json") is run_metrics
+    assert profiler.get_profiler().enabled
+    assert not profiler.get_profiler().summary
+
+    # メタデータでプロファイルを指定すると、有効になっているプロファイラーに設定を追加する
+    profiler.setup_from_metadata({"trace": True})
+    assert profiler.get_profiler().summary
+    assert profiler.get_profiler().trace
+
+    metrics.finish()
+    assert (tmp_path / "metrics.json").exists()
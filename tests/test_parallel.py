@@ -0,0 +1,70 @@
+import os
+import json
+import logging
+
+import pytest
+import panflute as pf
+
+from pandoc_crossref_filter import utils, parallel
+from pandoc_crossref_filter.parallel import DuplicateWarningFilter, convert_json_parallel
+
+
+def add_blocks(json_text, *list_block):
+    data = json.loads(json_text)
+    data["blocks"].extend(block.to_json() for block in list_block)
+    return json.dumps(data)
+
+
+@pytest.fixture
+def force_parallel(monkeypatch):
+    """CPU数やドキュメントの大きさに関わらず、チャンクに分けて変換する"""
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+    monkeypatch.setattr(parallel, "MIN_PARALLEL_BLOCKS", 0)
+
+
+def test_merged_chunks_match_normal_conversion(make_json, run_filter, force_parallel):
+    # 160ブロックなので、複数のチャンクに分かれる(チャンクをまたぐ前方参照と後方参照を含む)
+    json_text = make_json(40)
+    expected, _ = run_filter(json_text)
+    output, diagnostics = convert_json_parallel(json_text, "html", 2)
+    assert output == expected
+    assert diagnostics.list_error == []
+
+
+@pytest.mark.parametrize("cpu_count, jobs, min_blocks", [(2, 1, 0), (1, 4, 0), (2, 2, 1000)])
+def test_falls_back_to_normal_conversion(make_json, run_filter, monkeypatch, cpu_count, jobs, min_blocks):
+    # ワーカープロセスが1つ以下になる場合や、ブロックが少ない場合は、チャンクに分けない
+    monkeypatch.setattr(os, "cpu_count", lambda: cpu_count)
+    monkeypatch.setattr(parallel, "MIN_PARALLEL_BLOCKS", min_blocks)
+    monkeypatch.setattr(parallel, "_scan_chunks", None)
+    json_text = make_json(40)
+    expected, _ = run_filter(json_text)
+    output, diagnostics = convert_json_parallel(json_text, "html", jobs)
+    assert output == expected
+    assert diagnostics.list_error == []
+
+
+def test_errors_of_all_chunks_are_merged(make_json, run_filter, force_parallel):
+    json_text = add_blocks(
+        make_json(40),
+        pf.Para(pf.Cite(pf.Str("[@sec:missing]"), citations=[pf.Citation("sec:missing")])),
+        pf.Header(pf.Str("Again"), level=1, identifier="sec:s0"))
+    _, diagnostics = convert_json_parallel(json_text, "html", 2)
+    _, doc = run_filter(json_text)
+
+    # 参照IDの重複は、チャンクをまたいでいても事前スキャンで1回だけ報告する
+    # エラーの位置(ドキュメント全体でのブロックの番号と、直前のヘッダー)は通常の変換と同じ
+    assert diagnostics.get_sorted_errors() == doc.diagnostics.get_sorted_errors()
+    assert sorted(error["code"] for error in diagnostics.list_error) == [
+        "duplicate_identifier", "missing_reference"]
+
+
+def test_duplicate_warning_filter():
+    warning_filter = DuplicateWarningFilter({"already reported"})
+
+    def record(level, message):
+        return logging.LogRecord(utils.LOGGER_NAME, level, __file__, 0, message, None, None)
+
+    assert not warning_filter.filter(record(logging.WARNING, "already reported"))
+    assert warning_filter.filter(record(logging.WARNING, "new warning"))
+    assert warning_filter.filter(record(logging.ERROR, "already reported"))
@@ -0,0 +1,54 @@
+import panflute as pf
+
+from pandoc_crossref_filter.registry import ReferenceRegistry
+from pandoc_crossref_filter.section_cross_ref import SectionCrossRef
+from pandoc_crossref_filter.figure_cross_ref import FigureCrossRef
+
+
+def test_backward_and_forward_references(make_json, run_filter):
+    _, doc = run_filter(make_json(3))
+
+    # セクションごとに、自分自身への参照(後方)と、次のセクションへの参照(前方)が2つある
+    # (最後のセクションの次は最初のセクションなので、後方参照になる)
+    stats = doc.reference_registry.get_stats()
+    assert stats["backward"] == 3 + 2
+    assert stats["forward"] == 2 * 2
+    for cross_ref in doc.dict_cross_ref.values():
+        assert all(pending.target.text for pending in cross_ref.list_replace_target)
+
+
+def test_references_are_resolved_in_output(make_json, run_filter):
+    _, doc = run_filter(make_json(3))
+
+    list_text = [pf.stringify(block).strip() for block in doc.content if isinstance(block, pf.Para)]
+    # 前方参照(次のセクションの図とタイトル付きのセクション)も、後方参照と同じように書き換わる
+    assert list_text[0] == "see 第1章 [図2] 1.1節 Section1"
+    assert list_text[1] == "see 1.1節 [図3] 第2章 Section2"
+    assert list_text[2] == "see 第2章 [図1] 第1章 Section0"
+    assert len(doc.diagnostics.list_error) == 0
+
+
+def test_code_block_references_are_resolved(make_json, run_filter):
+    _, doc = run_filter(make_json(2))
+
+    list_code = [block.text for block in doc.content if isinstance(block, pf.CodeBlock)]
+    assert list_code == ["# 第1章 and [図2]", "# 1.1節 and [図1]"]
+
+
+def test_header_references_are_formatted_by_kind():
+    registry = ReferenceRegistry()
+    section_cross_ref = SectionCrossRef({}, True, registry)
+    figure_cross_ref = FigureCrossRef({}, True, False, registry)
+    registry.add("sec:a", "1", "Intro")
+
+    # セクションはヘッダー内ではリンクを張らず、番号だけにする
+    header_ref = section_cross_ref.add_reference("sec:a", True)
+    assert type(header_ref) is pf.Str and header_ref.text == "1"
+    assert pf.stringify(section_cross_ref.add_reference("sec:a+title", False)) == "第1章 Intro"
+
+    # 図はヘッダー内でも、通常の参照と同じ文字列とリンクにする
+    forward_ref = figure_cross_ref.add_reference("fig:b", True)
+    registry.add("fig:b", "2", "Chart")
+    figure_cross_ref.replace_reference()
+    assert type(forward_ref) is pf.Link and forward_ref.url == "#fig:b"
+    assert pf.stringify(forward_ref) == "[図2]"
@@ -0,0 +1,67 @@
+from pandoc_crossref_filter.registry import ReferenceRegistry
+from pandoc_crossref_filter.diagnostics import MISSING_REFERENCE_TEXT
+
+
+class FakeIndex():
+    """他のドキュメントのインデックス(CrossDocIndex.get_reference()だけを持つ)"""
+
+    def __init__(self, dict_ref):
+        self.dict_ref = dict_ref
+        self.num_call = 0
+
+    def get_reference(self, identifier):
+        self.num_call += 1
+        return self.dict_ref.get(identifier)
+
+
+def test_add_keeps_first_record():
+    registry = ReferenceRegistry()
+    assert registry.add("fig:a", "1", "First")
+    assert not registry.add("fig:a", "2", "Second")
+    record = registry.get("fig:a")
+    assert (record.number, record.title, record.kind) == ("1", "First", "figure")
+
+
+def test_get_falls_back_to_cross_doc_index():
+    registry = ReferenceRegistry()
+    registry.cross_doc_index = FakeIndex({"sec:other": ("3.1", "Other")})
+
+    assert not registry.has("sec:other")
+    record = registry.get("sec:other")
+    assert (record.number, record.title, record.kind) == ("3.1", "Other", "section")
+    # 読み込んだ参照は登録されるので、インデックスは1回だけ参照する
+    assert registry.has("sec:other")
+    registry.get("sec:other")
+    assert registry.cross_doc_index.num_call == 1
+    assert registry.get("sec:missing") is None
+
+
+def test_reference_string_is_memoized():
+    registry = ReferenceRegistry()
+    registry.add("tbl:a", "2", "Table")
+    list_call = []
+
+    def format_reference(key, add_title, is_header):
+        list_call.append(key)
+        return f"Table {registry.get(key).number}"
+
+    first = registry.get_reference_string("tbl:a", False, False, format_reference)
+    second = registry.get_reference_string("tbl:a", False, False, format_reference)
+    assert first == "Table 2"
+    assert first is second
+    assert list_call == ["tbl:a"]
+
+
+def test_missing_reference_is_recorded():
+    registry = ReferenceRegistry()
+    text = registry.get_reference_string(
+        "fig:missing", False, False, lambda *args: "unused", (3, "Section"))
+    assert text == MISSING_REFERENCE_TEXT
+    assert [error["code"] for error in registry.diagnostics.list_error] == ["missing_reference"]
+
+
+def test_items_are_in_registration_order():
+    registry = ReferenceRegistry()
+    for identifier in ("sec:b", "fig:a", "tbl:c"):
+        registry.add(identifier, "1", identifier)
+    assert [identifier for identifier, _ in registry.items()] == ["sec:b", "fig:a", "tbl:c"]
@@ -0,0 +1,80 @@
+import os
+import json
+
+import panflute as pf
+
+from pandoc_crossref_filter import main
+from pandoc_crossref_filter.result_cache import ResultCache
+
+
+def test_key_depends_on_input_and_format():
+    key = ResultCache.make_key(b"{}", "html")
+    assert key == ResultCache.make_key(b"{}", "html")
+    assert key != ResultCache.make_key(b"{}", "docx")
+    assert key != ResultCache.make_key(b"{ }", "html")
+
+
+def test_miss_then_hit(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), 1024 * 1024)
+    key = cache.make_key(b"input", "html")
+    assert cache.get(key) is None
+
+    cache.put(key, b"output\nwith newline", [])
+    assert cache.get(key) == b"output\nwith newline"
+
+
+def test_missing_image_is_a_miss(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), 1024 * 1024)
+    image = tmp_path / "diagram.svg"
+    image.write_text("<svg/>")
+    key = cache.make_key(b"input", "html")
+    cache.put(key, b"output", [str(image)])
+    assert cache.get(key) == b"output"
+
+    # 出力済みの画像が削除されていれば、再度フィルターを実行させる
+    image.unlink()
+    assert cache.get(key) is None
+
+
+def test_corrupted_entry_is_a_miss(tmp_path):
+    cache = ResultCache(str(tmp_path), 1024 * 1024)
+    key = cache.make_key(b"input", "html")
+    (tmp_path / (key + ".cache")).write_bytes(b"not json\noutput")
+    assert cache.get(key) is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    output = b"x" * 100
+    # 2つ分の大きさ(画像の一覧の行を含む)だけ保存できる
+    cache = ResultCache(str(tmp_path), 2 * (len(output) + 3))
+    key1, key2, key3 = (cache.make_key(name, "html") for name in (b"1", b"2", b"3"))
+
+    cache.put(key1, output, [])
+    cache.put(key2, output, [])
+    # 最終アクセス日時が古いものから削除するので、key2を一番古くしておく
+    os.utime(cache._get_path(key2), (0, 0))
+    assert cache.get(key1) == output
+    cache.put(key3, output, [])
+
+    assert cache.get(key1) == output
+    assert cache.get(key2) is None
+    assert cache.get(key3) == output
+
+
+def test_key_depends_on_dependency_files(tmp_path):
+    index = tmp_path / "book.db"
+    key_missing = ResultCache.make_key(b"{}", "html", [str(index)])
+    index.write_bytes(b"chapter 1")
+    key1 = ResultCache.make_key(b"{}", "html", [str(index)])
+    index.write_bytes(b"chapter 2")
+    key2 = ResultCache.make_key(b"{}", "html", [str(index)])
+    assert len({ResultCache.make_key(b"{}", "html"), key_missing, key1, key2}) == 4
+
+
+def test_index_path_is_a_dependency():
+    doc = pf.Doc(pf.Para(pf.Str("text")), metadata={
+        "pandoc_crossref_filter": {"index": {"path": "book.db", "chapter": "ch1.md"}}})
+    input_bytes = json.dumps(doc.to_json()).encode()
+    assert main.get_dependency_paths(input_bytes) == ["book.db"]
+    assert main.get_dependency_paths(json.dumps(pf.Doc().to_json()).encode()) == []
+    assert main.get_dependency_paths(b"not json") == []
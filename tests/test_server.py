@@ -0,0 +1,93 @@
+import json
+import base64
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+import panflute as pf
+
+from pandoc_crossref_filter import server
+from pandoc_crossref_filter.pandoc_crossref_filter import CONFIG_ROOT
+
+
+def test_restrict_config_keeps_only_allowed_keys(tmp_path):
+    doc = pf.Doc(metadata={CONFIG_ROOT: {
+        "figure": {"prefix": "Fig."},
+        "index": {"path": "/tmp/index.db"},
+        "profile": {"enable": True, "output": "/tmp/profile.json"},
+        "metrics": {"output": "/tmp/metrics.json"},
+        "code_block": {"save_dir": "/etc", "allow_path_in_filename": True},
+    }})
+    server.restrict_config(doc, str(tmp_path))
+
+    config = doc.get_metadata(CONFIG_ROOT)
+    assert config == {
+        "figure": {"prefix": "Fig."},
+        "code_block": {"save_dir": str(tmp_path), "allow_path_in_filename": False},
+    }
+
+
+def test_only_images_in_the_output_dir_are_embedded(tmp_path):
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    (output_dir / "diagram.svg").write_bytes(b"<svg/>")
+    (tmp_path / "secret.png").write_bytes(b"secret")
+    doc = pf.Doc(pf.Para(
+        pf.Image(url=str(output_dir / "diagram.svg")),
+        pf.Image(url=str(output_dir / ".." / "secret.png")),
+        pf.Image(url="/etc/passwd")))
+
+    server.embed_images(doc, str(output_dir))
+
+    list_url = [image.url for image in doc.content[0].content]
+    assert list_url[0] == "data:image/svg+xml;base64," + base64.b64encode(b"<svg/>").decode("ascii")
+    assert list_url[1:] == [str(output_dir / ".." / "secret.png"), "/etc/passwd"]
+
+
+def test_pandoc_always_runs_in_the_sandbox(monkeypatch):
+    list_args = []
+
+    def read_json(text, from_format, extra_args=()):
+        list_args.append(tuple(extra_args))
+        return json.dumps(pf.Doc(pf.Para(pf.Str(text))).to_json())
+
+    def write_output(json_text, to_format, extra_args=()):
+        list_args.append(tuple(extra_args))
+        return b"output"
+
+    monkeypatch.setattr(server, "read_json", read_json)
+    monkeypatch.setattr(server, "write_output", write_output)
+
+    output = server.ConversionService().convert("text", "html", {"sandbox": False})
+    assert output == b"output"
+    assert list_args == [("--sandbox",), ("--sandbox",)]
+
+
+@pytest.fixture
+def http_server():
+    """変換サービスのHTTPサーバーを起動して、URLを返す"""
+    httpd = server.ConversionHTTPServer(("127.0.0.1", 0), server.ConversionService())
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd, f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_unexpected_errors_return_500(http_server, monkeypatch):
+    httpd, url = http_server
+
+    def convert(*args, **kwargs):
+        raise RuntimeError("unexpected")
+
+    monkeypatch.setattr(httpd.service, "convert", convert)
+    request = urllib.request.Request(
+        f"{url}/convert", data=json.dumps({"markdown": "text", "to": "html"}).encode("utf-8"))
+    with pytest.raises(urllib.error.HTTPError) as exc_info:
+        urllib.request.urlopen(request, timeout=10)
+    assert exc_info.value.code == 500
+    assert json.loads(exc_info.value.read()) == {"error": "Internal server error."}
+
+    with urllib.request.urlopen(f"{url}/metrics", timeout=10) as response:
+        assert json.loads(response.read())["requests"] == {"error": 1}
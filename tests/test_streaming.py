@@ -0,0 +1,51 @@
+import io
+import json
+
+import pytest
+import panflute as pf
+
+from pandoc_crossref_filter.streaming import BlockStreamReader, run_streaming
+
+
+def run(json_text):
+    output = io.StringIO()
+    run_streaming(io.StringIO(json_text), output, "html")
+    return output.getvalue()
+
+
+def test_output_matches_normal_conversion(make_json, run_filter):
+    json_text = make_json(30)
+    expected, _ = run_filter(json_text)
+    assert run(json_text) == expected
+
+
+def test_toc_matches_normal_conversion(make_json, run_filter):
+    data = json.loads(make_json(5))
+    for key in ("toc", "lof"):
+        placeholder = pf.Para(pf.Cite(pf.Str(f"[@{key}]"), citations=[pf.Citation(key)]))
+        data["blocks"].insert(0, placeholder.to_json())
+    json_text = json.dumps(data)
+    expected, doc = run_filter(json_text)
+    assert [block.classes for block in doc.content[:2]] == [["lof"], ["toc"]]
+    assert run(json_text) == expected
+
+
+def test_missing_reference_exits():
+    doc = pf.Doc(pf.Para(pf.Cite(pf.Str("[@sec:missing]"), citations=[pf.Citation("sec:missing")])))
+    with pytest.raises(SystemExit):
+        run(json.dumps(doc.to_json()))
+
+
+def test_reader_yields_blocks_in_small_chunks(make_json):
+    json_text = make_json(3)
+    reader = BlockStreamReader(io.StringIO(json_text), chunk_size=7)
+    header = reader.read_header()
+    list_block = list(reader.iter_blocks())
+    assert "meta" in header
+    assert [block.to_json() for block in list_block] == json.loads(json_text)["blocks"]
+
+
+def test_meta_after_blocks_is_rejected():
+    json_text = '{"pandoc-api-version":[1,23,1],"blocks":[],"meta":{}}'
+    with pytest.raises(ValueError):
+        BlockStreamReader(io.StringIO(json_text)).read_header()
@@ -0,0 +1,42 @@
+import json
+
+import panflute as pf
+
+
+def make_table(*list_row):
+    """セルのブロックの一覧から表を作成する"""
+    return pf.Table(
+        pf.TableBody(*[pf.TableRow(*[pf.TableCell(*cell) for cell in row]) for row in list_row]),
+        colspec=[("AlignDefault", "ColWidthDefault")] * len(list_row[0]))
+
+
+def get_spans(table):
+    return [[(cell.colspan, cell.rowspan) for cell in row.content] for row in table.content[0].content]
+
+
+def test_grid_table_markers_are_merged(run_filter):
+    # グリッドテーブルのセルはParaになる
+    table = make_table(
+        [[pf.Para(pf.Str("a"))], [pf.Para(pf.Str("b"))], [pf.Para(pf.Str("c"))]],
+        [[pf.Para(pf.Str("d"))], [pf.Para(pf.Str("->"))], [pf.Para(pf.Str("〃"))]])
+    _, doc = run_filter(json.dumps(pf.Doc(table).to_json()))
+
+    assert get_spans(doc.content[0]) == [[(1, 1), (1, 1), (1, 2)], [(2, 1)]]
+
+
+def test_markers_split_into_several_inlines_are_merged(run_filter):
+    table = make_table(
+        [[pf.Plain(pf.Str("a"))], [pf.Plain(pf.Str("b"))], [pf.Plain(pf.Str("c"))]],
+        [[pf.Plain(pf.Str("d"))], [pf.Plain(pf.Str("-"), pf.Str(">"))], [pf.Plain(pf.Space, pf.Str("〃"))]])
+    _, doc = run_filter(json.dumps(pf.Doc(table).to_json()))
+
+    assert get_spans(doc.content[0]) == [[(1, 1), (1, 1), (1, 2)], [(2, 1)]]
+
+
+def test_cells_containing_a_marker_with_other_text_are_kept(run_filter):
+    table = make_table(
+        [[pf.Plain(pf.Str("a"))], [pf.Plain(pf.Str("b"))]],
+        [[pf.Para(pf.Str("x"), pf.Space, pf.Str("->"))], [pf.Para(pf.Str("->")), pf.Para(pf.Str("y"))]])
+    _, doc = run_filter(json.dumps(pf.Doc(table).to_json()))
+
+    assert get_spans(doc.content[0]) == [[(1, 1), (1, 1)], [(1, 1), (1, 1)]]
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+import panflute as pf
+
+
+def cite(key):
+    return pf.Cite(pf.Str(f"[@{key}]"), citations=[pf.Citation(key)])
+
+
+def make_json():
+    """目次、図目次、表目次の目印と、ヘッダー、図、表を含むpandocのJSONを作成する"""
+    table = pf.Table(
+        pf.TableBody(pf.TableRow(pf.TableCell(pf.Plain(pf.Str("x"))))),
+        colspec=[("AlignDefault", "ColWidthDefault")],
+        caption=pf.Caption(pf.Plain(pf.Str("Values"), pf.Space, pf.Str("{#tbl:values}"))))
+    return json.dumps(pf.Doc(
+        pf.Para(cite("toc")),
+        pf.Para(cite("lof")),
+        pf.Para(cite("lot")),
+        pf.Header(pf.Str("Intro"), level=1, identifier="sec:intro"),
+        pf.Header(pf.Str("Detail"), level=2, identifier="sec:detail"),
+        # toc_depth(デフォルトは3)より深いヘッダーは、目次に含めない
+        pf.Header(pf.Str("Deep"), level=4, identifier="sec:deep"),
+        pf.Figure(
+            pf.Plain(pf.Image(pf.Str("Chart"), url="chart.png")),
+            caption=pf.Caption(pf.Plain(pf.Str("Chart"))),
+            identifier="fig:chart"),
+        table,
+        pf.Header(pf.Str("Usage"), level=1, identifier="sec:usage")).to_json())
+
+
+def get_entries(bullet_list):
+    """箇条書きの項目を、(文字列, リンク先, 下の階層の項目)の一覧にする"""
+    list_entry = []
+    for item in bullet_list.content:
+        inline = item.content[0].content[0]
+        url = inline.url if isinstance(inline, pf.Link) else None
+        children = get_entries(item.content[1]) if len(item.content) > 1 else []
+        list_entry.append((pf.stringify(inline), url, children))
+    return list_entry
+
+
+@pytest.mark.parametrize("output_format, enable_link", [("html", False), ("docx", True)])
+def test_placeholders_are_expanded(run_filter, output_format, enable_link):
+    _, doc = run_filter(make_json(), output_format)
+    toc, lof, lot = doc.content[:3]
+
+    def link(identifier):
+        return f"#{identifier}" if enable_link else None
+
+    assert [type(toc), toc.classes] == [pf.Div, ["toc"]]
+    assert get_entries(toc.content[0]) == [
+        ("Intro", link("sec:intro"), [("Detail", link("sec:detail"), [])]),
+        ("Usage", link("sec:usage"), [])]
+    assert [type(lof), lof.classes] == [pf.Div, ["lof"]]
+    assert get_entries(lof.content[0]) == [("[図1] Chart", link("fig:chart"), [])]
+    assert [type(lot), lot.classes] == [pf.Div, ["lot"]]
+    assert get_entries(lot.content[0]) == [("[表1] Values", link("tbl:values"), [])]
+
+
+def test_placeholder_with_other_text_is_kept(run_filter):
+    data = json.loads(make_json())
+    data["blocks"][0] = pf.Para(pf.Str("see"), pf.Space, cite("toc")).to_json()
+    _, doc = run_filter(json.dumps(data))
+    assert type(doc.content[0]) is pf.Para
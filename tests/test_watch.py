@@ -0,0 +1,45 @@
+import pytest
+import panflute as pf
+
+from pandoc_crossref_filter import utils, watch
+
+
+@pytest.fixture
+def pandoc(monkeypatch):
+    """watchが使うpandocの呼び出しを置き換え、読み込む内容と出力した内容を返す"""
+    state = {"read": [], "written": {}}
+
+    def read_json(source, from_format=None):
+        result = state["read"].pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def write_output(json_text, to_format, output_path=None, extra_args=()):
+        state["written"][output_path] = json_text
+
+    monkeypatch.setattr(watch, "read_json", read_json)
+    monkeypatch.setattr(watch, "write_output", write_output)
+    return state
+
+
+def test_rebuild_continues_after_an_error(tmp_path, pandoc, make_json):
+    source = tmp_path / "index.md"
+    source.write_text("text")
+    output = str(tmp_path / "index.html")
+    watcher = watch.Watcher([str(source)], "html")
+
+    pandoc["read"].append(RuntimeError("broken input"))
+    watcher._rebuild(str(source), {str(source)})
+    assert pandoc["written"] == {}
+    assert str(source) not in watcher.dict_filtered_json
+
+    pandoc["read"].append(make_json(2))
+    watcher._rebuild(str(source), {str(source)})
+    doc = utils.load_doc(pandoc["written"][output], "html")
+    assert pf.stringify(doc.content[1]).strip() == "see 第1章 [図2] 1.1節 Section1"
+
+    # 入力ファイルが変更されていなければ、フィルター適用後のJSONを使いまわす
+    del pandoc["written"][output]
+    watcher._rebuild(str(source), set())
+    assert output in pandoc["written"]